@@ -0,0 +1,354 @@
+"""Benchmarks of the phases of a simulation, at several population sizes
+
+    python -m benchmarks.run run --sizes 1000 10000 --out results.json
+    python -m benchmarks.run compare results.json benchmarks/baseline.json
+
+The phases are the synthesis of the population (`populate`), the creation
+of the agents (`agents`), the steps of the simulation (`step`), the update
+of the mental health (`update`) and the writing of the results (`report`).
+The positive cases are a fixture and the hypotheses are read from the
+parameters of the repository, so the benchmarks run offline.
+
+Every size runs in a new process, twice: once to time the phases, and once
+with `tracemalloc` to measure the memory they allocate (tracing slows the
+phases down, so it is kept out of the timings).
+"""
+from comma.history import History
+from comma.metrics import peak_rss_mb
+from comma.model import Model
+from comma.population import Population
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import contextlib
+import json
+import multiprocessing
+import numpy as np
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+DIR_PARAMS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "parameters")
+PHASES = ["populate", "agents", "step", "update", "report"]
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+STEPS = 10
+
+# daily positive cases per 100,000 inhabitants, repeated for longer runs
+CASES_PER_100K = [35, 41, 38, 52, 47, 44, 39, 36, 48, 55]
+
+
+def new_cases(size: int, steps: int) -> np.ndarray:
+    """
+    Get the fixture of the number of new positive cases at every step
+
+    Args:
+        size (int): number of agents
+        steps (int): number of steps
+
+    Returns:
+        np.ndarray: number of new infected agents at every step, at least 1
+    """
+    per_100k = np.resize(CASES_PER_100K, steps)
+    return np.maximum(1, np.round(per_100k * size / 100_000)).astype(int)
+
+
+class PhaseTimer:
+    """
+    The PhaseTimer class accumulates the wall time of the phases of a
+    simulation, and with `trace_memory` the largest amount of memory
+    allocated during each phase (on top of what was allocated before).
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.peak_alloc = dict.fromkeys(PHASES, 0)
+        self.peak_rss = dict.fromkeys(PHASES, 0.0)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        yield
+        self.seconds[name] += time.perf_counter() - start
+        self.calls[name] += 1
+        if self.trace_memory:
+            allocated = tracemalloc.get_traced_memory()[1] - before
+            self.peak_alloc[name] = max(self.peak_alloc[name], allocated)
+        self.peak_rss[name] = peak_rss_mb()
+
+
+def simulate(
+    size: int,
+    steps: int = STEPS,
+    seed: int = 0,
+    engine: str = "vectorized",
+    output_format: str = "csv",
+    trace_memory: bool = False,
+) -> PhaseTimer:
+    """
+    Run a simulation phase by phase, as `Model.run` does, and time them
+
+    Args:
+        size (int): number of agents
+        steps (int): number of steps
+        seed (int): seed of the simulation
+        engine (str): "vectorized" or "object", see `Model.step_vectorized`
+        and `Model.step`
+        output_format (str): format of the results, see `Model.report`
+        trace_memory (bool): measure the memory allocated by every phase
+
+    Returns:
+        PhaseTimer: the measures of the phases
+    """
+    timer = PhaseTimer(trace_memory)
+    if trace_memory:
+        tracemalloc.start()
+    lockdown_policy = ["easy", "hard"] * (steps // 2) + ["easy"] * (steps % 2)
+    hypotheses = Model.read_hypotheses(DIR_PARAMS, lockdown_policy)
+    cases = new_cases(size, steps)
+
+    with timer.phase("populate"):
+        population = Population.populate(size, DIR_PARAMS, np.random.default_rng(seed))
+    with timer.phase("agents"):
+        model = Model(
+            size,
+            DIR_PARAMS,
+            seed=seed,
+            vectorized=engine == "vectorized",
+            population=population,
+        )
+        if not model.vectorized:
+            # the agents are created on first use, only `Model.step` uses them
+            model.agents
+    step_function = model.step_vectorized if model.vectorized else model.step
+
+    model.history = History(steps, size)
+    for step, lockdown in enumerate(lockdown_policy):
+        matrix, matrix_infected, action_effects = hypotheses[lockdown]
+        with timer.phase("step"):
+            step_function(matrix, action_effects, cases[step], matrix_infected)
+        with timer.phase("update"):
+            model.update(lockdown, step)
+        model.current_step += 1
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with timer.phase("report"):
+            model.report(
+                os.path.join(tmp_dir, f"results.{output_format}"), output_format
+            )
+    if trace_memory:
+        tracemalloc.stop()
+    return timer
+
+
+def _measure(task: dict) -> dict:
+    """
+    Measure the phases of a simulation, in a worker process
+
+    Args:
+        task (dict): arguments of `simulate`
+
+    Returns:
+        dict: the measures of every phase
+    """
+    # a small run first, so that the measures don't include the imports
+    simulate(min(task["size"], 100), steps=2, engine=task["engine"])
+    timer = simulate(**task)
+    return {
+        "seconds": timer.seconds,
+        "calls": timer.calls,
+        "peak_alloc": timer.peak_alloc,
+        "peak_rss": timer.peak_rss,
+    }
+
+
+def _in_new_process(task: dict) -> dict:
+    # a new interpreter for every measure, so they don't share memory or caches
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_measure, task).result()
+
+
+def run_benchmarks(
+    sizes: list = SIZES,
+    steps: int = STEPS,
+    seed: int = 0,
+    engine: str = "vectorized",
+    output_format: str = "csv",
+    trace_memory: bool = True,
+) -> dict:
+    """
+    Run the benchmarks of the phases of a simulation
+
+    Args:
+        sizes (list): numbers of agents
+        steps (int): number of steps of every simulation
+        seed (int): seed of the simulations
+        engine (str): "vectorized" or "object"
+        output_format (str): format of the results of the simulations
+        trace_memory (bool): measure the memory allocated by every phase
+
+    Returns:
+        dict: the settings of the benchmarks in `meta`, and in `results`
+        the measures of every size and phase: its wall time in seconds,
+        its number of calls, the number of agents (or agent-steps for
+        `step`, `update` and `report`) per second, the largest amount of memory it
+        allocated and the peak resident memory of the process at its end.
+    """
+    results = []
+    for size in sizes:
+        task = {
+            "size": size,
+            "steps": steps,
+            "seed": seed,
+            "engine": engine,
+            "output_format": output_format,
+        }
+        timing = _in_new_process(task)
+        memory = _in_new_process(dict(task, trace_memory=True)) if trace_memory else {}
+        rows = []
+        for phase in PHASES:
+            seconds = timing["seconds"][phase]
+            # agents, agent-steps for the phases of every step and the report
+            work = size * (steps if phase == "report" else timing["calls"][phase])
+            rows.append(
+                {
+                    "size": size,
+                    "phase": phase,
+                    "seconds": seconds,
+                    "calls": timing["calls"][phase],
+                    "agents_per_second": work / seconds if seconds > 0 else None,
+                    "peak_alloc_mb": (
+                        memory["peak_alloc"][phase] / (1 << 20) if memory else None
+                    ),
+                    "peak_rss_mb": timing["peak_rss"][phase],
+                }
+            )
+        print(f"{size} agents: " + format_phases(rows))
+        results += rows
+
+    meta = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "steps": steps,
+        "seed": seed,
+        "engine": engine,
+        "output_format": output_format,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    return {"meta": meta, "results": results}
+
+
+def format_phases(results: list) -> str:
+    # e.g. "populate 0.012s, agents 0.034s, ..."
+    return ", ".join(f"{r['phase']} {r['seconds']:.3f}s" for r in results)
+
+
+def compare(
+    results: dict, baseline: dict, tolerance: float = 0.25, min_seconds: float = 0.01
+) -> list:
+    """
+    Compare benchmark results with a baseline
+
+    Args:
+        results (dict): results of `run_benchmarks`
+        baseline (dict): results of `run_benchmarks`, e.g. on the main branch
+        tolerance (float): relative increase of time or memory
+        above which a phase is reported as a regression
+        min_seconds (float): increase of time below which the
+        differences are noise
+
+    Returns:
+        list: the regressions, as messages
+    """
+    reference = {(r["size"], r["phase"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        base = reference.get((result["size"], result["phase"]))
+        if base is None:
+            continue
+        label = f"{result['phase']} with {result['size']} agents"
+        ratio = result["seconds"] / base["seconds"] if base["seconds"] else 1.0
+        if ratio > 1 + tolerance and result["seconds"] - base["seconds"] > min_seconds:
+            regressions.append(
+                f"{label}: {result['seconds']:.3f}s, "
+                f"{ratio:.2f}x the baseline ({base['seconds']:.3f}s)"
+            )
+        if result["peak_alloc_mb"] is None or base["peak_alloc_mb"] is None:
+            continue
+        # below 1 MB, the differences are noise
+        increase = result["peak_alloc_mb"] - base["peak_alloc_mb"]
+        if increase > max(1.0, tolerance * base["peak_alloc_mb"]):
+            regressions.append(
+                f"{label}: {result['peak_alloc_mb']:.1f} MB allocated, "
+                f"{increase:+.1f} MB over the baseline"
+            )
+    return regressions
+
+
+def main(args: list = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run",
+        description="Benchmark the phases of a simulation",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    run_parser.add_argument("--steps", type=int, default=STEPS)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument(
+        "--engine", choices=["vectorized", "object"], default="vectorized"
+    )
+    run_parser.add_argument("--output-format", default="csv")
+    run_parser.add_argument(
+        "--no-memory", action="store_true", help="don't measure the memory"
+    )
+    run_parser.add_argument("--out", help="JSON file of the results")
+    run_parser.add_argument("--baseline", help="JSON file of results to compare with")
+    run_parser.add_argument("--tolerance", type=float, default=0.25)
+    compare_parser = commands.add_parser(
+        "compare", help="compare results with a baseline"
+    )
+    compare_parser.add_argument("results", help="JSON file of the results")
+    compare_parser.add_argument("baseline", help="JSON file of the baseline")
+    compare_parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(args)
+
+    if args.command == "run":
+        results = run_benchmarks(
+            args.sizes,
+            args.steps,
+            args.seed,
+            args.engine,
+            args.output_format,
+            trace_memory=not args.no_memory,
+        )
+        if args.out is not None:
+            with open(args.out, "w") as f:
+                json.dump(results, f, indent=2)
+    else:
+        with open(args.results) as f:
+            results = json.load(f)
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    if not regressions:
+        print("No regression")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""Aggregates of the state of the agents, computed as a simulation runs
+"""
+from comma.population import Population
+import numpy as np
+import pandas as pd
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def feature_groups(feature_names: list) -> dict:
+    """
+    Group the one-hot encoded features by variable, e.g. `gender_f` and
+    `gender_m` are the categories of `gender`
+
+    Args:
+        feature_names (list): names of the one-hot encoded features
+
+    Returns:
+        dict: for every variable, the list of (category, column index)
+    """
+    groups: dict = {}
+    for index, name in enumerate(feature_names):
+        if name == "baseline":
+            continue
+        variable, category = name.rsplit("_", 1)
+        # e.g. age_group__1
+        groups.setdefault(variable.rstrip("_"), []).append((category, index))
+    return groups
+
+
+class Aggregator:
+    """
+    The Aggregator class summarises the state of the agents at every
+    step of a simulation, for the whole population and for every
+    subgroup of the one-hot encoded features (age group, gender, ...):
+    the number of agents, the mean and quantiles of the cumulative mental
+    health, the prevalence of COVID-19 and the share of the agents that
+    took each action.
+
+    The subgroup of every agent in every variable is computed once, as
+    an integer code, so that the statistics of a step are grouped
+    reductions (`np.bincount`) over the codes. The covid status and the
+    actions of an agent are packed in the bits of one integer, so that
+    a single count of (subgroup, bits) pairs per variable gives the
+    prevalence and the share of every action. Only the aggregates are
+    kept: their size doesn't depend on the number of agents.
+    """
+
+    def __init__(self, population: Population, quantiles: tuple = QUANTILES):
+        self.quantiles = np.asarray(quantiles, dtype=np.float64)
+        self.actions = list(population.actions)
+        self.size = population.size
+
+        # subgroup 0 is the whole population, in row 0 of the codes.
+        # The agents without a category in a variable get the code
+        # `n_groups`, which is left out of the results.
+        self.group = ["all"]
+        self.category = ["all"]
+        rows = [np.zeros(self.size, dtype=np.int16)]
+        self._row_groups = [np.array([0])]
+        for variable, categories in feature_groups(population.feature_names).items():
+            offset = len(self.group)
+            codes = np.full(self.size, -1, dtype=np.int16)
+            for code, (category, index) in enumerate(categories):
+                codes[population.features[:, index] == 1] = offset + code
+                self.group.append(variable)
+                self.category.append(category)
+            rows.append(codes)
+            self._row_groups.append(np.arange(offset, len(self.group)))
+        self.n_groups = len(self.group)
+        for codes in rows:
+            codes[codes < 0] = self.n_groups
+        self.codes = np.stack(rows)
+
+        self.counts = self._sum(None)
+        # position of the first agent of every subgroup in its row,
+        # once the row is sorted by code
+        self._starts = np.zeros(self.n_groups, dtype=np.int64)
+        for groups in self._row_groups:
+            self._starts[groups[1:]] = np.cumsum(self.counts[groups[:-1]])
+
+        # bit 0 is the covid status, bit i + 1 the action i
+        self._bits = (
+            np.arange(1 << (len(self.actions) + 1))[:, None]
+            >> np.arange(len(self.actions) + 1)
+        ) & 1
+        self._weights = 1 << np.arange(1, len(self.actions) + 1)
+
+    def _sum(self, weights: np.ndarray = None) -> np.ndarray:
+        # sum of the weights (or number of agents) in every subgroup
+        total = np.zeros(self.n_groups + 1)
+        for codes in self.codes:
+            total += np.bincount(codes, weights=weights, minlength=self.n_groups + 1)
+        return total[: self.n_groups]
+
+    def _bit_shares(self, covid_status: np.ndarray, chosen_actions: np.ndarray):
+        # share of the agents with each bit set, in every subgroup
+        packed = chosen_actions @ self._weights
+        packed |= covid_status > 0
+        n_patterns = len(self._bits)
+        counts = np.zeros((self.n_groups + 1) * n_patterns)
+        for codes in self.codes:
+            counts += np.bincount(
+                codes.astype(np.int64) * n_patterns + packed,
+                minlength=len(counts),
+            )
+        counts = counts.reshape(self.n_groups + 1, n_patterns)[: self.n_groups]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (counts @ self._bits) / self.counts[:, None]
+
+    def _quantiles(self, values: np.ndarray) -> np.ndarray:
+        # exact quantiles, interpolated as `np.quantile` does. The values
+        # are sorted once, then every row is sorted by code with a stable
+        # sort, so that they stay sorted within each subgroup
+        order = np.argsort(values)
+        sorted_values = values[order]
+        result = np.full((self.n_groups, len(self.quantiles)), np.nan)
+        for codes, groups in zip(self.codes, self._row_groups):
+            grouped = sorted_values[np.argsort(codes[order], kind="stable")]
+            last = self.counts[groups].astype(np.int64)[:, None] - 1
+            position = self.quantiles * np.maximum(last, 0)
+            low = np.floor(position).astype(np.int64)
+            high = np.minimum(low + 1, np.maximum(last, 0))
+            starts = self._starts[groups][:, None]
+            # the indices of empty subgroups are clipped, their result is NaN
+            low_values = grouped[np.minimum(starts + low, self.size - 1)]
+            high_values = grouped[np.minimum(starts + high, self.size - 1)]
+            quantiles = low_values + (position - low) * (high_values - low_values)
+            result[groups] = np.where(last >= 0, quantiles, np.nan)
+        return result
+
+    @property
+    def columns(self) -> list:
+        """
+        Get the columns of the aggregates
+
+        Returns:
+            list: names of the columns
+        """
+        return (
+            ["step_id", "lockdown", "group", "category", "agents"]
+            + ["mean_mental_health"]
+            + [f"mental_health_q{round(q * 100):02d}" for q in self.quantiles]
+            + ["prevalence"]
+            + [f"share_{action}" for action in self.actions]
+        )
+
+    def aggregate(
+        self, step: int, lockdown: str, mh: np.ndarray, population: Population
+    ) -> pd.DataFrame:
+        """
+        Compute the aggregates of a step
+
+        Args:
+            step (int): step of the simulation
+            lockdown (str): lockdown of the step
+            mh (np.ndarray): cumulative mental health of every agent
+            population (Population): the agents, with their covid
+            status and the actions they chose at this step
+
+        Returns:
+            pd.DataFrame: one row per subgroup, the first one for the
+            whole population
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self._sum(mh) / self.counts
+        shares = self._bit_shares(population.covid_status, population.chosen_actions)
+        data = np.column_stack([mean, self._quantiles(mh), shares])
+        columns = self.columns
+        frame = pd.DataFrame(data, columns=columns[5:])
+        frame.insert(0, "step_id", step)
+        frame.insert(1, "lockdown", lockdown)
+        frame.insert(2, "group", self.group)
+        frame.insert(3, "category", self.category)
+        frame.insert(4, "agents", self.counts.astype(np.int64))
+        return frame
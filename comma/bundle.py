@@ -0,0 +1,226 @@
+"""Compiled bundle of the hypotheses of a parameters folder
+"""
+from comma.cache import cache_path, file_hash, write_entry
+from comma.hypothesis import PARAMS_INDIVIDUAL, Hypothesis
+from comma.individual import Individual
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import warnings
+
+# version of the compiled matrices and of their layout on disk, part of
+# the key of the cache: bump it when either changes
+BUNDLE_VERSION = 1
+
+
+def _lockdowns(lockdowns=None) -> list[str]:
+    # the lockdowns asked for, sorted, or the default ones
+    if lockdowns is None:
+        lockdowns = Hypothesis("2020-01-01", 1).lockdown_policies
+    return sorted(set(lockdowns))
+
+
+class ParameterBundle:
+    """
+    The ParameterBundle class holds the hypotheses of a parameters folder,
+    compiled for the simulation: for every lockdown, its lockdown matrix,
+    its lockdown matrix for the positive agents and its matrix of action
+    effects, as one contiguous float array. The rows of the matrices
+    follow `Hypothesis.all_possible_actions` and their columns are the
+    baseline followed by `Hypothesis.all_possible_features`, whatever
+    the order of the files.
+
+    The lockdowns are compiled and cached on disk one by one, keyed by
+    the hash of their files, see `load_bundle`.
+    """
+
+    # the matrices of every lockdown, in order
+    matrices_names = ["lockdown", "infected", "actions"]
+
+    def __init__(
+        self, lockdowns: list, actions: list, columns: list, matrices: np.ndarray
+    ):
+        self.lockdowns = lockdowns
+        self.actions = actions  # rows of the matrices
+        self.columns = columns  # columns of the matrices
+        # (n_lockdowns, 3, n_actions, n_columns), see `matrices_names`
+        self.matrices = matrices
+
+    @classmethod
+    def compile(cls, dir_params: str, lockdowns=None) -> "ParameterBundle":
+        """
+        Read, validate and align the hypothesis files of some lockdowns,
+        every file is read once. The files of the other lockdowns of the
+        folder are left alone.
+
+        Args:
+            dir_params (str): path to the parameters folder
+            lockdowns: optional. Lockdown types, `Hypothesis.lockdown_policies`
+            if not provided.
+
+        Returns:
+            ParameterBundle: the compiled bundle
+
+        Raises:
+            ValueError: If a file is missing or invalid,
+            see `Hypothesis.validate_param_file`.
+        """
+        hypothesis = Hypothesis("2020-01-01", 1)
+        hypothesis.lockdown_policies = _lockdowns(lockdowns)
+        param_files = hypothesis.read_param_files(dir_params)
+        hypothesis.validate_param_file(dir_params, param_files)
+
+        actions = list(Hypothesis.all_possible_actions)
+        columns = ["baseline"] + [f.lower() for f in Hypothesis.all_possible_features]
+        matrices = np.empty(
+            (len(hypothesis.lockdown_policies), 3, len(actions), len(columns))
+        )
+        for i, lockdown in enumerate(hypothesis.lockdown_policies):
+            for j, fname in [
+                (0, f"lockdown_{lockdown}.csv"),
+                (2, f"actions_effects_on_mh_{lockdown}.csv"),
+            ]:
+                df = param_files[fname].set_index("actions")
+                df.columns = df.columns.str.lower()
+                missing = set(columns) - set(df.columns)
+                if missing:
+                    raise ValueError(
+                        "Missing features:\n%s - %s" % (fname, ", ".join(missing))
+                    )
+                df = df.reindex(index=actions, columns=columns)
+                matrices[i, j] = df.fillna(0).to_numpy(dtype=np.float64)
+            # positive agents stay at home, whatever the lockdown
+            matrices[i, 1] = Individual.modify_policy_when_infected(
+                pd.DataFrame(matrices[i, 0], columns=columns)
+            ).to_numpy(dtype=np.float64)
+        return cls(hypothesis.lockdown_policies, actions, columns, matrices)
+
+    def save(self, path: str) -> None:
+        """
+        Save the bundle in a folder
+
+        Args:
+            path (str): path of the folder
+        """
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "bundle.json"), "w") as f:
+            json.dump(
+                {
+                    "lockdowns": self.lockdowns,
+                    "actions": self.actions,
+                    "columns": self.columns,
+                },
+                f,
+            )
+        np.save(os.path.join(path, "matrices.npy"), self.matrices)
+
+    @classmethod
+    def load(cls, path: str) -> "ParameterBundle":
+        """
+        Load a bundle saved with `save`, the matrices are memory-mapped
+
+        Args:
+            path (str): path of the folder
+
+        Returns:
+            ParameterBundle: the bundle
+        """
+        with open(os.path.join(path, "bundle.json")) as f:
+            meta = json.load(f)
+        matrices = np.load(os.path.join(path, "matrices.npy"), mmap_mode="r")
+        return cls(meta["lockdowns"], meta["actions"], meta["columns"], matrices)
+
+    def hypotheses(self, lockdowns) -> dict:
+        """
+        Get the matrices of some lockdowns
+
+        Args:
+            lockdowns: lockdown types
+
+        Returns:
+            dict: for every lockdown type, the tuple of its lockdown
+            matrix, its lockdown matrix for the positive agents, and
+            its matrix of action effects, as data frames
+        """
+        hypotheses = {}
+        for lockdown in set(lockdowns):
+            if lockdown not in self.lockdowns:
+                raise ValueError(
+                    f"No hypotheses for the lockdown '{lockdown}', "
+                    f"expected one of {', '.join(self.lockdowns)}"
+                )
+            matrices = self.matrices[self.lockdowns.index(lockdown)]
+            hypotheses[lockdown] = tuple(
+                pd.DataFrame(matrix, columns=self.columns, copy=False)
+                for matrix in matrices
+            )
+        return hypotheses
+
+
+def load_bundle(
+    dir_params: str, lockdowns=None, cache_dir: str = None
+) -> ParameterBundle:
+    """
+    Get the compiled bundle of some lockdowns of a parameters folder.
+    Only the files of these lockdowns are read and validated. Every
+    lockdown is compiled the first time and then read from the cache,
+    as long as its files and `params_individual.json` don't change, so
+    that the lockdowns compiled for different runs add up in the cache.
+    If the cache can't be written, the lockdowns are compiled in memory.
+
+    Args:
+        dir_params (str): path to the parameters folder
+        lockdowns: optional. Lockdown types, e.g. the lockdown of every
+        step of a simulation. `Hypothesis.lockdown_policies` if not
+        provided.
+        cache_dir (str): optional. Cache folder, `comma.cache.CACHE_DIR`
+        if not provided.
+
+    Returns:
+        ParameterBundle: the compiled bundle
+    """
+    lockdowns = _lockdowns(lockdowns)
+    fpaths = {
+        lockdown: [
+            os.path.join(dir_params, f"lockdown_{lockdown}.csv"),
+            os.path.join(dir_params, f"actions_effects_on_mh_{lockdown}.csv"),
+        ]
+        for lockdown in lockdowns
+    }
+    path_individual = os.path.join(dir_params, PARAMS_INDIVIDUAL)
+    if not os.path.isfile(path_individual) or not all(
+        os.path.isfile(fpath) for paths in fpaths.values() for fpath in paths
+    ):
+        # raises the error of the missing files
+        return ParameterBundle.compile(dir_params, lockdowns)
+
+    individual_hash = file_hash(path_individual)
+    matrices = []
+    for lockdown in lockdowns:
+        key = "|".join(
+            [str(BUNDLE_VERSION), lockdown, individual_hash]
+            + [file_hash(*fpaths[lockdown])]
+            + Hypothesis.all_possible_actions
+            + Hypothesis.all_possible_features
+        )
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        path = cache_path(cache_dir, f"params-{digest}")
+        if not os.path.isdir(path):
+            bundle = ParameterBundle.compile(dir_params, [lockdown])
+            try:
+                write_entry(path, bundle.save)
+            except OSError as error:
+                # the compiled lockdown is used without the cache
+                warnings.warn(f"Could not cache the parameters: {error}")
+                matrices.append(bundle.matrices[0])
+                continue
+        matrices.append(ParameterBundle.load(path).matrices[0])
+
+    matrices = np.stack(matrices)
+    matrices.flags.writeable = False
+    columns = ["baseline"] + [f.lower() for f in Hypothesis.all_possible_features]
+    return ParameterBundle(
+        lockdowns, list(Hypothesis.all_possible_actions), columns, matrices
+    )
@@ -0,0 +1,69 @@
+"""Helpers for the on-disk caches of comma
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+# where compiled parameters and populations are cached,
+# can be changed with the COMMA_CACHE_DIR environment variable
+CACHE_DIR = os.environ.get(
+    "COMMA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "comma")
+)
+
+
+def file_hash(*fpaths: str) -> str:
+    """
+    Compute a hash of the content of one or more files
+
+    Args:
+        fpaths (str): paths of the files
+
+    Returns:
+        str: hexadecimal sha256 digest of the files' content
+    """
+    digest = hashlib.sha256()
+    for fpath in fpaths:
+        with open(fpath, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir: str, name: str) -> str:
+    """
+    Get the path of an entry of the cache
+
+    Args:
+        cache_dir (str): cache folder, `CACHE_DIR` if None
+        name (str): name of the entry
+
+    Returns:
+        str: path of the entry
+    """
+    return os.path.join(CACHE_DIR if cache_dir is None else cache_dir, name)
+
+
+def write_entry(path: str, write) -> None:
+    """
+    Write an entry of the cache atomically: `write` fills a temporary
+    folder, which is then renamed to `path`. If another process wrote
+    the same entry in the meantime, its entry is kept.
+
+    Args:
+        path (str): path of the entry (a folder)
+        write (callable): function writing the entry's files
+        in the folder given as argument
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    try:
+        write(tmp_path)
+        os.rename(tmp_path, path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+    finally:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
@@ -0,0 +1,585 @@
+"""Local store of the COVID-19 case data of RIVM
+"""
+from comma.cache import cache_path
+import argparse
+import codecs
+import gzip
+import itertools
+import json
+import numpy as np
+import os
+import pandas as pd
+import re
+import requests
+from requests.adapters import HTTPAdapter
+import time
+from typing import Iterator
+import urllib3
+from urllib3.util.retry import Retry
+
+CASE_STORE = "rivm_cases.npz"
+DOWNLOAD = "rivm_download.json"  # the RIVM file, while it is downloaded
+GZIP_MAGIC = b"\x1f\x8b"
+
+# downloads of the RIVM file
+RETRIES = 3
+BACKOFF = 0.5  # seconds, doubled at every retry
+TIMEOUT = (10, 60)  # seconds to connect, and between two reads
+
+_session = None
+
+
+def case_store_path(path: str = None) -> str:
+    """
+    Get the path of the case store
+
+    Args:
+        path (str): optional. Path of the store, by default
+        `rivm_cases.npz` in `comma.cache.CACHE_DIR`
+
+    Returns:
+        str: path of the store
+    """
+    return cache_path(None, CASE_STORE) if path is None else path
+
+
+class CaseStore:
+    """
+    The CaseStore class holds the case counts of RIVM in a compact
+    columnar form. The records are sorted by municipality, then by date
+    of publication and date of report, and `offsets` indexes the records
+    of every municipality, so that a query only reads the records of one
+    municipality. The other columns of the RIVM file are kept as they are.
+    """
+
+    def __init__(
+        self,
+        codes: np.ndarray,
+        offsets: np.ndarray,
+        date_of_report: np.ndarray,
+        date_of_publication: np.ndarray,
+        columns: dict,
+        meta: dict = None,
+    ):
+        self.codes = codes  # sorted municipality codes
+        self.offsets = offsets  # records of codes[i]: offsets[i]:offsets[i + 1]
+        self.date_of_report = date_of_report  # datetime64[s]
+        self.date_of_publication = date_of_publication  # datetime64[D]
+        self.columns = columns  # {name: array} of the other columns
+        self.meta = {} if meta is None else meta
+
+    def __len__(self) -> int:
+        return len(self.date_of_report)
+
+    @property
+    def available_dates(self) -> tuple[pd.Timestamp, pd.Timestamp]:
+        """
+        Get the first and last dates of report in the store
+
+        Returns:
+            tuple: first and last date of report
+        """
+        return (
+            pd.Timestamp(self.date_of_report.min()),
+            pd.Timestamp(self.date_of_report.max()),
+        )
+
+    @classmethod
+    def ingest(cls, data: pd.DataFrame, meta: dict = None) -> "CaseStore":
+        """
+        Build the store from the records of the RIVM file
+
+        Args:
+            data (pd.DataFrame): records with (at least) the columns
+            `Date_of_report`, `Date_of_publication`, `Municipality_code`
+            and `Total_reported`.
+            meta (dict): optional. Information about the source of the data.
+
+        Returns:
+            CaseStore: the store
+        """
+        municipality = data["Municipality_code"].fillna("").to_numpy(dtype=str)
+        codes, inverse = np.unique(municipality, return_inverse=True)
+        report = pd.to_datetime(data["Date_of_report"]).to_numpy("datetime64[s]")
+        publication = pd.to_datetime(data["Date_of_publication"]).to_numpy(
+            "datetime64[D]"
+        )
+        order = np.lexsort((report, publication, inverse))
+        offsets = np.searchsorted(inverse[order], np.arange(len(codes) + 1))
+
+        columns = {}
+        for name in data.columns:
+            if name in ["Date_of_report", "Date_of_publication", "Municipality_code"]:
+                continue
+            column = data[name]
+            if column.dtype == object:
+                # stored as fixed-width strings, no pickled objects
+                columns[name] = column.fillna("").to_numpy(dtype=str)[order]
+            else:
+                columns[name] = column.to_numpy()[order]
+
+        meta = dict(meta or {}, columns=list(data.columns))
+        return cls(codes, offsets, report[order], publication[order], columns, meta)
+
+    def save(self, path: str) -> None:
+        """
+        Save the store in a npz file, replaced atomically
+
+        Args:
+            path (str): path of the file
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                codes=self.codes,
+                offsets=self.offsets,
+                date_of_report=self.date_of_report,
+                date_of_publication=self.date_of_publication,
+                meta=np.array(json.dumps(self.meta)),
+                **{f"column/{name}": array for name, array in self.columns.items()},
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CaseStore":
+        """
+        Load a store saved with `save`
+
+        Args:
+            path (str): path of the file
+
+        Returns:
+            CaseStore: the store
+        """
+        with np.load(path) as data:
+            columns = {
+                name.split("/", 1)[1]: data[name]
+                for name in data.files
+                if name.startswith("column/")
+            }
+            return cls(
+                data["codes"],
+                data["offsets"],
+                data["date_of_report"],
+                data["date_of_publication"],
+                columns,
+                json.loads(str(data["meta"])),
+            )
+
+    def query(self, municipality_code: str, start: str, end: str) -> pd.DataFrame:
+        """
+        Get the records of a municipality reported between two dates
+
+        Args:
+            municipality_code (str): also known as Gemeentecode
+            start (str): first date ('YYYY-MM-DD')
+            end (str): last date ('YYYY-MM-DD')
+
+        Returns:
+            pd.DataFrame: the records, with the columns of the RIVM file,
+            empty if the municipality is unknown
+        """
+        first, last = self.available_dates
+        if pd.to_datetime(start) < first or pd.to_datetime(end) > last:
+            raise ValueError(
+                f"time_period ({start} - {end}) "
+                f"is outside available dates that go from "
+                f"({first} to {last})"
+            )
+
+        i = np.searchsorted(self.codes, municipality_code)
+        if i < len(self.codes) and self.codes[i] == municipality_code:
+            records = np.arange(self.offsets[i], self.offsets[i + 1])
+        else:
+            records = np.arange(0)
+        report = self.date_of_report[records]
+        records = records[
+            (report >= np.datetime64(start)) & (report <= np.datetime64(end))
+        ]
+
+        data = {
+            "Date_of_report": pd.to_datetime(self.date_of_report[records]),
+            "Date_of_publication": pd.to_datetime(
+                self.date_of_publication[records]
+            ).strftime("%Y-%m-%d"),
+            "Municipality_code": np.full(len(records), municipality_code),
+        }
+        for name, array in self.columns.items():
+            data[name] = array[records]
+        columns = self.meta.get("columns", list(data))
+        return pd.DataFrame(data, columns=columns)
+
+
+# whitespace and separators between the records of a json array
+_SEPARATORS = re.compile(r"[\s,]*")
+
+
+def iter_records(chunks) -> Iterator[dict]:
+    """
+    Parse a json array of objects incrementally, e.g. while it downloads.
+    Only the current chunk and the record being parsed are held in memory.
+
+    Args:
+        chunks: iterable of bytes, the successive parts of the json document
+
+    Yields:
+        dict: the objects of the array, one by one
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+    for chunk in itertools.chain(chunks, [None]):
+        final = chunk is None
+        buffer += utf8.decode(b"" if final else chunk, final=final)
+        pos = 0
+        while True:
+            pos = _SEPARATORS.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("The json document is not an array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                break  # the record continues in the next chunk
+            yield record
+        buffer = buffer[pos:]
+    raise ValueError("The json document ended before the end of the array")
+
+
+def read_records(
+    chunks,
+    municipality_codes: list = None,
+    start: str = None,
+    end: str = None,
+) -> pd.DataFrame:
+    """
+    Parse the RIVM json file incrementally, keeping only the records of
+    some municipalities, reported between two dates. The records are
+    collected column by column, so the memory used grows with the
+    records kept, not with the size of the file.
+
+    Args:
+        chunks: iterable of bytes, the successive parts of the json document
+        municipality_codes (list): optional. Municipalities to keep,
+        all of them by default.
+        start (str): optional. First date of report ('YYYY-MM-DD')
+        end (str): optional. Last date of report ('YYYY-MM-DD')
+
+    Returns:
+        pd.DataFrame: the records kept
+    """
+    if municipality_codes is not None:
+        municipality_codes = set(municipality_codes)
+    columns: dict[str, list] = {}
+    n_records = 0
+    for record in iter_records(chunks):
+        if (
+            municipality_codes is not None
+            and record.get("Municipality_code") not in municipality_codes
+        ):
+            continue
+        # dates and times are in ISO format, so they compare as strings
+        report = record.get("Date_of_report", "")
+        if (start is not None and report < start) or (end is not None and report > end):
+            continue
+        for name, value in record.items():
+            # columns missing from the previous records are filled with None
+            columns.setdefault(name, [None] * n_records).append(value)
+        n_records += 1
+        for values in columns.values():
+            if len(values) < n_records:
+                values.append(None)
+    return pd.DataFrame(columns)
+
+
+def get_session() -> requests.Session:
+    """
+    Get the HTTP session of the downloads, created once so that its
+    connections are reused. Failed connections and the transient errors
+    of the server are retried with an exponential backoff.
+
+    Returns:
+        requests.Session: the session
+    """
+    global _session
+    if _session is None:
+        retry = Retry(
+            total=RETRIES,
+            backoff_factor=BACKOFF,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+        )
+        _session = requests.Session()
+        _session.mount("http://", HTTPAdapter(max_retries=retry))
+        _session.mount("https://", HTTPAdapter(max_retries=retry))
+    return _session
+
+
+def fetch_file(
+    url: str,
+    fpath: str,
+    validators: dict = None,
+    retries: int = RETRIES,
+    timeout: tuple = TIMEOUT,
+    chunk_size: int = 1 << 20,
+) -> dict:
+    """
+    Download a file, asking for it compressed with gzip. The response is
+    saved as it is sent, still compressed, in `<fpath>.part`: when the
+    transfer is interrupted, it is resumed from there with a range
+    request, by this call (up to `retries` times) or by the next one.
+
+    Args:
+        url (str): URL of the file
+        fpath (str): path of the downloaded file
+        validators (dict): optional. `etag` and `last_modified` of the
+        copy we already have, the file is only downloaded if it changed.
+        retries (int): number of times an interrupted transfer is resumed
+        timeout (tuple): connect and read timeouts, in seconds
+        chunk_size (int): number of bytes written at once
+
+    Returns:
+        dict: `etag`, `last_modified` and `content_encoding` of the file,
+        or None if it did not change
+    """
+    part_path = f"{fpath}.part"
+    meta_path = f"{part_path}.json"
+    for attempt in range(retries + 1):
+        part = {}
+        if os.path.exists(part_path) and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                part = json.load(f)
+        offset = os.path.getsize(part_path) if part else 0
+
+        headers = {"Accept-Encoding": "gzip"}
+        if offset and (part["etag"] or part["last_modified"]):
+            # the rest of the same version of the file, or all of a new one
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = part["etag"] or part["last_modified"]
+        elif validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+        try:
+            with get_session().get(
+                url, headers=headers, stream=True, timeout=timeout
+            ) as response:
+                if response.status_code == 304:
+                    return None
+                if response.status_code == 416:
+                    # the part is not a prefix of the file, start again
+                    os.remove(part_path)
+                    raise requests.HTTPError("Invalid range", response=response)
+                if response.status_code == 200:
+                    offset = 0
+                    part = {
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                        "content_encoding": response.headers.get("Content-Encoding"),
+                    }
+                    os.makedirs(os.path.dirname(os.path.abspath(fpath)), exist_ok=True)
+                    with open(meta_path, "w") as f:
+                        json.dump(part, f)
+                elif response.status_code != 206:
+                    raise Exception(
+                        "Failed to download data: HTTP status code:",
+                        response.status_code,
+                    )
+
+                with open(part_path, "ab" if offset else "wb") as f:
+                    # the bytes as sent, ranges are offsets in the compressed file
+                    for chunk in response.raw.stream(chunk_size, decode_content=False):
+                        f.write(chunk)
+                size = os.path.getsize(part_path) - offset
+                if size < int(response.headers.get("Content-Length", size)):
+                    raise requests.ConnectionError("The transfer was interrupted")
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as error:
+            if attempt == retries:
+                if isinstance(error, requests.RequestException):
+                    raise
+                raise requests.ConnectionError(error) from error
+            time.sleep(BACKOFF * 2**attempt)
+            continue
+
+        os.replace(part_path, fpath)
+        os.remove(meta_path)
+        return part
+
+
+def read_covid_file(
+    fpath: str,
+    municipality_codes: list = None,
+    start: str = None,
+    end: str = None,
+    chunk_size: int = 1 << 20,
+) -> pd.DataFrame:
+    """
+    Read the RIVM json file, compressed with gzip or not, see `read_records`
+
+    Args:
+        fpath (str): path of the file
+        municipality_codes (list): optional. Municipalities to keep
+        start (str): optional. First date of report ('YYYY-MM-DD')
+        end (str): optional. Last date of report ('YYYY-MM-DD')
+        chunk_size (int): number of bytes read at once
+
+    Returns:
+        pd.DataFrame: the records kept
+    """
+    with open(fpath, "rb") as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    with (gzip.open if compressed else open)(fpath, "rb") as f:
+        chunks = iter(lambda: f.read(chunk_size), b"")
+        return read_records(chunks, municipality_codes, start, end)
+
+
+def stream_covid_data(
+    source: str,
+    municipality_codes: list = None,
+    start: str = None,
+    end: str = None,
+    chunk_size: int = 1 << 20,
+    validators: dict = None,
+) -> pd.DataFrame:
+    """
+    Read the RIVM json file from a URL or a local file, see `fetch_file`
+    and `read_records`. A download is kept compressed on disk until it is
+    parsed, so an interrupted download is resumed by the next call.
+
+    Args:
+        source (str): URL or path of the file
+        municipality_codes (list): optional. Municipalities to keep
+        start (str): optional. First date of report ('YYYY-MM-DD')
+        end (str): optional. Last date of report ('YYYY-MM-DD')
+        chunk_size (int): number of bytes read at once
+        validators (dict): optional. `etag` and `last_modified` of the
+        data we already have, see `fetch_file`
+
+    Returns:
+        pd.DataFrame: the records kept, with the `etag` and
+        `last_modified` of the file in `attrs["http"]`, or None
+        if the file did not change
+    """
+    if os.path.exists(source):
+        return read_covid_file(source, municipality_codes, start, end, chunk_size)
+
+    fpath = cache_path(None, DOWNLOAD)
+    meta = fetch_file(source, fpath, validators, chunk_size=chunk_size)
+    if meta is None:
+        return None
+    try:
+        data = read_covid_file(fpath, municipality_codes, start, end, chunk_size)
+    finally:
+        os.remove(fpath)
+    data.attrs["http"] = {
+        "etag": meta["etag"],
+        "last_modified": meta["last_modified"],
+    }
+    return data
+
+
+def load_case_store(path: str = None) -> CaseStore:
+    """
+    Load the case store, if it exists
+
+    Args:
+        path (str): optional. Path of the store, see `case_store_path`
+
+    Returns:
+        CaseStore: the store, or None if there is none yet
+    """
+    path = case_store_path(path)
+    if not os.path.exists(path):
+        return None
+    return CaseStore.load(path)
+
+
+def refresh_case_store(
+    path: str = None, url: str = None, force: bool = False
+) -> CaseStore:
+    """
+    Download the RIVM file and replace the case store with it. The file
+    is only downloaded if it changed since the store was filled, according
+    to the `etag` and `last_modified` kept in the store.
+
+    Args:
+        path (str): optional. Path of the store, see `case_store_path`
+        url (str): optional. URL (or local path) of the RIVM file
+        force (bool): optional. Download the file even if it did not change
+
+    Returns:
+        CaseStore: the new store, or the current one if the file did
+        not change
+    """
+    # imported here, the hypothesis module queries the store
+    from comma.hypothesis import Hypothesis
+
+    hypothesis = Hypothesis("2020-01-01", 1)
+    if url is not None:
+        hypothesis.RIVM_URL = url
+    store = None if force else load_case_store(path)
+    data = hypothesis.download_covid_data(
+        validators=None if store is None else store.meta
+    )
+    if data is None:
+        return store
+
+    store = CaseStore.ingest(
+        data,
+        meta={
+            "source": hypothesis.RIVM_URL,
+            "fetched_at": pd.Timestamp.now(tz="UTC").isoformat(),
+            **data.attrs.get("http", {}),
+        },
+    )
+    store.save(case_store_path(path))
+    return store
+
+
+def main(args: list = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m comma.casedata",
+        description="Manage the local store of the COVID-19 case data of RIVM",
+    )
+    parser.add_argument("command", choices=["refresh", "info"])
+    parser.add_argument("--path", help="path of the store")
+    parser.add_argument("--url", help="URL (or local path) of the RIVM file")
+    parser.add_argument(
+        "--force", action="store_true", help="download the file even if unchanged"
+    )
+    args = parser.parse_args(args)
+
+    if args.command == "refresh":
+        previous = load_case_store(args.path)
+        store = refresh_case_store(args.path, args.url, args.force)
+        if previous is not None and store.meta == previous.meta:
+            print("The case data is up to date")
+        else:
+            print(f"Stored {len(store)} records at {case_store_path(args.path)}")
+    store = load_case_store(args.path)
+    if store is None:
+        print(f"No case data at {case_store_path(args.path)}")
+        return
+    first, last = store.available_dates
+    print(
+        f"{len(store)} records of {len(store.codes)} municipalities, "
+        f"reported from {first} to {last}, {store.meta}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Ensembles of replicates of a simulation
+"""
+from comma.model import Model
+from comma.population import Population
+from comma.shared import SharedArrays, attach_hypotheses, share_hypotheses
+from comma.writer import OUTPUT_FORMATS, get_writer
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import os
+from tqdm import tqdm
+
+
+def _run_simulation(task: dict) -> str:
+    """
+    Run one simulation of an ensemble or a sweep, in a worker process
+
+    Args:
+        task (dict): arguments of the simulation, see `run_ensemble`
+
+    Returns:
+        str: path of the results of the simulation
+    """
+    # the read-only arrays are mapped, not copied
+    shared = task["shared"]
+    population = None
+    if "features" in shared:
+        population = Population(shared["features"])
+    model = Model(
+        task["size"],
+        task["dir_params"],
+        use_ipf=task["use_ipf"],
+        seed=task["seed"],
+        vectorized=True,
+        cache_population=task["cache_population"],
+        population=population,
+    )
+    hypotheses = attach_hypotheses(
+        shared, task["lockdown_policy"], task.get("prefix", "")
+    )
+    with get_writer(
+        task["out_path"], task["output_format"], task["chunk_rows"]
+    ) as writer:
+        model._simulate(
+            task["lockdown_policy"],
+            task["new_cases"],
+            hypotheses,
+            writer,
+            keep_history=False,
+            progress=False,
+        )
+    return task["out_path"]
+
+
+def run_ensemble(
+    replicates: int,
+    size: int,
+    dir_params: str,
+    steps: int,
+    lockdown_policy: list,
+    out_dir: str,
+    seed=None,
+    workers: int = None,
+    use_ipf: bool = False,
+    cache_population: bool = False,
+    shared_population: bool = False,
+    starting_date="2021-02-01",
+    municipality_code="GM0014",
+    real_pop_size=200336,
+    cache=False,
+    output_format="csv",
+    chunk_rows=1_000_000,
+) -> list[str]:
+    """Run replicates of a simulation in parallel
+
+    Every replicate is a simulation of a new population with the
+    vectorized engine. The seed of each replicate is spawned from
+    `seed`, so the results of a replicate only depend on `seed` and
+    on its number, not on the number of workers.
+
+    The positive cases and the hypotheses are read once, and each
+    replicate writes its results to its own file in `out_dir`. The
+    matrices of the hypotheses (and the feature matrix of the population,
+    if shared) are memory-mapped by the workers, rather than copied.
+
+    Args:
+        replicates(int): Number of replicates
+
+        size(int): Number of agents of every replicate
+
+        dir_params(str): Path to the parameters folder
+
+        steps(int): Number of steps to run the simulation
+
+        lockdown_policy(list): Type of lockdown policy of every step
+
+        out_dir(str): Folder of the output files
+
+        seed: Seed of the ensemble. If None, the replicates are not
+        reproducible.
+
+        workers(int): Number of worker processes. Defaults to the
+        number of CPUs, with 1 the replicates run in this process.
+
+        use_ipf(boolean): Sample the agents from the IPF weights
+
+        cache_population(boolean): Cache the populations of the
+        replicates on disk
+
+        shared_population(boolean): Simulate the same population, seeded
+        from `seed`, in every replicate. The replicates only differ in
+        their infections and their choices of actions.
+
+        starting_date(str): start date ('YYYY-MM-DD')
+
+        municipality_code(str): Also known as Gemeentecode
+
+        real_pop_size(int): Real size of the population
+        of the relative municipality_code
+
+        cache(boolean): Do you want to save COVID-19 data?
+
+        output_format(str): Format of the output files, one of
+        "csv", "parquet", "feather" or "npz"
+
+        chunk_rows(int): Number of rows buffered in memory
+        before being written to the output files
+
+    Returns:
+        list: paths of the results of every replicate, in order
+    """
+    if replicates < 1:
+        raise ValueError("There must be at least one replicate")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"output_format should be one of {', '.join(OUTPUT_FORMATS)}, "
+            f"got '{output_format}'"
+        )
+
+    # the inputs are shared by all the replicates, read them once
+    new_cases = Model.get_new_cases(
+        dir_params,
+        size,
+        steps,
+        lockdown_policy,
+        starting_date,
+        municipality_code,
+        real_pop_size,
+        cache,
+    )
+    arrays = share_hypotheses(Model.read_hypotheses(dir_params, lockdown_policy))
+
+    root_seed = np.random.SeedSequence(seed)
+    if shared_population:
+        populate = Population.populate_ipf if use_ipf else Population.populate
+        rng = np.random.default_rng(root_seed)
+        arrays["features"] = populate(size, dir_params, rng).features
+
+    os.makedirs(out_dir, exist_ok=True)
+    seeds = root_seed.spawn(replicates)
+    with SharedArrays(arrays) as shared:
+        tasks = [
+            {
+                "seed": child_seed,
+                "size": size,
+                "dir_params": dir_params,
+                "use_ipf": use_ipf,
+                "cache_population": cache_population,
+                "lockdown_policy": list(lockdown_policy),
+                "new_cases": new_cases,
+                "shared": shared,
+                "out_path": os.path.join(out_dir, f"replicate_{i:04d}.{output_format}"),
+                "output_format": output_format,
+                "chunk_rows": chunk_rows,
+            }
+            for i, child_seed in enumerate(seeds)
+        ]
+        return _map(_run_simulation, tasks, workers, desc="Running replicates")
+
+
+def _map(function, tasks: list, workers: int = None, desc: str = None) -> list:
+    """
+    Call a function on every task in a process pool, in order
+
+    Args:
+        function (callable): function to call, picklable
+        tasks (list): arguments of the function
+        workers (int): number of worker processes. Defaults to the
+        number of CPUs, with 1 the tasks run in this process.
+        desc (str): label of the progress bar
+
+    Returns:
+        list: results of the function
+    """
+    if workers == 1:
+        return list(tqdm(map(function, tasks), total=len(tasks), desc=desc))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(function, tasks)
+        return list(tqdm(results, total=len(tasks), desc=desc))
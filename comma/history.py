@@ -0,0 +1,189 @@
+"""History class definition
+"""
+import numpy as np
+import pandas as pd
+
+
+class History:
+    """
+    The History class records the state of the agents at every step
+    of a simulation in preallocated arrays indexed by [step, agent].
+    The lockdown is the same for all agents, so it is stored once per
+    step, as a code into `lockdown_names`.
+
+    When `keep_steps` is given, only the last `keep_steps` steps are kept
+    in memory (e.g. when they are streamed to disk as the simulation runs).
+    """
+
+    columns = [
+        "step_id",
+        "lockdown",
+        "agent_id",
+        "delta_mental_health",
+        "cumulative_mental_health",
+        "covid_status",
+        "days_since_first_infection",
+    ]
+    # the arrays of the recorded data
+    arrays = ["lockdown", "delta_mh", "mh", "covid_status", "days_since_positive"]
+
+    def __init__(self, steps: int, size: int, keep_steps: int = None):
+        self.size = size
+        self.keep_steps = keep_steps
+        self.recorded = 0  # number of steps recorded so far
+        self.lockdown_names: list[str] = []
+        self.lockdown = np.full(steps, -1, dtype=np.int8)
+        rows = steps if keep_steps is None else min(steps, keep_steps)
+        self.delta_mh = np.zeros((rows, size), dtype=np.float64)
+        self.mh = np.zeros((rows, size), dtype=np.float64)
+        self.covid_status = np.zeros((rows, size), dtype=np.int8)
+        self.days_since_positive = np.full((rows, size), np.nan)
+
+    @property
+    def steps(self) -> int:
+        """
+        Get the number of steps the history has room for
+
+        Returns:
+            int: number of steps
+        """
+        return len(self.lockdown)
+
+    def row(self, step: int) -> int:
+        """
+        Get the row of the arrays where a step is stored
+
+        Args:
+            step (int): step of the simulation
+
+        Returns:
+            int: row index
+        """
+        if self.keep_steps is None:
+            return step
+        if step < self.recorded - self.keep_steps:
+            raise ValueError(
+                f"Step {step} is not kept in memory anymore, only the "
+                f"last {self.keep_steps} steps are"
+            )
+        return step % self.keep_steps
+
+    def extend(self, steps: int) -> None:
+        """
+        Make room for more steps, keeping the steps already recorded.
+
+        Args:
+            steps (int): new number of steps. Nothing happens if
+            the history already has room for them.
+        """
+        if steps <= self.steps:
+            return
+        extra = steps - self.steps
+        self.lockdown = np.concatenate(
+            [self.lockdown, np.full(extra, -1, dtype=np.int8)]
+        )
+        if self.keep_steps is not None:
+            # the rows are reused, only the lockdowns are kept for every step
+            rows = min(steps, self.keep_steps)
+            extra = rows - len(self.mh)
+        for name, fill in [
+            ("delta_mh", 0),
+            ("mh", 0),
+            ("covid_status", 0),
+            ("days_since_positive", np.nan),
+        ]:
+            array = getattr(self, name)
+            padding = np.full((extra, self.size), fill, dtype=array.dtype)
+            setattr(self, name, np.concatenate([array, padding]))
+
+    def lockdown_code(self, lockdown: str) -> int:
+        """
+        Get the integer code of a lockdown policy
+
+        Args:
+            lockdown (str): lockdown type
+
+        Returns:
+            int: index of the lockdown in `lockdown_names`
+        """
+        if lockdown not in self.lockdown_names:
+            self.lockdown_names.append(lockdown)
+        return self.lockdown_names.index(lockdown)
+
+    def record(
+        self,
+        step: int,
+        lockdown: str,
+        delta_mh: np.ndarray,
+        mh: np.ndarray,
+        covid_status: np.ndarray,
+        days_since_positive: np.ndarray,
+    ) -> None:
+        """
+        Record the state of all the agents at a given step
+
+        Args:
+            step (int): step of the simulation
+            lockdown (str): lockdown type
+            delta_mh (np.ndarray): incremental change of mental health
+            mh (np.ndarray): cumulative mental health
+            covid_status (np.ndarray): covid status of the agents
+            days_since_positive (np.ndarray): days since tested positive
+        """
+        self.lockdown[step] = self.lockdown_code(lockdown)
+        self.recorded = max(self.recorded, step + 1)
+        row = self.row(step)
+        self.delta_mh[row] = delta_mh
+        self.mh[row] = mh
+        self.covid_status[row] = covid_status
+        self.days_since_positive[row] = days_since_positive
+
+    def to_frame(self, start: int = 0, stop: int = None) -> pd.DataFrame:
+        """
+        Get the recorded steps as a long dataframe, one row per (step, agent)
+
+        Args:
+            start (int): first step. Defaults to 0.
+            stop (int): step after the last one. Defaults to
+            the number of steps recorded.
+
+        Returns:
+            pd.DataFrame: the recorded data, with columns `History.columns`
+        """
+        if stop is None:
+            stop = self.recorded
+        steps = np.arange(start, stop)
+        rows = [self.row(step) for step in steps]
+        lockdown_names = np.asarray(self.lockdown_names, dtype=object)
+        return pd.DataFrame(
+            {
+                "step_id": np.repeat(steps, self.size),
+                "lockdown": np.repeat(lockdown_names[self.lockdown[steps]], self.size),
+                "agent_id": np.tile(np.arange(self.size), len(steps)),
+                "delta_mental_health": self.delta_mh[rows].ravel(),
+                "cumulative_mental_health": self.mh[rows].ravel(),
+                "covid_status": self.covid_status[rows].ravel(),
+                "days_since_first_infection": self.days_since_positive[rows].ravel(),
+            },
+            columns=self.columns,
+        )
+
+    def fill(self, data: pd.DataFrame) -> None:
+        """
+        Fill the state of the agents from rows of results, e.g. the
+        steps written to the output file before a simulation was resumed.
+        The lockdowns and the number of steps recorded are not changed.
+
+        Args:
+            data (pd.DataFrame): rows with columns `History.columns`, of
+            steps kept in memory
+        """
+        steps = data["step_id"].to_numpy()
+        rows = steps if self.keep_steps is None else steps % self.keep_steps
+        agents = data["agent_id"].to_numpy()
+        self.delta_mh[rows, agents] = data["delta_mental_health"].to_numpy()
+        self.mh[rows, agents] = data["cumulative_mental_health"].to_numpy()
+        self.covid_status[rows, agents] = data["covid_status"].to_numpy()
+        self.days_since_positive[rows, agents] = data[
+            "days_since_first_infection"
+        ].to_numpy()
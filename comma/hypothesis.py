@@ -1,11 +1,11 @@
 """Hypothesis class definition"""
 import warnings
+from comma.casedata import load_case_store, refresh_case_store, stream_covid_data
 from datetime import datetime, timedelta
 import json
 import os
 import pandas as pd
 import re
-import requests
 
 PARAMS_INDIVIDUAL = "params_individual.json"
 PARAMS_IPF_WEIGHTS = "ipf_weights.csv.zip"
@@ -96,21 +96,34 @@ class Hypothesis:
         "be_sedentary",
     ]
 
-    def download_covid_data(self) -> pd.DataFrame:
+    def download_covid_data(
+        self,
+        municipality_codes: list = None,
+        start: str = None,
+        end: str = None,
+        validators: dict = None,
+    ) -> pd.DataFrame:
         """
-        Download COVID-19 data from RIVM
+        Download COVID-19 data from RIVM. The file is downloaded compressed,
+        and resumed if the transfer is interrupted, see
+        `comma.casedata.fetch_file`. Only the records of the given
+        municipalities and dates are kept, see `comma.casedata.read_records`.
+
+        Args:
+        - municipality_codes (list): optional. Municipalities to keep,
+        all of them by default.
+        - start (str): optional. First date of report ('YYYY-MM-DD')
+        - end (str): optional. Last date of report ('YYYY-MM-DD')
+        - validators (dict): optional. `etag` and `last_modified` of the
+        data we already have, to download the file only if it changed.
 
         Returns:
-        - df (pd.Dataframe): A DataFrame containing the downloaded data.
+        - df (pd.Dataframe): A DataFrame containing the downloaded data,
+        or None if the file did not change.
         """
-
-        response = requests.get(self.RIVM_URL)
-        if response.status_code != 200:
-            raise Exception(
-                "Failed to download data: HTTP status code:", response.status_code
-            )
-        df = pd.DataFrame(response.json())
-        return df
+        return stream_covid_data(
+            self.RIVM_URL, municipality_codes, start, end, validators=validators
+        )
 
     def compute_time_period(self) -> tuple:
         """
@@ -129,6 +142,8 @@ class Hypothesis:
     def get_covid_data(self, municipality_code: str, cache=False) -> pd.DataFrame:
         """
         Download and filter COVID-19 test data from the RIVM website.
+        The data is downloaded once and kept in a local store,
+        see `comma.casedata`.
 
         Args:
         municipality_code (str): also known as Gemeentecode
@@ -152,39 +167,17 @@ class Hypothesis:
             print(f"Data already exists: {csv_file_path}.")
             return pd.read_csv(csv_file_path)
 
-        # fetch the data
-        print("Downloading COVID-19 data from RIVM")
-        data = self.download_covid_data()
-        print("Data fetched")
+        # query the local store of case data, the RIVM file is
+        # downloaded (and ingested in the store) the first time only.
+        # `python -m comma.casedata refresh` updates the store.
+        store = load_case_store()
+        if store is None:
+            print("Downloading COVID-19 data from RIVM")
+            store = refresh_case_store(url=self.RIVM_URL)
+            print("Data fetched")
 
-        # filter by municipality code
-        filtered_data = data[data["Municipality_code"] == municipality_code].copy()
-
-        # are dates available compatible with start/end dates?
-        available_start = pd.to_datetime(data["Date_of_report"].min())
-        available_end = pd.to_datetime(data["Date_of_report"].max())
-
-        if (
-            pd.to_datetime(start) < available_start
-            or pd.to_datetime(end) > available_end
-        ):
-            raise ValueError(
-                f"time_period ({self.time_period[0]} - {self.time_period[1]}) "
-                f"is outside available dates that go from "
-                f"({available_start} to {available_end})"
-            )
-
-        # filter by dates
-        start_date = pd.to_datetime(start)
-        end_date = pd.to_datetime(end)
-        filtered_data["Date_of_report"] = pd.to_datetime(
-            filtered_data["Date_of_report"]
-        )
-
-        filtered_data = filtered_data[
-            (filtered_data["Date_of_report"] >= start_date)
-            & (filtered_data["Date_of_report"] <= end_date)
-        ]
+        # filter by municipality code and dates
+        filtered_data = store.query(municipality_code, start, end)
 
         if cache:
             if not os.path.exists(folder_path):
@@ -428,19 +421,19 @@ class Hypothesis:
         for fp in output_fpaths:
             df.to_csv(fp, sep=";", index=False)
 
-    def validate_param_file(self, dir_params: str) -> None:
-        """Validate files in the parameter folder.
+    def read_param_files(self, dir_params: str) -> dict[str, pd.DataFrame]:
+        """Read the hypothesis files of the parameter folder, as they are.
 
         Args:
             dir_params (str): dir to the folder containing
             hypothesis and parameter files.
 
+        Returns:
+            dict: the content of every file, by file name
+
         Raises:
-            ValueError: If any validation checks fail.
+            ValueError: If a file is missing.
         """
-        # check if parameter files exist
-        path_individual = os.path.join(dir_params, PARAMS_INDIVIDUAL)
-
         # check if all hypothesis files exist
         fnames = [
             "actions_effects_on_%s_%s.csv" % (status, policy)
@@ -455,11 +448,34 @@ class Hypothesis:
                 "Hypothesis file(s) not found: %s."
                 % ", ".join([fnames[i] for i in range(len(fnames)) if not fexist[i]])
             )
+        return {
+            fn: pd.read_csv(fp, sep=",", decimal=".") for fn, fp in zip(fnames, fpaths)
+        }
+
+    def validate_param_file(
+        self, dir_params: str, param_files: dict[str, pd.DataFrame] = None
+    ) -> None:
+        """Validate files in the parameter folder.
+
+        Args:
+            dir_params (str): dir to the folder containing
+            hypothesis and parameter files.
+            param_files (dict): optional. The hypothesis files, as
+            returned by `read_param_files`, read if not given.
+
+        Raises:
+            ValueError: If any validation checks fail.
+        """
+        # check if parameter files exist
+        path_individual = os.path.join(dir_params, PARAMS_INDIVIDUAL)
+        if param_files is None:
+            param_files = self.read_param_files(dir_params)
+        fnames = list(param_files)
 
         # check if all hypothesis files contain all the required agent features
         required_features = ["actions", "baseline"]
         required_features += self._get_one_hot_encoded_features(path_individual)
-        hypothesis_data = [pd.read_csv(fp, sep=",", decimal=".") for fp in fpaths]
+        hypothesis_data = list(param_files.values())
         missing_features = []
         for hd in hypothesis_data:
             # lower case labels
@@ -1,27 +1,85 @@
 """Individual agent class definition
 """
 
-from comma.hypothesis import PARAMS_INDIVIDUAL, PARAMS_IPF_WEIGHTS, Hypothesis
-import json
+from comma.hypothesis import Hypothesis
+from comma.population import Population, recovery_probability
 import numpy as np
-import os
 import pandas as pd
-from scipy.stats import gamma  # for the "recovery" curve
 from tqdm import tqdm
 
 
 class Individual:
-    def __init__(self, id: int, dir_params: str, features):
+    """
+    An individual agent. It is a lightweight view on the population:
+    the agent only holds its index, and its features and state are
+    read from (and written to) the population arrays on access.
+    """
+
+    __slots__ = ("id", "dir_params", "recovery", "_index", "_population")
+
+    actions = Hypothesis.all_possible_actions
+
+    def __init__(
+        self,
+        id: int,
+        dir_params: str,
+        features: pd.Series = None,
+        population: Population = None,
+    ):
         self.id: int = id
         self.dir_params = dir_params
-        self.chosen_actions = None
-        self._status: float = 0.0
-        self._features = features
-        self.actions = Hypothesis.all_possible_actions
-        self.covid_status: int = 0  # this tracks the positivity to COVID-19
-        self.long_covid: int = 0  # is this a long covid case?
-        self.days_since_positive = np.nan  # n-day from first day of positivity
         self.recovery = np.nan  # recovery status
+        # the agent's state lives in the population arrays, at index `id`.
+        # A standalone agent gets a population of its own, with `features`.
+        if population is None:
+            population = Population.from_frame(pd.DataFrame([features]))
+            self._index = 0
+        else:
+            self._index = id
+        self._population = population
+
+    @property
+    def covid_status(self) -> int:
+        """this tracks the positivity to COVID-19"""
+        return self._population.covid_status[self._index]
+
+    @covid_status.setter
+    def covid_status(self, value: int) -> None:
+        self._population.covid_status[self._index] = value
+
+    @property
+    def long_covid(self) -> int:
+        """is this a long covid case?"""
+        return self._population.long_covid[self._index]
+
+    @long_covid.setter
+    def long_covid(self, value: int) -> None:
+        self._population.long_covid[self._index] = value
+
+    @property
+    def days_since_positive(self) -> float:
+        """n-day from first day of positivity"""
+        return self._population.days_since_positive[self._index]
+
+    @days_since_positive.setter
+    def days_since_positive(self, value: float) -> None:
+        self._population.days_since_positive[self._index] = value
+
+    @property
+    def _status(self) -> float:
+        return self._population.status[self._index]
+
+    @_status.setter
+    def _status(self, value: float) -> None:
+        self._population.status[self._index] = value
+
+    @property
+    def chosen_actions(self) -> np.ndarray:
+        return self._population.chosen_actions[self._index]
+
+    @chosen_actions.setter
+    def chosen_actions(self, actions: np.ndarray) -> None:
+        self._population.chosen_actions[self._index] = actions
 
     def get_features(self) -> pd.Series:
         """
@@ -31,7 +89,15 @@ class Individual:
             pd.Series: represents an individual (agent)
             with their various features
         """
-        return self._features
+        return pd.Series(
+            self._population.features[self._index],
+            index=Population.feature_names,
+            name=self.id,
+        )
+
+    @property
+    def _features(self) -> pd.Series:
+        return self.get_features()
 
     def get_status(self) -> float:
         """
@@ -119,8 +185,9 @@ class Individual:
 
         The function uses a gamma cumulative distribution
         function with shape parameter 5 and scale parameter 3
-        to model the probability of recovery. This can be of
-        course changed based on the literature.
+        (7 and 10 for long covid cases) to model the probability
+        of recovery, precomputed for every day in `RECOVERY_TABLE`.
+        This can be of course changed based on the literature.
         Note that if `n_days` is equal or lower than 10,
         then the probability of recovering is always 0,
         as per Astrid's suggestion.
@@ -140,12 +207,9 @@ class Individual:
         if rng is None:
             rng = np.random.default_rng(None)
 
-        if self.is_long_covid():
-            # long covid recovery
-            recovery_prob = gamma.cdf(self.days_since_positive, a=7, scale=10)
-        else:
-            # standard recovery
-            recovery_prob = gamma.cdf(self.days_since_positive, a=5, scale=3)
+        # long covid or standard recovery
+        long_covid = int(self.is_long_covid())
+        recovery_prob = recovery_probability(self.days_since_positive, long_covid)
 
         recovery = rng.uniform() <= recovery_prob
         return recovery
@@ -212,18 +276,28 @@ class Individual:
         -------
         sample (pandas.dataFrame): dataframe containing the sampling
         """
-        fpath_weights = os.path.join(dir_params, PARAMS_IPF_WEIGHTS)
+        return Population.sampling_from_ipf(size, dir_params, rng)
 
-        df_weights = pd.read_csv(fpath_weights, sep=",", index_col=0)
-        weights = df_weights["weight"] / df_weights["weight"].sum()
-        indices = df_weights.index
-        # use the new random method of numpy
-        if rng is None:
-            rng = np.random.default_rng(None)
-        sample_indices = rng.choice(indices, size, p=weights)
-        sample = df_weights.loc[sample_indices].drop(["weight"], axis=1)
-        sample = sample.reset_index(drop=True)
-        return sample
+    @staticmethod
+    def from_population(population: Population, dir_params: str) -> list:
+        """
+        Create the individual agents of a population. Their state is
+        stored in (and shared with) the population arrays.
+
+        Args:
+            population (Population): the population of agents.
+            dir_params (str): path to parameters folder.
+
+        Returns:
+            List[Individual]: A list containing instances of
+            the individual class, one per agent of the population.
+        """
+        return [
+            Individual(i, dir_params, population=population)
+            for i in tqdm(
+                range(population.size), desc="Populating individuals", unit="i"
+            )
+        ]
 
     @staticmethod
     def populate_ipf(size: int, dir_params: str, rng=None) -> list:
@@ -243,26 +317,8 @@ class Individual:
             the individual class, each representing an
             agent with specific features.
         """
-        _features = pd.DataFrame()
-
-        sample = Individual.sampling_from_ipf(size, dir_params, rng)
-
-        # one-hot encoding
-        encoded_columns = pd.get_dummies(sample)
-        encoded_columns.columns = map(str.lower, encoded_columns.columns)
-        encoded_columns = encoded_columns.reindex(
-            columns=Hypothesis.all_possible_features, fill_value=0
-        )
-        _features = pd.concat([_features, encoded_columns], axis=1)
-
-        # Add 'baseline' column filled with ones if this is not present yet
-        if "baseline" not in _features.columns:
-            _features.insert(0, "baseline", 1)
-
-        return [
-            Individual(i, dir_params, _features.iloc[i])
-            for i in tqdm(range(size), desc="Populating individuals", unit="i")
-        ]
+        population = Population.populate_ipf(size, dir_params, rng)
+        return Individual.from_population(population, dir_params)
 
     @staticmethod
     def populate(size: int, dir_params: str, rng=None) -> list:
@@ -274,8 +330,6 @@ class Individual:
             size (int): population size, i.e., number of agents.
             dir_params (str): dir to the folder containing
             feature parameter file.
-            #from_scratch (bool, optional): flag of creating hypothesis
-            from scratch or reading from files. Defaults to False.
             rng (np.random.Generator): optional. An instance of numpy random
             generator. If not provided, a default random generator will be
             used. This ensures reproducibility.
@@ -283,42 +337,5 @@ class Individual:
         Returns:
             list[Individual]: a list of Individual agents
         """
-        assert size > 0, "Size must be positive!"
-        assert isinstance(size, int), "Size must be integer!"
-        assert os.path.isdir(dir_params), "Given folder doesn't exist!"
-
-        fpath_params_individual = os.path.join(dir_params, PARAMS_INDIVIDUAL)
-        with open(fpath_params_individual) as f:
-            features = json.load(f)
-
-        _features = pd.DataFrame()
-        for feature, distribution in features.items():
-            # new numpy random method
-            if rng is None:
-                # quality gate complains about security if
-                # I don't use a large range
-                rng = np.random.default_rng(None)
-            _features[feature] = rng.choice(distribution[0], size, p=distribution[1])
-
-            # Define all possible columns (including those not in the sample)
-            # When the sample size is too small,
-            # this doesn't cover all categories,
-            # the resulting DataFrame thus lacks those columns.
-            # To solve the issue, we ensure all possible categories are present
-            # when creating the dummy variables
-
-        # one-hot encoding
-        categorical_cols = _features.select_dtypes(include=["object"])
-        encoded_cols = pd.get_dummies(categorical_cols).reindex(
-            columns=Hypothesis.all_possible_features, fill_value=0
-        )
-        _features = _features.drop(categorical_cols.columns, axis=1)
-        _features = pd.concat([_features, encoded_cols], axis=1)
-
-        # Add 'baseline' column filled with ones
-        _features.insert(0, "baseline", 1)
-
-        return [
-            Individual(i, dir_params, _features.iloc[i])
-            for i in tqdm(range(size), desc="Populating individuals", unit="i")
-        ]
+        population = Population.populate(size, dir_params, rng)
+        return Individual.from_population(population, dir_params)
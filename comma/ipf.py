@@ -0,0 +1,360 @@
+"""Fitting and sampling the joint distribution of the agents via IPF
+"""
+from comma.cache import cache_path, file_hash, write_entry
+from comma.hypothesis import PARAMS_IPF_WEIGHTS
+import json
+import numpy as np
+import os
+import pandas as pd
+import warnings
+
+# version of the compiled tables and of the draws from them, part of the
+# keys of the caches: bump it when either changes
+IPF_VERSION = 1
+
+
+def alias_table(weights: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Build the alias table of a discrete distribution (Vose's method),
+    to draw from it in O(1) per sample.
+
+    Args:
+        weights (np.ndarray): non-negative weights of the outcomes
+
+    Returns:
+        prob (np.ndarray): probability of keeping each outcome
+        alias (np.ndarray): outcome drawn instead, otherwise
+    """
+    n = len(weights)
+    scaled = np.asarray(weights, dtype=np.float64) * n / np.sum(weights)
+    prob = np.ones(n, dtype=np.float64)
+    alias = np.arange(n, dtype=np.int64)
+
+    small = list(np.flatnonzero(scaled < 1))
+    large = list(np.flatnonzero(scaled >= 1))
+    scaled = scaled.tolist()
+    while small and large:
+        s = small.pop()
+        g = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = g
+        scaled[g] = (scaled[g] + scaled[s]) - 1
+        if scaled[g] < 1:
+            small.append(g)
+        else:
+            large.append(g)
+    # what is left has probability 1 (up to rounding errors)
+    return prob, alias
+
+
+class IPFTable:
+    """
+    The IPFTable class holds the joint distribution obtained via IPF,
+    compiled for sampling: the categories of every variable are integer
+    coded, and the weights are turned into an alias table and into their
+    normalised cumulative sum.
+
+    Compiled tables are cached on disk as numpy arrays, keyed by the
+    hash of the weights file, and memory-mapped when loaded.
+    """
+
+    def __init__(
+        self,
+        categories: dict,
+        codes: np.ndarray,
+        prob: np.ndarray,
+        alias: np.ndarray,
+        cdf: np.ndarray,
+    ):
+        self.categories = categories  # {variable: list of categories}
+        self.codes = codes  # (n_rows, n_variables) category codes
+        self.prob = prob
+        self.alias = alias
+        self.cdf = cdf
+
+    @property
+    def variables(self) -> list[str]:
+        """
+        Get the names of the variables, in the order of the columns of `codes`
+
+        Returns:
+            list: names of the variables
+        """
+        return list(self.categories)
+
+    @classmethod
+    def compile(cls, fpath_weights: str) -> "IPFTable":
+        """
+        Compile a weights file
+
+        Args:
+            fpath_weights (str): path to the weights file, with one
+            column per variable and a `weight` column.
+
+        Returns:
+            IPFTable: the compiled table
+        """
+        df_weights = pd.read_csv(fpath_weights, sep=",", index_col=0)
+        weights = df_weights.pop("weight")
+        # the cumulative weights as computed by `rng.choice(..., p=weights)`
+        cdf = (weights / weights.sum()).to_numpy(dtype=np.float64).cumsum()
+        cdf /= cdf[-1]
+        weights = weights.to_numpy(dtype=np.float64)
+
+        categories = {}
+        codes = np.empty(df_weights.shape, dtype=np.int16)
+        for i, variable in enumerate(df_weights.columns):
+            codes[:, i], uniques = pd.factorize(
+                df_weights[variable], use_na_sentinel=False
+            )
+            categories[variable] = uniques.tolist()
+
+        prob, alias = alias_table(weights)
+        return cls(categories, codes, prob, alias, cdf)
+
+    def save(self, path: str) -> None:
+        """
+        Save the table in a folder
+
+        Args:
+            path (str): path of the folder
+        """
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "categories.json"), "w") as f:
+            json.dump(self.categories, f)
+        for name in ["codes", "prob", "alias", "cdf"]:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, path: str) -> "IPFTable":
+        """
+        Load a table saved with `save`, the arrays are memory-mapped
+
+        Args:
+            path (str): path of the folder
+
+        Returns:
+            IPFTable: the table
+        """
+        with open(os.path.join(path, "categories.json")) as f:
+            categories = json.load(f)
+        codes, prob, alias, cdf = [
+            np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in ["codes", "prob", "alias", "cdf"]
+        ]
+        return cls(categories, codes, prob, alias, cdf)
+
+    def sample(self, size: int, rng=None, alias: bool = False) -> np.ndarray:
+        """
+        Draw rows of the table. By default, the draws are the ones of
+        `rng.choice(rows, size, p=weights)`, so that a seeded population
+        is the same as with earlier versions.
+
+        Args:
+            size (int): number of rows to draw
+            rng (np.random.Generator): optional. An instance of numpy random
+            generator. If not provided, a default random generator will be
+            used. This ensures reproducibility.
+            alias (bool): draw with the alias method instead, in O(1) per
+            row rather than a binary search of the cumulative weights.
+
+        Returns:
+            np.ndarray: indices of the rows drawn
+        """
+        if rng is None:
+            rng = np.random.default_rng(None)
+        if not alias:
+            return self.cdf.searchsorted(rng.random(size), side="right")
+        rows = rng.integers(len(self.prob), size=size)
+        keep = rng.random(size) < self.prob[rows]
+        return np.where(keep, rows, self.alias[rows])
+
+    def sample_codes(self, size: int, rng=None, alias: bool = False) -> dict:
+        """
+        Draw agents from the joint distribution
+
+        Args:
+            size (int): number of agents
+            rng (np.random.Generator): optional random generator
+            alias (bool): draw with the alias method, see `sample`
+
+        Returns:
+            dict: for each variable, the array of category codes of the agents
+        """
+        codes = self.codes[self.sample(size, rng, alias)]
+        return {variable: codes[:, i] for i, variable in enumerate(self.categories)}
+
+
+def load_ipf_table(dir_params: str, cache_dir: str = None) -> IPFTable:
+    """
+    Get the compiled IPF table of a parameters folder. The table is
+    compiled the first time and then read from the cache, as long as
+    the weights file doesn't change.
+
+    Args:
+        dir_params (str): path to the parameters folder
+        cache_dir (str): optional. Cache folder, `comma.cache.CACHE_DIR`
+        if not provided.
+
+    Returns:
+        IPFTable: the compiled table
+    """
+    fpath_weights = os.path.join(dir_params, PARAMS_IPF_WEIGHTS)
+    path = cache_path(cache_dir, f"ipf-{IPF_VERSION}-{file_hash(fpath_weights)}")
+    if not os.path.isdir(path):
+        table = IPFTable.compile(fpath_weights)
+        write_entry(path, table.save)
+    return IPFTable.load(path)
+
+
+class IPFFit:
+    """
+    The IPFFit class holds the result of `fit_ipf`: the joint weights as
+    an N-dimensional array, one axis per variable, and how the fitting went.
+    """
+
+    def __init__(
+        self,
+        categories: dict,
+        weights: np.ndarray,
+        iterations: int,
+        max_error: float,
+        converged: bool,
+    ):
+        self.categories = categories  # {variable: list of categories}
+        self.weights = weights
+        self.iterations = iterations
+        self.max_error = max_error
+        self.converged = converged
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Get the weights as a long table: one column per variable, and a
+        `weight` column. Combinations with zero weight are left out.
+
+        Returns:
+            pd.DataFrame: the weights
+        """
+        nonzero = np.nonzero(self.weights)
+        df = pd.DataFrame(
+            {
+                variable: np.asarray(categories, dtype=object)[codes]
+                for (variable, categories), codes in zip(
+                    self.categories.items(), nonzero
+                )
+            }
+        )
+        df["weight"] = self.weights[nonzero]
+        return df
+
+    def save(self, dir_params: str) -> str:
+        """
+        Write the weights file read by `Individual.populate_ipf`
+
+        Args:
+            dir_params (str): path to the parameters folder
+
+        Returns:
+            str: path of the weights file
+        """
+        fpath_weights = os.path.join(dir_params, PARAMS_IPF_WEIGHTS)
+        self.to_frame().to_csv(fpath_weights, sep=",")
+        return fpath_weights
+
+
+def _variables_of(table) -> list[str]:
+    names = [table.index.name]
+    if isinstance(table, pd.DataFrame):
+        names.append(table.columns.name)
+    if any(name is None for name in names):
+        raise ValueError(
+            "The index (and columns) of the marginal tables must be named "
+            "after their variable, as in pd.crosstab"
+        )
+    return names
+
+
+def fit_ipf(
+    marginals: list,
+    categories: dict = None,
+    tol: float = 1e-6,
+    max_iter: int = 1000,
+    verbose: bool = False,
+) -> IPFFit:
+    """
+    Fit the joint distribution of a set of categorical variables to
+    their marginals with iterative proportional fitting (raking).
+
+    The joint distribution is an N-dimensional array with one axis per
+    variable. At each iteration it is scaled, marginal by marginal, so
+    that its sum over the other axes matches the marginal. Every marginal
+    is normalised to sum to 1, the fitting stops when the largest
+    difference between the fitted and the target marginals is below `tol`.
+
+    Args:
+        marginals (list): one- or two-way tables of counts, either
+        pd.Series or pd.DataFrame (e.g. built by pd.crosstab), whose index
+        and columns are named after their variable.
+        categories (dict): optional. For each variable, the list of its
+        categories. By default, the categories found in the marginals.
+        tol (float): convergence tolerance.
+        max_iter (int): maximum number of iterations.
+        verbose (bool): print the error at every iteration.
+
+    Returns:
+        IPFFit: the fitted weights
+    """
+    if categories is None:
+        categories = {}
+        for table in marginals:
+            labels = [table.index]
+            if isinstance(table, pd.DataFrame):
+                labels.append(table.columns)
+            for variable, values in zip(_variables_of(table), labels):
+                known = categories.setdefault(variable, [])
+                known += [value for value in values if value not in known]
+    variables = list(categories)
+    shape = tuple(len(categories[variable]) for variable in variables)
+
+    # targets: (axes of the joint array, normalised marginal on those axes)
+    targets = []
+    for table in marginals:
+        names = _variables_of(table)
+        if isinstance(table, pd.DataFrame):
+            table = table.reindex(
+                index=categories[names[0]], columns=categories[names[1]]
+            )
+        else:
+            table = table.reindex(categories[names[0]])
+        target = table.fillna(0).to_numpy(dtype=np.float64)
+        axes = [variables.index(name) for name in names]
+        if len(axes) == 2 and axes[0] > axes[1]:
+            axes.reverse()
+            target = target.T
+        targets.append((tuple(axes), target / target.sum()))
+
+    joint = np.full(shape, 1 / np.prod(shape))
+    max_error = np.inf
+    iteration = 0
+    for iteration in range(1, max_iter + 1):
+        max_error = 0.0
+        for axes, target in targets:
+            other_axes = tuple(i for i in range(len(shape)) if i not in axes)
+            margin = joint.sum(axis=other_axes)
+            max_error = max(max_error, np.abs(margin - target).max())
+            ratio = np.divide(
+                target, margin, out=np.zeros_like(target), where=margin > 0
+            )
+            joint *= np.expand_dims(ratio, other_axes)
+        if verbose:
+            print(f"IPF iteration {iteration}: max error {max_error:.3g}")
+        if max_error < tol:
+            break
+
+    converged = max_error < tol
+    if not converged:
+        warnings.warn(
+            f"IPF did not converge after {iteration} iterations "
+            f"(max error {max_error:.3g}, tolerance {tol:.3g})"
+        )
+    return IPFFit(categories, joint, iteration, max_error, converged)
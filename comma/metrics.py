@@ -0,0 +1,297 @@
+"""Metrics of the phases of a simulation
+"""
+import contextlib
+import cProfile
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_mb() -> float:
+    """
+    Get the peak resident memory of the process so far
+
+    Returns:
+        float: peak resident memory in MB, NaN where it is not available
+    """
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+
+
+class NoMetrics:
+    """
+    The NoMetrics class is the default metrics of a model: it measures
+    nothing, so that a run pays almost nothing for the instrumentation.
+    """
+
+    enabled = False
+    _null_context = contextlib.nullcontext()
+
+    def phase(self, name: str):
+        return self._null_context
+
+    def start_run(self, steps: int, size: int) -> None:
+        pass
+
+    def end_setup(self, phases: dict = None) -> None:
+        pass
+
+    def start_step(self, step: int) -> None:
+        pass
+
+    def end_step(self, step: int, lockdown: str) -> None:
+        pass
+
+    def end_run(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+NO_METRICS = NoMetrics()
+
+
+class Metrics(NoMetrics):
+    """
+    The Metrics class measures the wall time of the phases of a run:
+
+    - setup: `population` (when the model was created), `new_cases`
+      (the positive cases, downloaded if needed) and `hypotheses`
+    - every step: `recovery`, `infection`, `actions` (choice of the
+      actions), `effects` (their effects on mental health), `update`,
+      `report` (writing the step) and `checkpoint`
+
+    It emits one record per step, with the time of its phases, the
+    agent-steps per second, the peak resident memory of the process and
+    the net change of the number of live memory blocks of the interpreter
+    (`net_live_blocks`: the blocks allocated and not freed during the
+    step, so it can be zero or negative for a step that allocates a
+    lot), plus a record of the setup and one of the whole run. The
+    records are dictionaries given to `callback`, and/or lines of the
+    JSON-lines file `path`.
+
+    The steps in `profile_steps` (a range, `(start, stop)`) can be
+    profiled with cProfile, the statistics are saved in `profile_path`.
+    The memory allocated during the steps in `trace_steps` can be traced
+    with tracemalloc: their records have the peak of the traced memory,
+    and the most memory allocated during the step on top of what was
+    allocated before (`traced_allocated_mb`). The largest allocation
+    sites are emitted in a `tracemalloc` record.
+    """
+
+    enabled = True
+
+    def __init__(
+        self,
+        callback=None,
+        path: str = None,
+        profile_steps: tuple = None,
+        profile_path: str = None,
+        trace_steps: tuple = None,
+        top: int = 10,
+    ):
+        if profile_steps is not None and profile_path is None:
+            raise ValueError("profile_path is needed to profile steps")
+        self.callback = callback
+        self.path = path
+        self.profile_steps = profile_steps
+        self.profile_path = profile_path
+        self.trace_steps = trace_steps
+        self.top = top  # number of allocation sites reported
+        self._profiler = None
+        self._file = None
+        self._phases: dict = {}
+        self._started_tracing = False  # tracemalloc was started by the metrics
+
+    def phase(self, name: str):
+        return self._timed(name)
+
+    @contextlib.contextmanager
+    def _timed(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._phases[name] = self._phases.get(name, 0.0) + elapsed
+
+    def emit(self, record: dict) -> None:
+        """
+        Send a record to the callback and to the metrics file
+
+        Args:
+            record (dict): the record
+        """
+        if self.callback is not None:
+            self.callback(record)
+        if self._file is not None:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def start_run(self, steps: int, size: int) -> None:
+        """
+        Start measuring a run
+
+        Args:
+            steps (int): number of steps of the simulation
+            size (int): number of agents
+        """
+        self.steps = steps
+        self.size = size
+        self._file = None if self.path is None else open(self.path, "a")
+        self._phases = {}
+        self._totals: dict = {}
+        self._steps_run = 0
+        self._steps_seconds = 0.0
+        self._run_start = time.perf_counter()
+        self._run_blocks = sys.getallocatedblocks()
+
+    def end_setup(self, phases: dict = None) -> None:
+        """
+        Emit the record of the setup of the run
+
+        Args:
+            phases (dict): optional. Times of the phases of the setup
+            measured before the run, e.g. the creation of the population
+        """
+        self._phases.update(phases or {})
+        self.emit(
+            {
+                "event": "setup",
+                "steps": self.steps,
+                "agents": self.size,
+                "phases": self._phases,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+        )
+        self._phases = {}
+
+    def _in_range(self, steps: tuple, step: int) -> bool:
+        return steps is not None and steps[0] <= step < steps[1]
+
+    def start_step(self, step: int) -> None:
+        """
+        Start measuring a step
+
+        Args:
+            step (int): the step
+        """
+        if self._in_range(self.trace_steps, step):
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+            self._traced_start = tracemalloc.get_traced_memory()[0]
+        if self._in_range(self.profile_steps, step):
+            if self._profiler is None:
+                self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._step_blocks = sys.getallocatedblocks()
+        self._step_start = time.perf_counter()
+
+    def end_step(self, step: int, lockdown: str) -> None:
+        """
+        Emit the record of a step
+
+        Args:
+            step (int): the step
+            lockdown (str): lockdown of the step
+        """
+        seconds = time.perf_counter() - self._step_start
+        if self._in_range(self.profile_steps, step):
+            self._profiler.disable()
+        record = {
+            "event": "step",
+            "step": step,
+            "lockdown": lockdown,
+            "seconds": seconds,
+            "agent_steps_per_second": self.size / seconds if seconds > 0 else None,
+            "phases": self._phases,
+            "peak_rss_mb": peak_rss_mb(),
+            "net_live_blocks": sys.getallocatedblocks() - self._step_blocks,
+        }
+        traced = self._in_range(self.trace_steps, step)
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            record["traced_peak_mb"] = peak / (1 << 20)
+            record["traced_allocated_mb"] = (peak - self._traced_start) / (1 << 20)
+        self.emit(record)
+        if traced and step in [self.trace_steps[1] - 1, self.steps - 1]:
+            self._emit_tracemalloc()
+
+        for name, value in self._phases.items():
+            self._totals[name] = self._totals.get(name, 0.0) + value
+        self._phases = {}
+        self._steps_run += 1
+        self._steps_seconds += seconds
+
+    def _emit_tracemalloc(self) -> None:
+        snapshot = tracemalloc.take_snapshot()
+        self._stop_tracing()
+        self.emit(
+            {
+                "event": "tracemalloc",
+                "steps": list(self.trace_steps),
+                "top": [
+                    {
+                        "where": f"{stat.traceback[0].filename}:"
+                        f"{stat.traceback[0].lineno}",
+                        "size_mb": stat.size / (1 << 20),
+                        "count": stat.count,
+                    }
+                    for stat in snapshot.statistics("lineno")[: self.top]
+                ],
+            }
+        )
+
+    def _stop_tracing(self) -> None:
+        # the tracing started by the caller goes on
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def end_run(self) -> None:
+        """
+        Emit the record of the whole run, and save the profile if any
+        """
+        seconds = self._steps_seconds
+        self.emit(
+            {
+                "event": "run",
+                "steps": self._steps_run,
+                "agents": self.size,
+                "seconds": time.perf_counter() - self._run_start,
+                "agent_steps_per_second": (
+                    self.size * self._steps_run / seconds if seconds > 0 else None
+                ),
+                "phases": self._totals,
+                "peak_rss_mb": peak_rss_mb(),
+                "net_live_blocks": sys.getallocatedblocks() - self._run_blocks,
+            }
+        )
+        if self._profiler is not None:
+            self._profiler.dump_stats(self.profile_path)
+            self.emit({"event": "profile", "path": self.profile_path})
+        self.close()
+
+    def close(self) -> None:
+        """
+        Stop measuring, e.g. when a run fails
+        """
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler = None
+        self._stop_tracing()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,31 +1,87 @@
 """Model class definition
 """
+from comma.aggregate import Aggregator
+from comma.bundle import load_bundle
 from comma.individual import Individual
+from comma.history import History
 from comma.hypothesis import Hypothesis
+from comma.metrics import NO_METRICS
+from comma.population import Population, cached_population
+from comma.writer import WRITERS, get_writer, iter_results
+import copy
+import json
 import pandas as pd
 import numpy as np
+import os
+import time
 from tqdm import tqdm
 
 
 class Model:
     def __init__(
-        self, size: int, dir_params: str, use_ipf: bool = False, seed=None
+        self,
+        size: int,
+        dir_params: str,
+        use_ipf: bool = False,
+        seed=None,
+        vectorized: bool = False,
+        cache_population: bool = False,
+        population: Population = None,
     ) -> None:
         self.simulation_id: int = None
+        self.vectorized: bool = vectorized  # use `step_vectorized` in `run`
         self.current_step: int = 0  # keep track of the current simulation step
         self.lockdown_status: dict = {}
         self.dir_params: str = dir_params
-        self.cumulative_status = dict()
-        if seed is not None:
-            seed_value = np.random.SeedSequence(seed)
-            self.rng = np.random.default_rng(seed_value)
+        self.history: History = None  # allocated when the simulation runs
+        self.metrics = NO_METRICS  # the metrics of the current run, if any
+        if isinstance(seed, np.random.SeedSequence):
+            # e.g. a child seed spawned for a replicate of an ensemble
+            self.seed_sequence = seed
         else:
-            self.rng = np.random.default_rng(None)
-
-        if use_ipf:
-            self.agents = Individual.populate_ipf(size, self.dir_params, self.rng)
+            self.seed_sequence = np.random.SeedSequence(seed)
+        # the seeds of forked models are spawned from `seed_sequence`
+        self.rng = np.random.default_rng(self.seed_sequence)
+
+        # the population arrays hold the state of the model, the agents
+        # are bound to them
+        start = time.perf_counter()
+        if population is not None:
+            # e.g. a population shared with other processes
+            if population.size != size:
+                raise ValueError(
+                    f"The population has {population.size} agents, " f"expected {size}"
+                )
+            self.population = population
+        elif cache_population:
+            # reuse the population created before with the same parameters
+            self.population = cached_population(
+                size, self.dir_params, seed, self.rng, use_ipf
+            )
+        elif use_ipf:
+            # an unseeded population doesn't need the draws of earlier versions
+            self.population = Population.populate_ipf(
+                size, self.dir_params, self.rng, alias=seed is None
+            )
         else:
-            self.agents = Individual.populate(size, self.dir_params, self.rng)
+            self.population = Population.populate(size, self.dir_params, self.rng)
+        self._agents: list = None  # created when they are first used
+        self._checkpoint_features: str = None  # saved once per run
+        self.population_seconds = time.perf_counter() - start
+
+    @property
+    def agents(self) -> list:
+        """
+        Get the agents, views on the population arrays. They are only
+        created when they are used, e.g. by `step`: the vectorized
+        engine works on the population arrays, and doesn't need them.
+
+        Returns:
+            list: the agents, as `Individual`
+        """
+        if self._agents is None:
+            self._agents = Individual.from_population(self.population, self.dir_params)
+        return self._agents
 
     def update_covid_counter(self):
         """
@@ -34,9 +90,8 @@ class Model:
         Returns:
             None. This function updates the agent's covid counter in place.
         """
-        for agent in self.agents:
-            if agent.covid_status == 1:
-                agent.days_since_positive += 1
+        positives = self.population.covid_status == 1
+        self.population.days_since_positive[positives] += 1
 
     def get_recovered_individuals(self) -> list[int]:
         """
@@ -49,9 +104,7 @@ class Model:
             recovered (list): List of indices of recovered agents
 
         """
-        positives = [
-            index for index, agent in enumerate(self.agents) if agent.covid_status == 1
-        ]
+        positives = np.flatnonzero(self.population.covid_status == 1)
         recovered = []
         for i in positives:
             if self.agents[i].is_recovered():
@@ -60,7 +113,11 @@ class Model:
         return recovered
 
     def step(
-        self, lockdown: pd.DataFrame, action_effects: pd.DataFrame, new_infected: int
+        self,
+        lockdown: pd.DataFrame,
+        action_effects: pd.DataFrame,
+        new_infected: int,
+        lockdown_infected: pd.DataFrame = None,
     ) -> None:
         """Actions to be performed in each step.
 
@@ -68,50 +125,112 @@ class Model:
             lockdown (pd.DataFrame): lockdown dataframe
             action_effects (pd.Dataframe): actions dataframe
             new_infected (int): number of new infected
+            lockdown_infected (pd.DataFrame): lockdown dataframe of
+            the positive agents. Derived from `lockdown` if not given.
         Returns:
             actions: array of booleans
             action_probs: array of probabilities
         """
-        # update counter
-        self.update_covid_counter()
-        # check recovery
-        recovered_idx = self.get_recovered_individuals()
-
-        if recovered_idx:
-            for i in recovered_idx:
-                # if recovered reset their covid status
-                self.agents[i].covid_status = 0
-                self.agents[i].long_covid = 0
-                # and reset the counter
-                self.agents[i].days_since_positive = 0
-
-        # extract agents who are negative
-        negative_agents = [agent for agent in self.agents if agent.covid_status == 0]
-        # print(f"left: {len(negative_agents)}")
-        # make some of them positive (selected randomly)
-        random_rng = np.random.default_rng(None)
-        newly_infected_agents = random_rng.choice(
-            negative_agents, new_infected, replace=False
-        )
+        metrics = self.metrics
+        with metrics.phase("recovery"):
+            # update counter
+            self.update_covid_counter()
+            # check recovery
+            recovered_idx = self.get_recovered_individuals()
+
+            # if recovered reset their covid status
+            self.population.covid_status[recovered_idx] = 0
+            self.population.long_covid[recovered_idx] = 0
+            # and reset the counter
+            self.population.days_since_positive[recovered_idx] = 0
+
+        with metrics.phase("infection"):
+            # extract agents who are negative
+            negative_agents = [
+                self.agents[i]
+                for i in np.flatnonzero(self.population.covid_status == 0)
+            ]
+            # print(f"left: {len(negative_agents)}")
+            # make some of them positive (selected randomly)
+            random_rng = np.random.default_rng(None)
+            newly_infected_agents = random_rng.choice(
+                negative_agents, new_infected, replace=False
+            )
 
-        # mark selected agents as infected (covid_status = 1)
-        # and update counter of positive days for positive people
-        for agent in newly_infected_agents:
-            agent.covid_status = 1
-            agent.days_since_positive = 1
-
-        for agent in self.agents:
-            if agent.covid_status == 0:
-                # choose actions based on lockdown
-                agent.choose_actions_on_lockdown(lockdown, rng=self.rng)
-                # take those actions, and compute their effect on mental health
-            else:
-                # positive agents stay at home
-                lockdown_updated = agent.modify_policy_when_infected(lockdown)
-                agent.choose_actions_on_lockdown(lockdown_updated, rng=self.rng)
-                # depending on lockdown staying at home
-                # has certain consequences on mental health
-            agent.take_actions(action_effects)
+            # mark selected agents as infected (covid_status = 1)
+            # and update counter of positive days for positive people
+            for agent in newly_infected_agents:
+                agent.covid_status = 1
+                agent.days_since_positive = 1
+
+        if lockdown_infected is None:
+            lockdown_infected = Individual.modify_policy_when_infected(lockdown)
+
+        # the agents choose their actions and take them in turn,
+        # both are measured as `actions`
+        with metrics.phase("actions"):
+            for agent in self.agents:
+                if agent.covid_status == 0:
+                    # choose actions based on lockdown
+                    agent.choose_actions_on_lockdown(lockdown, rng=self.rng)
+                    # take those actions, and compute their effect on mental health
+                else:
+                    # positive agents stay at home
+                    agent.choose_actions_on_lockdown(lockdown_infected, rng=self.rng)
+                    # depending on lockdown staying at home
+                    # has certain consequences on mental health
+                agent.take_actions(action_effects)
+
+    def step_vectorized(
+        self,
+        lockdown: pd.DataFrame,
+        action_effects: pd.DataFrame,
+        new_infected: int,
+        lockdown_infected: pd.DataFrame = None,
+    ) -> None:
+        """Actions to be performed in each step, on the whole population at once.
+
+        Same as `step`, but recovery, infection, the choice of actions and
+        their effects are computed with array operations over the population.
+        All random numbers are drawn from the model's random generator.
+
+        Args:
+            lockdown (pd.DataFrame): lockdown dataframe
+            action_effects (pd.Dataframe): actions dataframe
+            new_infected (int): number of new infected
+            lockdown_infected (pd.DataFrame): lockdown dataframe of
+            the positive agents. Derived from `lockdown` if not given.
+        """
+        population = self.population
+        metrics = self.metrics
+        with metrics.phase("recovery"):
+            # update counter
+            self.update_covid_counter()
+            # check recovery
+            recovered_idx = population.get_recovered(rng=self.rng)
+            # if recovered reset their covid status and the counter
+            population.covid_status[recovered_idx] = 0
+            population.long_covid[recovered_idx] = 0
+            population.days_since_positive[recovered_idx] = 0
+
+        with metrics.phase("infection"):
+            # make some of the negative agents positive (selected randomly)
+            negative_idx = np.flatnonzero(population.covid_status == 0)
+            newly_infected_idx = self.rng.choice(
+                negative_idx, new_infected, replace=False
+            )
+            population.covid_status[newly_infected_idx] = 1
+            population.days_since_positive[newly_infected_idx] = 1
+
+        # choose actions based on lockdown, positive agents stay at home
+        if lockdown_infected is None:
+            lockdown_infected = Individual.modify_policy_when_infected(lockdown)
+        with metrics.phase("actions"):
+            population.choose_actions_on_lockdown(
+                lockdown, rng=self.rng, lockdown_infected=lockdown_infected
+            )
+        with metrics.phase("effects"):
+            population.take_actions(action_effects)
 
     def update(self, lockdown: str, step: int) -> None:
         """
@@ -121,93 +240,48 @@ class Model:
             lockdown (str): lockdown type
             step (int): step of the simulation
         """
+        if self.history is None:
+            self.history = History(step + 1, self.population.size)
+        self.history.extend(step + 1)
+
         if self.current_step == 0:
-            delta_mh = 0  # it's day 0, so no incremental change
-            self.cumulative_status[step] = [
-                (
-                    lockdown,
-                    agent.id,
-                    delta_mh,
-                    agent.get_status(),
-                    agent.covid_status,
-                    agent.days_since_positive,
-                )
-                for agent in self.agents
-            ]
+            # it's day 0, so no incremental change
+            delta_mh = np.zeros(self.population.size)
+            mh = self.population.status
         else:
             # from step 1++, sum the agent's status with the previous status
-            agent_statuses = []
-            for agent in self.agents:
-                last_status = [
-                    status
-                    for status in self.cumulative_status[step - 1]
-                    if status[1] == agent.id
-                ][0][-3]
-                delta_mh = agent.get_status()  # this is the incremental effect
-                mu, sigma = 0.002, 0.0005
-                # this is the baseline effect when no action is taken
-                # or when action effects are canceled out
-                update_rng = np.random.default_rng(None)
-                baseline = update_rng.normal(mu, sigma)
-                new_status = (
-                    lockdown,
-                    agent.id,
-                    delta_mh,
-                    (last_status + delta_mh) - baseline,
-                    agent.covid_status,
-                    agent.days_since_positive,
-                )
-                agent_statuses.append(new_status)
-            self.cumulative_status[step] = agent_statuses
+            delta_mh = self.population.status  # this is the incremental effect
+            mu, sigma = 0.002, 0.0005
+            # this is the baseline effect when no action is taken
+            # or when action effects are canceled out
+            baseline = self.rng.normal(mu, sigma, self.population.size)
+            last_mh = self.history.mh[self.history.row(step - 1)]
+            mh = (last_mh + delta_mh) - baseline
+
+        self.history.record(
+            step,
+            lockdown,
+            delta_mh,
+            mh,
+            self.population.covid_status,
+            self.population.days_since_positive,
+        )
 
-    def report(self, out_path: str) -> None:
+    def report(
+        self, out_path: str, output_format: str = "csv", chunk_rows: int = 1_000_000
+    ) -> None:
         """
         Collect data recorded at the end of the simulation
-        and exports it as csv file.
+        and exports it as csv (or parquet, feather, npz) file.
 
         Args:
             out_path (str): File path of the output file
+            output_format (str): One of "csv", "parquet", "feather", "npz"
+            chunk_rows (int): Number of rows written to disk at once
         """
-        status_data = []
-
-        for step_id, agent_statuses in self.cumulative_status.items():
-            for agent_status in agent_statuses:
-                (
-                    lockdown,
-                    agent_id,
-                    delta_mh,
-                    mh,
-                    covid_status,
-                    days_since_positive,
-                ) = agent_status
-                status_data.append(
-                    [
-                        step_id,
-                        lockdown,
-                        agent_id,
-                        delta_mh,
-                        mh,
-                        covid_status,
-                        days_since_positive,
-                    ]
-                )
-
-        # create a pandas dataframe to store data from `status_data`
-        status_df = pd.DataFrame(
-            status_data,
-            columns=[
-                "step_id",
-                "lockdown",
-                "agent_id",
-                "delta_mental_health",
-                "cumulative_mental_health",
-                "covid_status",
-                "days_since_first_infection",
-            ],
-        )
-
-        # Export to a csv
-        status_df.to_csv(out_path, index=False, sep=";", decimal=",", mode="w+")
+        with get_writer(out_path, output_format, chunk_rows) as writer:
+            for step in range(self.history.recorded):
+                writer.write(self.history.to_frame(step, step + 1))
 
     def run(
         self,
@@ -218,6 +292,13 @@ class Model:
         municipality_code="GM0014",
         real_pop_size=200336,
         cache=False,
+        keep_history=True,
+        output_format="csv",
+        chunk_rows=1_000_000,
+        checkpoint_path=None,
+        checkpoint_every=10,
+        metrics=None,
+        aggregate=False,
     ) -> None:
         """Run a simulation
 
@@ -240,6 +321,130 @@ class Model:
 
             cache(boolean): Do you want to save COVID-19 data
             i.e., to avoid to download twice?
+
+            keep_history(boolean): Do you want to keep the data of
+            every step in `history` after the run? Each step is
+            written to `out_path` as soon as it finishes, so if not,
+            only the last step is kept in memory.
+
+            output_format(str): Format of the output file, one of
+            "csv", "parquet", "feather" or "npz". The binary formats
+            store the lockdown as a category, the covid status as
+            an integer and the mental health as float32.
+
+            chunk_rows(int): Number of rows buffered in memory
+            before being written to `out_path`
+
+            checkpoint_path(str): File path of the checkpoints. If
+            given, the state of the simulation is saved every
+            `checkpoint_every` steps, and the simulation can be
+            continued from the last checkpoint with `Model.resume`.
+            Only csv and npz outputs can be resumed.
+
+            checkpoint_every(int): Number of steps between checkpoints
+
+            metrics(Metrics): Measures of the phases of the run, see
+            `comma.metrics.Metrics`. Nothing is measured by default.
+
+            aggregate(boolean): Write the aggregates of every step
+            instead of the state of every agent: the mean and quantiles
+            of the cumulative mental health, the prevalence and the
+            share of each action, for the population and each subgroup
+            of the features, see `comma.aggregate.Aggregator`. Only the
+            last step is kept in `history` then, so the memory and the
+            size of the output don't grow with the number of agents.
+
+        If the model has already simulated some steps (e.g. it was
+        forked), the simulation continues from `current_step`, and the
+        first steps of `lockdown_policy` must be the ones simulated so
+        far. The steps kept in `history` are written to `out_path` too,
+        unless `aggregate` is set (the actions of past steps aren't kept).
+        """
+        simulated = [self.lockdown_status[step] for step in range(self.current_step)]
+        if list(lockdown_policy[: self.current_step]) != simulated:
+            raise ValueError(
+                f"The first {self.current_step} steps of the lockdown list "
+                "must be the steps already simulated"
+            )
+        if checkpoint_path is not None:
+            if checkpoint_every < 1:
+                raise ValueError("checkpoint_every must be at least 1")
+            if output_format in WRITERS and not WRITERS[output_format].resumable:
+                raise ValueError(
+                    f"Writing {output_format} files can't be resumed, "
+                    "use csv or npz with checkpoints"
+                )
+            # the features are saved with the first checkpoint of the run
+            self._checkpoint_features = None
+        self.metrics = metrics = NO_METRICS if metrics is None else metrics
+        try:
+            metrics.start_run(steps, self.population.size)
+            with metrics.phase("new_cases"):
+                new_cases = self.get_new_cases(
+                    self.dir_params,
+                    self.population.size,
+                    steps,
+                    lockdown_policy,
+                    starting_date,
+                    municipality_code,
+                    real_pop_size,
+                    cache,
+                )
+            with metrics.phase("hypotheses"):
+                hypotheses = self.read_hypotheses(self.dir_params, lockdown_policy)
+            metrics.end_setup({"population": self.population_seconds})
+
+            aggregator = Aggregator(self.population) if aggregate else None
+            with get_writer(out_path, output_format, chunk_rows) as writer:
+                if (
+                    self.current_step > 0
+                    and self.history.keep_steps is None
+                    and aggregator is None
+                ):
+                    writer.write(self.history.to_frame(0, self.current_step))
+                self._simulate(
+                    lockdown_policy,
+                    new_cases,
+                    hypotheses,
+                    writer,
+                    keep_history and aggregator is None,
+                    checkpoint_path=checkpoint_path,
+                    checkpoint_every=checkpoint_every,
+                    aggregator=aggregator,
+                )
+            metrics.end_run()
+        finally:
+            metrics.close()
+            self.metrics = NO_METRICS
+
+    @staticmethod
+    def get_new_cases(
+        dir_params: str,
+        size: int,
+        steps: int,
+        lockdown_policy: list,
+        starting_date="2021-02-01",
+        municipality_code="GM0014",
+        real_pop_size=200336,
+        cache=False,
+    ) -> np.ndarray:
+        """
+        Check the inputs of a simulation, and get the number of new
+        positive cases at every step, scaled to the simulated population
+
+        Args:
+            dir_params(str): Path to the parameters folder
+            size(int): Size of the simulated population
+            steps(int): Number of steps to run the simulation
+            lockdown_policy(list): lockdown type of every step
+            starting_date(str): start date ('YYYY-MM-DD')
+            municipality_code(str): Also known as Gemeentecode
+            real_pop_size(int): Real size of the population
+            of the relative municipality_code
+            cache(boolean): Do you want to save COVID-19 data?
+
+        Returns:
+            np.ndarray: number of new infected agents at every step
         """
         if steps <= 1:
             raise ValueError("Steps must be more than 1")
@@ -251,37 +456,321 @@ class Model:
             )
         # compute time_period
         hypothesis = Hypothesis(starting_date, steps)
-        hypothesis.validate_param_file(self.dir_params)
+        # validates the hypothesis files of the lockdowns, and caches
+        # their compiled bundle
+        load_bundle(dir_params, lockdown_policy)
 
         # get new positive cases
         positives = hypothesis.get_positive_cases(municipality_code, cache)
         # scale them to the size of the simulated population
-        new_cases = hypothesis.scale_cases_to_population(
-            positives, real_pop_size, len(self.agents)
-        )
-        # print(f"scaled cases: {new_cases} \n cases: {positives}")
-        # read hypotheses
-        lockdown_matrices = hypothesis.read_hypotheses(
-            self.dir_params, set(lockdown_policy), "lockdown"
+        return np.asarray(
+            hypothesis.scale_cases_to_population(positives, real_pop_size, size)
         )
 
-        actions_effects_matrices = hypothesis.read_hypotheses(
-            self.dir_params, set(lockdown_policy), "actions"
-        )
+    @staticmethod
+    def read_hypotheses(dir_params: str, lockdown_policy: list) -> dict:
+        """
+        Read the matrices of the lockdowns of a simulation, from the
+        compiled bundle of the parameters folder, see `comma.bundle`
 
-        # start the simulation
-        for step, current_lockdown in tqdm(
-            enumerate(lockdown_policy), total=steps, desc="Running simulation"
+        Args:
+            dir_params(str): Path to the parameters folder
+            lockdown_policy(list): lockdown type of every step
+
+        Returns:
+            dict: for every lockdown type, the tuple of its lockdown
+            matrix, its lockdown matrix for the positive agents, and
+            its matrix of action effects
+        """
+        return load_bundle(dir_params, lockdown_policy).hypotheses(lockdown_policy)
+
+    def _simulate(
+        self,
+        lockdown_policy: list,
+        new_cases: np.ndarray,
+        hypotheses: dict,
+        writer,
+        keep_history: bool = True,
+        progress: bool = True,
+        checkpoint_path: str = None,
+        checkpoint_every: int = 10,
+        aggregator: Aggregator = None,
+    ) -> None:
+        """
+        Run the steps of a simulation, from `current_step` to the end
+        of `lockdown_policy`. Each step is written as soon as it finishes
+
+        Args:
+            lockdown_policy(list): lockdown type of every step
+            new_cases(np.ndarray): number of new infected at every step
+            hypotheses(dict): matrices of every lockdown, as returned
+            by `read_hypotheses`
+            writer(Writer): writer of the results
+            keep_history(boolean): keep the data of every step in `history`
+            progress(boolean): show a progress bar
+            checkpoint_path(str): File path of the checkpoints, if any
+            checkpoint_every(int): Number of steps between checkpoints
+            aggregator(Aggregator): if given, the aggregates of every step
+            are written instead of the state of every agent
+        """
+        steps = len(lockdown_policy)
+        start = self.current_step
+        if start == 0:
+            self.history = History(
+                steps, self.population.size, keep_steps=None if keep_history else 1
+            )
+        else:
+            self.history.extend(steps)
+        step_function = self.step_vectorized if self.vectorized else self.step
+        metrics = self.metrics
+
+        for step in tqdm(
+            range(start, steps),
+            total=steps,
+            initial=start,
+            desc="Running simulation",
+            disable=not progress,
         ):
             # print(f"new cases: {new_cases[step]}, day: {step}")
+            current_lockdown = lockdown_policy[step]
             self.simulation_id = step
             self.lockdown_status[step] = current_lockdown
-            new_infected = new_cases[step]
-            self.step(
-                lockdown_matrices[current_lockdown],
-                actions_effects_matrices[current_lockdown],
-                new_infected,
-            )
-            self.update(current_lockdown, step)
+            lockdown, lockdown_infected, action_effects = hypotheses[current_lockdown]
+            metrics.start_step(step)
+            step_function(lockdown, action_effects, new_cases[step], lockdown_infected)
+            with metrics.phase("update"):
+                self.update(current_lockdown, step)
+            with metrics.phase("report"):
+                if aggregator is None:
+                    writer.write(self.history.to_frame(step, step + 1))
+                else:
+                    mh = self.history.mh[self.history.row(step)]
+                    writer.write(
+                        aggregator.aggregate(
+                            step, current_lockdown, mh, self.population
+                        )
+                    )
             self.current_step += 1  # Increment the simulation step
-        self.report(out_path)
+
+            if (
+                checkpoint_path is not None
+                and self.current_step % checkpoint_every == 0
+                and self.current_step < steps
+            ):
+                with metrics.phase("checkpoint"):
+                    self.save_checkpoint(
+                        checkpoint_path,
+                        lockdown_policy,
+                        new_cases,
+                        writer,
+                        checkpoint_every,
+                        aggregate=aggregator is not None,
+                    )
+            metrics.end_step(step, current_lockdown)
+
+    def fork(self, branches: int) -> list["Model"]:
+        """
+        Clone the model at its current step, e.g. to continue a shared
+        prefix of a simulation with different lockdown policies:
+
+            model.run(60, ["easy"] * 60, "prefix.csv")
+            for i, branch in enumerate(model.fork(2)):
+                branch.run(90, ["easy"] * 60 + suffixes[i], f"branch_{i}.csv")
+
+        The branches share the (read-only) feature matrix of the model,
+        and get a copy of the state of the agents and of the history.
+        Each branch draws its random numbers from its own seed, spawned
+        from the seed of the model, so the branches are reproducible.
+
+        Args:
+            branches(int): Number of branches
+
+        Returns:
+            list: the forked models
+        """
+        forks = []
+        for seed in self.seed_sequence.spawn(branches):
+            population = Population(self.population.features)
+            for name in Population.state_arrays:
+                getattr(population, name)[:] = getattr(self.population, name)
+
+            model = Model(
+                population.size,
+                self.dir_params,
+                seed=seed,
+                vectorized=self.vectorized,
+                population=population,
+            )
+            model.current_step = self.current_step
+            model.simulation_id = self.simulation_id
+            model.lockdown_status = dict(self.lockdown_status)
+            model.history = copy.deepcopy(self.history)
+            forks.append(model)
+        return forks
+
+    def save_checkpoint(
+        self,
+        path: str,
+        lockdown_policy: list,
+        new_cases: np.ndarray,
+        writer,
+        checkpoint_every: int = 10,
+        aggregate: bool = False,
+    ) -> None:
+        """
+        Save the state of a running simulation: the state of the agents,
+        the last step of the history, the state of the random generator
+        and of the writer, and the inputs of the simulation, as an
+        uncompressed npz file. The file is replaced atomically, so a
+        checkpoint is never left half written.
+
+        The steps before the last one are in the output file already, and
+        the features of the agents don't change: they are saved once per
+        run, next to the checkpoint (`<path>.features.npy`). So the size
+        of a checkpoint doesn't grow with the number of steps.
+
+        Args:
+            path(str): File path of the checkpoint
+            lockdown_policy(list): lockdown type of every step
+            new_cases(np.ndarray): number of new infected at every step
+            writer(Writer): writer of the results, flushed to the output file
+            checkpoint_every(int): Number of steps between checkpoints
+            aggregate(boolean): the aggregates of the steps are written,
+            see `run`
+        """
+        features_path = f"{path}.features.npy"
+        if self._checkpoint_features != features_path:
+            tmp_path = f"{features_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, self.population.features)
+            os.replace(tmp_path, features_path)
+            self._checkpoint_features = features_path
+
+        meta = {
+            "step": self.current_step,
+            "dir_params": self.dir_params,
+            "vectorized": self.vectorized,
+            "features": os.path.basename(features_path),
+            "rng": self.rng.bit_generator.state,
+            "seed_sequence": {
+                "entropy": self.seed_sequence.entropy,
+                "spawn_key": list(self.seed_sequence.spawn_key),
+                "n_children_spawned": self.seed_sequence.n_children_spawned,
+            },
+            "lockdown_policy": list(lockdown_policy),
+            "checkpoint_every": checkpoint_every,
+            "aggregate": aggregate,
+            "history": {
+                "steps": self.history.steps,
+                "keep_steps": self.history.keep_steps,
+                "recorded": self.history.recorded,
+                "lockdown_names": self.history.lockdown_names,
+            },
+            "writer": {
+                "out_path": str(writer.out_path),
+                "output_format": writer.output_format,
+                "chunk_rows": writer.chunk_rows,
+                "state": writer.checkpoint(),
+            },
+        }
+        arrays = {"new_cases": new_cases}
+        for name in Population.state_arrays:
+            arrays[f"population/{name}"] = getattr(self.population, name)
+        # the lockdown of every step, and the state of the agents at the
+        # last step, which the next step starts from
+        last = self.history.row(self.current_step - 1)
+        for name in History.arrays:
+            array = getattr(self.history, name)
+            arrays[f"history/{name}"] = array if name == "lockdown" else array[last]
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def resume(checkpoint_path: str, progress: bool = True) -> "Model":
+        """
+        Continue a simulation from its last checkpoint, see `run`.
+        The output file is truncated to the steps written before the
+        checkpoint, and the rest of the simulation is appended to it.
+
+        With the vectorized engine, the results are the same as the
+        results of a simulation that wasn't interrupted. If the whole
+        history is kept, the steps before the checkpoint are read back
+        from the output file, with the precision of its format (float32
+        mental health in npz files).
+
+        Args:
+            checkpoint_path(str): File path of the checkpoint
+            progress(boolean): show a progress bar
+
+        Returns:
+            Model: the model, at the end of the simulation
+        """
+        with np.load(checkpoint_path) as data:
+            meta = json.loads(str(data["meta"]))
+            features_path = os.path.join(
+                os.path.dirname(checkpoint_path), meta["features"]
+            )
+            population = Population(np.load(features_path))
+            for name in Population.state_arrays:
+                getattr(population, name)[:] = data[f"population/{name}"]
+            history = History(
+                meta["history"]["steps"],
+                population.size,
+                keep_steps=meta["history"]["keep_steps"],
+            )
+            history.recorded = meta["history"]["recorded"]
+            history.lockdown_names = meta["history"]["lockdown_names"]
+            last = history.row(meta["step"] - 1)
+            for name in History.arrays:
+                if name == "lockdown":
+                    history.lockdown[:] = data[f"history/{name}"]
+                else:
+                    getattr(history, name)[last] = data[f"history/{name}"]
+            new_cases = data["new_cases"]
+
+        model = Model(
+            population.size,
+            meta["dir_params"],
+            vectorized=meta["vectorized"],
+            population=population,
+        )
+        model.seed_sequence = np.random.SeedSequence(**meta["seed_sequence"])
+        model.rng.bit_generator.state = meta["rng"]
+        model.history = history
+        model.current_step = meta["step"]
+        model.simulation_id = meta["step"] - 1
+        model._checkpoint_features = features_path
+        lockdown_policy = meta["lockdown_policy"]
+        model.lockdown_status = dict(enumerate(lockdown_policy[: meta["step"]]))
+
+        hypotheses = model.read_hypotheses(model.dir_params, lockdown_policy)
+        writer = meta["writer"]
+        with get_writer(
+            writer["out_path"],
+            writer["output_format"],
+            writer["chunk_rows"],
+            state=writer["state"],
+        ) as writer:
+            if history.keep_steps is None:
+                # the steps before the last one, from the truncated output
+                for data in iter_results(
+                    writer.out_path, writer.output_format, writer.chunk_rows
+                ):
+                    history.fill(data[data["step_id"] < meta["step"] - 1])
+            model._simulate(
+                lockdown_policy,
+                new_cases,
+                hypotheses,
+                writer,
+                keep_history=history.keep_steps is None,
+                progress=progress,
+                checkpoint_path=checkpoint_path,
+                checkpoint_every=meta["checkpoint_every"],
+                aggregator=(
+                    Aggregator(population) if meta.get("aggregate", False) else None
+                ),
+            )
+        return model
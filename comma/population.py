@@ -0,0 +1,421 @@
+"""Population class definition
+"""
+from comma.cache import cache_path, file_hash, write_entry
+from comma.hypothesis import PARAMS_INDIVIDUAL, PARAMS_IPF_WEIGHTS, Hypothesis
+from comma.ipf import IPF_VERSION, load_ipf_table
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+from scipy.stats import gamma  # for the "recovery" curve
+
+# Probability of being recovered n days after testing positive, for
+# n = 0, ..., RECOVERY_DAYS - 1. Row 0 is the standard recovery curve,
+# row 1 the long covid one. Both are (practically) 1 at the last day.
+RECOVERY_DAYS = 366
+RECOVERY_TABLE = np.stack(
+    [
+        gamma.cdf(np.arange(RECOVERY_DAYS), a=5, scale=3),  # standard recovery
+        gamma.cdf(np.arange(RECOVERY_DAYS), a=7, scale=10),  # long covid recovery
+    ]
+)
+
+
+def recovery_probability(n_days, long_covid) -> np.ndarray:
+    """
+    Look up the probability of being recovered from COVID-19
+
+    Args:
+        n_days (np.ndarray): number of days since tested positive
+        long_covid (np.ndarray): 1 for long covid cases, 0 otherwise
+
+    Returns:
+        np.ndarray: probability of being recovered
+    """
+    n_days = np.minimum(n_days, RECOVERY_DAYS - 1).astype(np.intp)
+    return RECOVERY_TABLE[long_covid, n_days]
+
+
+class Population:
+    """
+    The Population class stores the state of all the agents column-wise:
+    one feature matrix of shape (n_agents, n_features) plus one typed
+    array per agent attribute, so that population-wide operations
+    become array operations.
+    """
+
+    feature_names = ["baseline"] + Hypothesis.all_possible_features
+    actions = Hypothesis.all_possible_actions
+    # the arrays that change during a simulation
+    state_arrays = [
+        "covid_status",
+        "days_since_positive",
+        "long_covid",
+        "status",
+        "chosen_actions",
+    ]
+
+    def __init__(self, features: np.ndarray):
+        self.features = np.ascontiguousarray(features, dtype=np.float64)
+        if self.features.ndim != 2 or self.features.shape[1] != len(self.feature_names):
+            raise ValueError(
+                f"features must have shape (n_agents, {len(self.feature_names)}), "
+                f"got {self.features.shape}"
+            )
+        size = len(self.features)
+        self.covid_status = np.zeros(size, dtype=np.int8)
+        self.days_since_positive = np.full(size, np.nan)
+        self.long_covid = np.zeros(size, dtype=np.int8)
+        self.status = np.zeros(size, dtype=np.float64)
+        self.chosen_actions = np.zeros((size, len(self.actions)), dtype=bool)
+
+    @property
+    def size(self) -> int:
+        """
+        Get the number of agents in the population
+
+        Returns:
+            int: number of agents
+        """
+        return len(self.features)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Get the feature matrix as a dataframe
+
+        Returns:
+            pd.DataFrame: one row per agent, one column per feature
+        """
+        return pd.DataFrame(self.features, columns=self.feature_names)
+
+    def choose_actions_on_lockdown(
+        self,
+        lockdown: pd.DataFrame,
+        rng=None,
+        lockdown_infected: pd.DataFrame = None,
+    ) -> None:
+        """
+        Choose the actions of all the agents based on current lockdown policy.
+
+        The logits of every agent are computed as a single
+        (n_agents x n_features) @ (n_features x n_actions) product,
+        and the actions are drawn with one call to the random generator.
+
+        Args:
+            lockdown (pd.DataFrame): dataframe of a given lockdown
+            rng (np.random.Generator): optional. An instance of numpy random
+            generator. If not provided, a default random generator will be
+            used. This ensures reproducibility.
+            lockdown_infected (pd.DataFrame): optional. Lockdown applied to
+            the agents that are positive to COVID-19.
+
+        Returns:
+            None. The chosen actions are stored in `chosen_actions`.
+        """
+        params_lockdown = np.asarray(lockdown, dtype=np.float64)
+        logits = self.features @ params_lockdown.T
+        if lockdown_infected is not None:
+            infected = np.flatnonzero(self.covid_status == 1)
+            params_infected = np.asarray(lockdown_infected, dtype=np.float64)
+            logits[infected] = self.features[infected] @ params_infected.T
+        # apply the sigmoid function
+        action_probs = 1 / (1 + np.exp(-logits))
+        if rng is None:
+            rng = np.random.default_rng(None)
+        np.less_equal(rng.random(logits.shape), action_probs, out=self.chosen_actions)
+
+    def take_actions(self, action_effects: pd.DataFrame) -> None:
+        """
+        Update the status of all the agents by taking their chosen actions.
+
+        Same as `Individual.take_actions` for every agent: the features are
+        multiplied by the action effects, then each row is reduced against
+        the chosen actions of that agent.
+
+        Args:
+            action_effects (pd.DataFrame): matrix of actions effects
+
+        Returns:
+            None: This function updates the agents' status
+            but does not return anything.
+        """
+        params_status = np.asarray(action_effects, dtype=np.float64)
+        effects = self.features @ params_status.T
+        self.status[:] = np.einsum("ij,ij->i", effects, self.chosen_actions)
+
+    def get_recovered(self, rng=None) -> np.ndarray:
+        """
+        Get the indices of the agents who are recovered from COVID-19.
+
+        Same recovery model as `Individual.is_recovered`: no recovery
+        in the first 10 days, a 20% chance per day to become a long covid
+        case, then a gamma cumulative distribution function of the days
+        since testing positive, looked up in `RECOVERY_TABLE`.
+
+        Args:
+            rng (np.random.Generator): optional. An instance of numpy random
+            generator. If not provided, a default random generator will be
+            used. This ensures reproducibility.
+
+        Returns:
+            recovered (np.ndarray): indices of recovered agents
+        """
+        if rng is None:
+            rng = np.random.default_rng(None)
+
+        candidates = np.flatnonzero(
+            (self.covid_status == 1) & (self.days_since_positive > 10)
+        )
+        long_covid_draw, recovery_draw = rng.random((2, len(candidates)))
+        long_covid = self.long_covid[candidates]
+        long_covid[long_covid_draw < 0.20] = 1
+        self.long_covid[candidates] = long_covid
+
+        n_days = self.days_since_positive[candidates]
+        recovered = recovery_draw <= recovery_probability(n_days, long_covid)
+        return candidates[recovered]
+
+    def save(self, path: str) -> None:
+        """
+        Save the feature matrix in a folder
+
+        Args:
+            path (str): path of the folder
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "features.npy"), self.features)
+
+    @classmethod
+    def load(cls, path: str) -> "Population":
+        """
+        Load a population saved with `save`. The feature matrix is
+        memory-mapped (read-only), so processes loading the same
+        population share its pages.
+
+        Args:
+            path (str): path of the folder
+
+        Returns:
+            Population: the population, with the initial agents' state
+        """
+        return cls(np.load(os.path.join(path, "features.npy"), mmap_mode="r"))
+
+    @classmethod
+    def from_frame(cls, features: pd.DataFrame) -> "Population":
+        """
+        Create a population from a dataframe of encoded features
+
+        Args:
+            features (pd.DataFrame): one row per agent. Columns missing
+            from `Population.feature_names` are filled with zeros.
+
+        Returns:
+            Population: the new population
+        """
+        features = features.reindex(columns=cls.feature_names, fill_value=0)
+        return cls(features.to_numpy(dtype=np.float64))
+
+    @classmethod
+    def from_codes(
+        cls, codes: dict, categories: dict, lowercase: bool = False
+    ) -> "Population":
+        """
+        Create a population from the category codes of its agents.
+
+        The one-hot encoded feature matrix is built directly, by setting
+        to one the column of each agent's category. Categories that are
+        not in `Population.feature_names` are left out.
+
+        Args:
+            codes (dict): for each variable, an array of category codes,
+            one per agent.
+            categories (dict): for each variable, the list of its categories.
+            lowercase (bool): lowercase the names of the one-hot encoded
+            features ('<variable>_<category>') before matching them with
+            `Population.feature_names`.
+
+        Returns:
+            Population: the new population
+        """
+        size = len(next(iter(codes.values())))
+        column_index = {name: i for i, name in enumerate(cls.feature_names)}
+
+        features = np.zeros((size, len(cls.feature_names)), dtype=np.float64)
+        features[:, column_index["baseline"]] = 1
+        rows = np.arange(size)
+        for variable, variable_codes in codes.items():
+            names = [f"{variable}_{category}" for category in categories[variable]]
+            if lowercase:
+                names = [name.lower() for name in names]
+            columns = np.array([column_index.get(name, -1) for name in names])
+            columns = columns[variable_codes]
+            known = columns >= 0
+            features[rows[known], columns[known]] = 1
+
+        return cls(features)
+
+    @classmethod
+    def populate_ipf(
+        cls, size: int, dir_params: str, rng=None, alias: bool = False
+    ) -> "Population":
+        """
+        Create a population with the given weights obtained via IPF
+
+        Args:
+            size (int): size of data sample.
+            dir_params (str): path to parameters folder.
+            rng (np.random.Generator): optional. An instance of numpy random
+            generator. If not provided, a default random generator will be
+            used. This ensures reproducibility.
+            alias (bool): draw the agents with the alias method, faster
+            but not the same agents for a given seed as earlier versions.
+
+        Returns:
+            Population: a population of `size` agents
+        """
+        table = load_ipf_table(dir_params)
+        codes = table.sample_codes(size, rng, alias)
+        return cls.from_codes(codes, table.categories, lowercase=True)
+
+    @classmethod
+    def populate(cls, size: int, dir_params: str, rng=None) -> "Population":
+        """
+        Create a population with the given feature parameters.
+
+        Args:
+            size (int): population size, i.e., number of agents.
+            dir_params (str): dir to the folder containing
+            feature parameter file.
+            rng (np.random.Generator): optional. An instance of numpy random
+            generator. If not provided, a default random generator will be
+            used. This ensures reproducibility.
+
+        Returns:
+            Population: a population of `size` agents
+        """
+        assert size > 0, "Size must be positive!"
+        assert isinstance(size, int), "Size must be integer!"
+        assert os.path.isdir(dir_params), "Given folder doesn't exist!"
+
+        fpath_params_individual = os.path.join(dir_params, PARAMS_INDIVIDUAL)
+        with open(fpath_params_individual) as f:
+            features = json.load(f)
+
+        if rng is None:
+            rng = np.random.default_rng(None)
+
+        # draw the category of every agent as a small integer code
+        codes = {}
+        categories = {}
+        for feature, distribution in features.items():
+            categories[feature] = distribution[0]
+            codes[feature] = rng.choice(len(distribution[0]), size, p=distribution[1])
+
+        return cls.from_codes(codes, categories)
+
+    @staticmethod
+    def sampling_from_ipf(size: int, dir_params: str, rng=None) -> pd.DataFrame:
+        """
+        Sample from IPF distribution saved
+        as `weights.csv` in the parameters folder.
+        The weights are compiled once and cached, see `comma.ipf`.
+
+        Parameters
+        ----------
+        size (int): size of data sample
+        dir_params (str): path to the parameters folder
+        rng (np.random.Generator): optional. An instance of numpy random
+            generator. If not provided, a default random generator will be
+            used. This ensures reproducibility.
+
+        Returns
+        -------
+        sample (pandas.dataFrame): dataframe containing the sampling
+        """
+        table = load_ipf_table(dir_params)
+        codes = table.sample_codes(size, rng)
+        sample = pd.DataFrame(
+            {
+                variable: np.asarray(table.categories[variable], dtype=object)[
+                    variable_codes
+                ]
+                for variable, variable_codes in codes.items()
+            }
+        )
+        return sample
+
+
+def _seed_key(seed) -> str:
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    # spawned seeds share the entropy of their parent
+    return f"{seed.entropy}/{seed.spawn_key}"
+
+
+def cached_population(
+    size: int,
+    dir_params: str,
+    seed,
+    rng: np.random.Generator,
+    use_ipf: bool = False,
+    cache_dir: str = None,
+) -> Population:
+    """
+    Create a population, or load it from the cache if the same population
+    was created before. Populations are keyed by their size, the seed,
+    the sampler (IPF or `params_individual.json`) and the content of the
+    parameter file.
+
+    The state of `rng` after creating the population is cached too and
+    restored when the population is loaded, so that the rest of the
+    simulation draws the same random numbers either way.
+
+    Args:
+        size (int): population size, i.e., number of agents.
+        dir_params (str): path to parameters folder.
+        seed: seed of `rng`. Populations are not cached if None.
+        rng (np.random.Generator): random generator created from `seed`.
+        use_ipf (bool): sample the agents from the IPF weights.
+        cache_dir (str): optional. Cache folder, `comma.cache.CACHE_DIR`
+        if not provided.
+
+    Returns:
+        Population: the population
+    """
+    if seed is None:
+        if use_ipf:
+            # no seed to reproduce, the faster draws
+            return Population.populate_ipf(size, dir_params, rng, alias=True)
+        return Population.populate(size, dir_params, rng)
+    populate = Population.populate_ipf if use_ipf else Population.populate
+
+    params_file = PARAMS_IPF_WEIGHTS if use_ipf else PARAMS_INDIVIDUAL
+    key = "|".join(
+        [
+            f"ipf-{IPF_VERSION}" if use_ipf else "individual",
+            str(size),
+            _seed_key(seed),
+            file_hash(os.path.join(dir_params, params_file)),
+        ]
+    )
+    path = cache_path(
+        cache_dir, f"population-{hashlib.sha256(key.encode()).hexdigest()}"
+    )
+
+    if not os.path.isdir(path):
+        population = populate(size, dir_params, rng)
+
+        def write(tmp_path):
+            population.save(tmp_path)
+            with open(os.path.join(tmp_path, "rng.json"), "w") as f:
+                json.dump(rng.bit_generator.state, f)
+
+        write_entry(path, write)
+
+    with open(os.path.join(path, "rng.json")) as f:
+        rng.bit_generator.state = json.load(f)
+    return Population.load(path)
@@ -0,0 +1,105 @@
+"""Read-only arrays shared by the processes of a run
+"""
+import numpy as np
+import os
+import shutil
+import tempfile
+
+# memory-backed filesystem, where available
+SHM_DIR = "/dev/shm"
+
+
+class SharedArrays:
+    """
+    The SharedArrays class places read-only arrays in memory-mapped files,
+    in /dev/shm when available. Only the folder of the files is pickled,
+    so the arrays can be sent to worker processes, which map the same
+    pages instead of receiving their own copy.
+
+    The files are removed when the arrays are closed, e.g. at the end
+    of a `with` block.
+    """
+
+    def __init__(self, arrays: dict, dir: str = None):
+        if dir is None and os.path.isdir(SHM_DIR):
+            dir = SHM_DIR
+        self.path = tempfile.mkdtemp(prefix="comma-shared-", dir=dir)
+        self.names = list(arrays)
+        for name, array in arrays.items():
+            np.save(self._fpath(name), np.asarray(array))
+
+    def __enter__(self) -> "SharedArrays":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _fpath(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.npy")
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """
+        Map an array in memory
+
+        Args:
+            name (str): name of the array
+
+        Returns:
+            np.ndarray: the array, read-only
+        """
+        if name not in self.names:
+            raise KeyError(name)
+        return np.load(self._fpath(name), mmap_mode="r")
+
+    def close(self) -> None:
+        """
+        Remove the files of the arrays
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def share_hypotheses(hypotheses: dict, prefix: str = "") -> dict:
+    """
+    Get the matrices of the lockdowns as arrays, to share them
+
+    Args:
+        hypotheses (dict): matrices of every lockdown, as returned
+        by `Model.read_hypotheses`
+        prefix (str): optional. Prefix of the names of the arrays, to
+        share the hypotheses of several parameters folders.
+
+    Returns:
+        dict: the arrays, named `<prefix><matrix>_<lockdown>`
+    """
+    arrays = {}
+    for lockdown, matrices in hypotheses.items():
+        for name, matrix in zip(["lockdown", "infected", "actions"], matrices):
+            arrays[f"{prefix}{name}_{lockdown}"] = np.asarray(matrix, dtype=np.float64)
+    return arrays
+
+
+def attach_hypotheses(shared: SharedArrays, lockdowns, prefix: str = "") -> dict:
+    """
+    Get the matrices of the lockdowns from shared arrays, the
+    inverse of `share_hypotheses`
+
+    Args:
+        shared (SharedArrays): the shared arrays
+        lockdowns: lockdown types
+        prefix (str): optional. Prefix of the names of the arrays
+
+    Returns:
+        dict: for every lockdown type, the tuple of its lockdown
+        matrix, its lockdown matrix for the positive agents, and
+        its matrix of action effects
+    """
+    return {
+        lockdown: tuple(
+            shared[f"{prefix}{name}_{lockdown}"]
+            for name in ["lockdown", "infected", "actions"]
+        )
+        for lockdown in set(lockdowns)
+    }
@@ -0,0 +1,223 @@
+"""Sweeps of a simulation over scenarios of lockdown policies
+"""
+from comma.ensemble import _map, _run_simulation
+from comma.model import Model
+from comma.population import Population
+from comma.shared import SharedArrays, share_hypotheses
+from comma.writer import OUTPUT_FORMATS, get_writer, iter_results, read_results
+import numpy as np
+import os
+import pandas as pd
+import tempfile
+
+SWEEP_FILE = "sweep"  # the results are in sweep.<output_format>
+
+
+class Scenario:
+    """
+    The Scenario class describes one simulation of a sweep: the
+    lockdown of every step and, optionally, the parameters folder
+    the hypotheses are read from.
+    """
+
+    def __init__(self, name: str, lockdown_policy: list, dir_params: str = None):
+        self.name = name
+        self.lockdown_policy = list(lockdown_policy)
+        self.dir_params = dir_params  # the folder of the sweep if None
+
+    @property
+    def steps(self) -> int:
+        """
+        Get the number of steps of the scenario
+
+        Returns:
+            int: number of steps
+        """
+        return len(self.lockdown_policy)
+
+
+def run_sweep(
+    scenarios,
+    size: int,
+    dir_params: str,
+    out_dir: str,
+    seed=None,
+    workers: int = None,
+    use_ipf: bool = False,
+    starting_date="2021-02-01",
+    municipality_code="GM0014",
+    real_pop_size=200336,
+    cache=False,
+    output_format="csv",
+    chunk_rows=1_000_000,
+) -> str:
+    """Run a simulation for every scenario of lockdown policies
+
+    The population is sampled once and shared by all the scenarios, the
+    positive cases and the hypotheses are read once. The scenarios run
+    in parallel with the vectorized engine, and draw the same random
+    numbers, so that the differences between them come from the policies
+    only (common random numbers).
+
+    The results of all the scenarios are written to one file in
+    `out_dir`, `sweep.<output_format>`, with the name of the scenario in
+    the `scenario` column, and can be read with `read_sweep`. Each worker
+    writes its scenario to a temporary file, which is then appended to
+    the results of the sweep, so the rows of a scenario are contiguous,
+    in chunks of their own.
+
+    Args:
+        scenarios: list of `Scenario`, or dictionary of the lockdown
+        policy of every scenario, by name
+
+        size(int): Number of agents
+
+        dir_params(str): Path to the parameters folder
+
+        out_dir(str): Folder of the results
+
+        seed: Seed of the sweep. If None, the sweep is not reproducible.
+
+        workers(int): Number of worker processes. Defaults to the
+        number of CPUs, with 1 the scenarios run in this process.
+
+        use_ipf(boolean): Sample the agents from the IPF weights
+
+        starting_date(str): start date ('YYYY-MM-DD')
+
+        municipality_code(str): Also known as Gemeentecode
+
+        real_pop_size(int): Real size of the population
+        of the relative municipality_code
+
+        cache(boolean): Do you want to save COVID-19 data?
+
+        output_format(str): Format of the output file, one of
+        "csv", "parquet", "feather" or "npz"
+
+        chunk_rows(int): Number of rows buffered in memory
+        before being written to the output file
+
+    Returns:
+        str: path of the results of the sweep
+    """
+    if isinstance(scenarios, dict):
+        scenarios = [Scenario(name, policy) for name, policy in scenarios.items()]
+    names = [scenario.name for scenario in scenarios]
+    if not names:
+        raise ValueError("There must be at least one scenario")
+    if len(set(names)) != len(names):
+        raise ValueError("The names of the scenarios must be unique")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"output_format should be one of {', '.join(OUTPUT_FORMATS)}, "
+            f"got '{output_format}'"
+        )
+
+    # positive cases, once per length of the scenarios
+    new_cases = {}
+    for scenario in scenarios:
+        if scenario.steps in new_cases:
+            continue
+        # the lockdowns of the scenario are checked in its own folder
+        new_cases[scenario.steps] = Model.get_new_cases(
+            scenario.dir_params or dir_params,
+            size,
+            scenario.steps,
+            scenario.lockdown_policy,
+            starting_date,
+            municipality_code,
+            real_pop_size,
+            cache,
+        )
+
+    # hypotheses, once per parameters folder, with the lockdowns it needs
+    folders = {}
+    for scenario in scenarios:
+        folder = scenario.dir_params or dir_params
+        folders.setdefault(folder, set()).update(scenario.lockdown_policy)
+    arrays = {}
+    for i, (folder, lockdowns) in enumerate(folders.items()):
+        # the files of the other folders are validated by their bundle
+        hypotheses = Model.read_hypotheses(folder, lockdowns)
+        arrays.update(share_hypotheses(hypotheses, prefix=f"{i}_"))
+    prefixes = {folder: f"{i}_" for i, folder in enumerate(folders)}
+
+    root_seed = np.random.SeedSequence(seed)
+    populate = Population.populate_ipf if use_ipf else Population.populate
+    arrays["features"] = populate(
+        size, dir_params, np.random.default_rng(root_seed)
+    ).features
+    step_seed = root_seed.spawn(1)[0]
+
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, f"{SWEEP_FILE}.{output_format}")
+    with tempfile.TemporaryDirectory(
+        prefix=".scenarios", dir=out_dir
+    ) as parts_dir, SharedArrays(arrays) as shared:
+        tasks = [
+            {
+                "seed": step_seed,
+                "size": size,
+                "dir_params": dir_params,
+                "use_ipf": use_ipf,
+                "cache_population": False,
+                "lockdown_policy": scenario.lockdown_policy,
+                "new_cases": new_cases[scenario.steps],
+                "shared": shared,
+                "prefix": prefixes[scenario.dir_params or dir_params],
+                "out_path": os.path.join(
+                    parts_dir, f"scenario_{i:04d}.{output_format}"
+                ),
+                "output_format": output_format,
+                "chunk_rows": chunk_rows,
+            }
+            for i, scenario in enumerate(scenarios)
+        ]
+        parts = _map(_run_simulation, tasks, workers, desc="Running scenarios")
+
+        with get_writer(out_path, output_format, chunk_rows) as writer:
+            for scenario, part in zip(scenarios, parts):
+                for data in iter_results(part, output_format, chunk_rows):
+                    data.insert(0, "scenario", scenario.name)
+                    writer.write(data)
+                # the chunks don't mix scenarios
+                writer.flush()
+                os.remove(part)
+    return out_path
+
+
+def read_sweep(out_dir: str, scenarios: list = None) -> pd.DataFrame:
+    """
+    Read the results of a sweep
+
+    Args:
+        out_dir (str): folder of the results of the sweep
+        scenarios (list): optional. Names of the scenarios to read,
+        all of them by default.
+
+    Returns:
+        pd.DataFrame: the results, with the name of the scenario
+        in the `scenario` column
+    """
+    for output_format in OUTPUT_FORMATS:
+        path = os.path.join(out_dir, f"{SWEEP_FILE}.{output_format}")
+        if os.path.exists(path):
+            break
+    else:
+        raise FileNotFoundError(f"No results of a sweep in {out_dir}")
+
+    if scenarios is None:
+        data = read_results(path, output_format)
+    else:
+        # only the rows of the scenarios asked for are kept in memory
+        scenarios = [str(name) for name in scenarios]
+        data = pd.concat(
+            [
+                chunk[chunk["scenario"].astype(str).isin(scenarios)]
+                for chunk in iter_results(path, output_format)
+            ],
+            ignore_index=True,
+        )
+    data["scenario"] = data["scenario"].astype(str)
+    return data
@@ -0,0 +1,421 @@
+"""Writers of the simulation results
+"""
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+
+OUTPUT_FORMATS = ["csv", "parquet", "feather", "npz"]
+
+
+class Writer:
+    """
+    The Writer class streams the results of a simulation to a file.
+    Blocks of rows are buffered in memory and appended to the file
+    whenever the buffer holds more than `chunk_rows` rows, so that the
+    memory used doesn't grow with the length of the simulation.
+    Subclasses define how a chunk is written.
+
+    Resumable writers can continue a file after a restart, from the
+    state returned by `checkpoint`.
+    """
+
+    output_format: str = None
+    resumable = False
+
+    def __init__(self, out_path: str, chunk_rows: int = 1_000_000, state: dict = None):
+        self.out_path = out_path
+        self.chunk_rows = chunk_rows
+        self._buffer: list[pd.DataFrame] = []
+        self._buffered_rows = 0
+        self._header_written = False
+        if state is not None:
+            if not self.resumable:
+                raise ValueError(f"Writing {self.output_format} files can't be resumed")
+            self._restore(state)
+
+    def __enter__(self) -> "Writer":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def write(self, data: pd.DataFrame) -> None:
+        """
+        Add a block of rows to the output
+
+        Args:
+            data (pd.DataFrame): rows to write, e.g. the data of one step
+        """
+        self._buffer.append(data)
+        self._buffered_rows += len(data)
+        if self._buffered_rows >= self.chunk_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Append the buffered rows to the output file
+        """
+        if not self._buffer:
+            return
+        self._write_chunk(pd.concat(self._buffer, ignore_index=True))
+        self._header_written = True
+        self._buffer = []
+        self._buffered_rows = 0
+
+    def _write_chunk(self, data: pd.DataFrame) -> None:
+        raise NotImplementedError
+
+    def checkpoint(self) -> dict:
+        """
+        Write the buffered rows, and get the state of the output file,
+        to resume writing it from this point
+
+        Returns:
+            dict: state of the writer, json serializable
+        """
+        self.flush()
+        return {"header_written": self._header_written}
+
+    def _restore(self, state: dict) -> None:
+        self._header_written = state["header_written"]
+
+    def close(self) -> None:
+        """
+        Write what is left in the buffer
+        """
+        self.flush()
+
+
+class CsvWriter(Writer):
+    """
+    Writes the results as a semicolon-separated csv file, with
+    comma as decimal separator.
+    """
+
+    output_format = "csv"
+    resumable = True
+
+    def checkpoint(self) -> dict:
+        state = super().checkpoint()
+        state["size"] = (
+            os.path.getsize(self.out_path) if os.path.exists(self.out_path) else 0
+        )
+        return state
+
+    def _restore(self, state: dict) -> None:
+        super()._restore(state)
+        # drop what was written after the checkpoint
+        with open(self.out_path, "ab") as f:
+            f.truncate(state["size"])
+
+    def _write_chunk(self, data: pd.DataFrame) -> None:
+        data.to_csv(
+            self.out_path,
+            index=False,
+            sep=";",
+            decimal=",",
+            mode="a" if self._header_written else "w",
+            header=not self._header_written,
+        )
+
+
+def compact(data: pd.DataFrame, lockdown_names: list[str]) -> pd.DataFrame:
+    """
+    Cast the results to compact column types: integer steps,
+    agents and covid status, categorical lockdown, and float32
+    mental health and days since first infection.
+
+    Args:
+        data (pd.DataFrame): rows of results
+        lockdown_names (list): categories of the lockdown column. Lockdowns
+        that are not in the list yet are appended to it, so that the
+        codes stay the same from one chunk to the next.
+
+    Returns:
+        pd.DataFrame: the same rows with compact types
+    """
+    for name in pd.unique(data["lockdown"]):
+        if name not in lockdown_names:
+            lockdown_names.append(name)
+    dtypes = {
+        "step_id": np.int32,
+        "lockdown": "category",
+        "agent_id": np.int32,
+        "delta_mental_health": np.float32,
+        "cumulative_mental_health": np.float32,
+        "covid_status": np.int8,
+        "days_since_first_infection": np.float32,
+    }
+    data = data.astype({col: dtypes[col] for col in data.columns if col in dtypes})
+    data["lockdown"] = data["lockdown"].cat.set_categories(lockdown_names)
+    return data
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as error:
+        raise ImportError(
+            "pyarrow is required to write parquet and feather files, "
+            "install it with `pip install comma[arrow]`"
+        ) from error
+    return pyarrow
+
+
+class _ArrowWriter(Writer):
+    """
+    Writes the results as Arrow record batches, with the lockdown
+    column dictionary-encoded.
+    """
+
+    def __init__(self, out_path: str, chunk_rows: int = 1_000_000, state: dict = None):
+        super().__init__(out_path, chunk_rows, state)
+        self._pa = _import_pyarrow()
+        self._writer = None
+        self._lockdown_names: list[str] = []
+
+    def _to_table(self, data: pd.DataFrame):
+        data = compact(data, self._lockdown_names)
+        return self._pa.Table.from_pandas(data, preserve_index=False)
+
+    def _open(self, schema):
+        raise NotImplementedError
+
+    def _write_chunk(self, data: pd.DataFrame) -> None:
+        table = self._to_table(data)
+        if self._writer is None:
+            self._writer = self._open(table.schema)
+        self._writer.write_table(table)
+
+    def close(self) -> None:
+        super().close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class ParquetWriter(_ArrowWriter):
+    """
+    Writes the results as a parquet file, one row group per chunk
+    """
+
+    output_format = "parquet"
+
+    def _open(self, schema):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(self.out_path, schema)
+
+
+class FeatherWriter(_ArrowWriter):
+    """
+    Writes the results as a feather (Arrow IPC) file, one record batch per chunk
+    """
+
+    output_format = "feather"
+
+    def _open(self, schema):
+        # new lockdowns are appended to the dictionary as deltas
+        options = self._pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+        return self._pa.ipc.new_file(self.out_path, schema, options=options)
+
+
+class NpzWriter(Writer):
+    """
+    Writes the results as a numpy .npz archive. Every chunk is stored as
+    one array per column, named `<column>/<chunk number>`. The lockdown
+    column is stored as integer codes into the `lockdown_names` array.
+    """
+
+    output_format = "npz"
+    resumable = True
+
+    def __init__(self, out_path: str, chunk_rows: int = 1_000_000, state: dict = None):
+        self._lockdown_names: list[str] = []
+        self._n_chunks = 0
+        if state is None and os.path.exists(out_path):
+            os.remove(out_path)
+        super().__init__(out_path, chunk_rows, state)
+
+    def checkpoint(self) -> dict:
+        state = super().checkpoint()
+        state["n_chunks"] = self._n_chunks
+        state["lockdown_names"] = list(self._lockdown_names)
+        return state
+
+    def _restore(self, state: dict) -> None:
+        super()._restore(state)
+        self._n_chunks = state["n_chunks"]
+        self._lockdown_names = list(state["lockdown_names"])
+        # keep the chunks written before the checkpoint
+        tmp_path = f"{self.out_path}.tmp"
+        with zipfile.ZipFile(self.out_path) as source, zipfile.ZipFile(
+            tmp_path, mode="w"
+        ) as archive:
+            for name in source.namelist():
+                if "/" in name and int(name[:-4].split("/")[1]) < self._n_chunks:
+                    archive.writestr(source.getinfo(name), source.read(name))
+        os.replace(tmp_path, self.out_path)
+
+    def _add_array(self, name: str, array: np.ndarray) -> None:
+        with zipfile.ZipFile(self.out_path, mode="a") as archive:
+            with archive.open(f"{name}.npy", mode="w", force_zip64=True) as f:
+                np.lib.format.write_array(f, np.ascontiguousarray(array))
+
+    def _write_chunk(self, data: pd.DataFrame) -> None:
+        data = compact(data, self._lockdown_names)
+        for col in data.columns:
+            if col == "lockdown":
+                array = data[col].cat.codes.to_numpy(dtype=np.int8)
+            else:
+                array = data[col].to_numpy()
+                if array.dtype == object:
+                    # e.g. the subgroups of the aggregates
+                    array = array.astype(str)
+            self._add_array(f"{col}/{self._n_chunks}", array)
+        self._n_chunks += 1
+
+    def close(self) -> None:
+        super().close()
+        self._add_array("lockdown_names", np.array(self._lockdown_names, dtype=str))
+
+
+WRITERS = {
+    "csv": CsvWriter,
+    "parquet": ParquetWriter,
+    "feather": FeatherWriter,
+    "npz": NpzWriter,
+}
+
+
+def get_writer(
+    out_path: str,
+    output_format: str = "csv",
+    chunk_rows: int = 1_000_000,
+    state: dict = None,
+) -> Writer:
+    """
+    Get the writer for a given output format
+
+    Args:
+        out_path (str): File path of the output file
+        output_format (str): one of `OUTPUT_FORMATS`
+        chunk_rows (int): Number of rows written to disk at once
+        state (dict): optional. State returned by `Writer.checkpoint`,
+        to resume writing the file from the checkpoint.
+
+    Returns:
+        Writer: the writer of the results
+    """
+    if output_format not in WRITERS:
+        raise ValueError(
+            f"output_format should be one of {', '.join(OUTPUT_FORMATS)}, "
+            f"got '{output_format}'"
+        )
+    return WRITERS[output_format](out_path, chunk_rows, state)
+
+
+def read_results(path: str, output_format: str = "csv") -> pd.DataFrame:
+    """
+    Read the results of a simulation written by one of the writers
+
+    Args:
+        path (str): File path of the results
+        output_format (str): one of `OUTPUT_FORMATS`
+
+    Returns:
+        pd.DataFrame: the results, one row per (step, agent)
+    """
+    if output_format == "csv":
+        return pd.read_csv(path, sep=";", decimal=",")
+    if output_format == "parquet":
+        _import_pyarrow()
+        return pd.read_parquet(path)
+    if output_format == "feather":
+        _import_pyarrow()
+        return pd.read_feather(path)
+    if output_format == "npz":
+        with np.load(path) as archive:
+            columns = {}
+            for name in archive.files:
+                if "/" in name:
+                    col, chunk = name.split("/")
+                    columns.setdefault(col, []).append((int(chunk), archive[name]))
+            data = pd.DataFrame(
+                {
+                    col: np.concatenate([array for _, array in sorted(chunks)])
+                    for col, chunks in columns.items()
+                }
+            )
+            data["lockdown"] = pd.Categorical.from_codes(
+                data["lockdown"], archive["lockdown_names"]
+            )
+        return data
+    raise ValueError(
+        f"output_format should be one of {', '.join(OUTPUT_FORMATS)}, "
+        f"got '{output_format}'"
+    )
+
+
+def iter_results(path: str, output_format: str = "csv", chunk_rows: int = 1_000_000):
+    """
+    Read the results of a simulation block by block, so that the
+    memory used doesn't grow with the size of the file
+
+    Args:
+        path (str): File path of the results
+        output_format (str): one of `OUTPUT_FORMATS`
+        chunk_rows (int): Number of rows of a block, for csv and parquet
+        files. The feather and npz files are read one written chunk at
+        a time.
+
+    Yields:
+        pd.DataFrame: blocks of rows of the results, in order
+    """
+    if output_format == "csv":
+        # the floats are read back exactly as they were written
+        yield from pd.read_csv(
+            path,
+            sep=";",
+            decimal=",",
+            chunksize=chunk_rows,
+            float_precision="round_trip",
+        )
+    elif output_format == "parquet":
+        _import_pyarrow()
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    elif output_format == "feather":
+        pa = _import_pyarrow()
+        with pa.ipc.open_file(path) as reader:
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i).to_pandas()
+    elif output_format == "npz":
+        with np.load(path) as archive:
+            columns: dict = {}
+            for name in archive.files:
+                if "/" in name:
+                    col, chunk = name.split("/")
+                    columns.setdefault(int(chunk), []).append(col)
+            # the names are written when the file is closed: a file that
+            # is still being written has the codes of the lockdowns only
+            lockdown_names = None
+            if "lockdown_names" in archive.files:
+                lockdown_names = archive["lockdown_names"]
+            for chunk in sorted(columns):
+                data = pd.DataFrame(
+                    {col: archive[f"{col}/{chunk}"] for col in columns[chunk]}
+                )
+                if lockdown_names is not None:
+                    data["lockdown"] = pd.Categorical.from_codes(
+                        data["lockdown"], lockdown_names
+                    )
+                yield data
+    else:
+        raise ValueError(
+            f"output_format should be one of {', '.join(OUTPUT_FORMATS)}, "
+            f"got '{output_format}'"
+        )
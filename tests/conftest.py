@@ -0,0 +1,11 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    # the caches of the tests are temporary, apart from the files of the test.
+    # The environment variable is read by the interpreters the tests spawn
+    path = tmp_path_factory.mktemp("cache")
+    monkeypatch.setattr("comma.cache.CACHE_DIR", str(path))
+    monkeypatch.setenv("COMMA_CACHE_DIR", str(path))
+    return path
@@ -0,0 +1,141 @@
+from comma.aggregate import Aggregator, feature_groups
+from comma.hypothesis import Hypothesis
+from comma.model import Model
+from comma.population import Population
+from comma.writer import read_results
+import numpy as np
+import pandas as pd
+import pytest
+from unittest.mock import patch
+
+
+class TestAggregator:
+    dir_params = "parameters/"
+    lockdown_policy = ["easy", "easy", "hard", "hard"]
+
+    @pytest.fixture
+    def population(self):
+        rng = np.random.default_rng(0)
+        population = Population.populate(300, self.dir_params, rng)
+        population.covid_status[::7] = 1
+        population.chosen_actions[:] = rng.random(population.chosen_actions.shape) < 0.4
+        return population
+
+    def test_feature_groups(self):
+        groups = feature_groups(Population.feature_names)
+        assert [category for category, _ in groups["age_group"]] == list("1234")
+        assert [category for category, _ in groups["gender"]] == ["f", "m"]
+        assert sum(len(categories) for categories in groups.values()) == len(
+            Hypothesis.all_possible_features
+        )
+
+    def test_aggregate(self, population):
+        """
+        The aggregates of every subgroup are the statistics of its agents
+        """
+        aggregator = Aggregator(population)
+        mh = np.random.default_rng(1).normal(size=population.size)
+        data = aggregator.aggregate(2, "hard", mh, population)
+
+        assert list(data.columns) == aggregator.columns
+        assert len(data) == 1 + len(Hypothesis.all_possible_features)
+        assert (data["step_id"] == 2).all() and (data["lockdown"] == "hard").all()
+        quantile_columns = [col for col in data.columns if "_q" in col]
+        share_columns = [col for col in data.columns if col.startswith("share_")]
+        for (_, row), name in zip(data.iterrows(), Population.feature_names):
+            if name == "baseline":
+                agents = np.ones(population.size, dtype=bool)
+                assert (row["group"], row["category"]) == ("all", "all")
+            else:
+                agents = population.features[:, Population.feature_names.index(name)]
+                agents = agents == 1
+            assert row["agents"] == agents.sum()
+            if not agents.any():
+                assert row[quantile_columns + ["prevalence"]].isna().all()
+                continue
+            assert row["mean_mental_health"] == pytest.approx(mh[agents].mean())
+            assert row[quantile_columns].tolist() == pytest.approx(
+                np.quantile(mh[agents], aggregator.quantiles)
+            )
+            assert row["prevalence"] == pytest.approx(
+                population.covid_status[agents].mean()
+            )
+            assert row[share_columns].tolist() == pytest.approx(
+                population.chosen_actions[agents].mean(axis=0)
+            )
+
+    @pytest.mark.filterwarnings("ignore:Given sim_size")
+    @pytest.mark.parametrize("output_format", ["csv", "npz"])
+    @patch("comma.model.Hypothesis.get_positive_cases")
+    def test_run(self, mock_positive_cases, output_format, tmp_path):
+        """
+        The size of the aggregates doesn't depend on the number of agents,
+        and the aggregates don't change the simulation
+        """
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        results = []
+        for size in [20, 60]:
+            out_path = tmp_path / f"aggregates_{size}.{output_format}"
+            model = Model(size, self.dir_params, seed=0, vectorized=True)
+            model.run(
+                4,
+                self.lockdown_policy,
+                out_path,
+                output_format=output_format,
+                aggregate=True,
+            )
+            assert model.history.keep_steps == 1
+            results.append(read_results(out_path, output_format))
+        assert (
+            len(results[0])
+            == len(results[1])
+            == 4 * (1 + len(Hypothesis.all_possible_features))
+        )
+
+        full = Model(60, self.dir_params, seed=0, vectorized=True)
+        full.run(4, self.lockdown_policy, tmp_path / "full.csv")
+        expected = read_results(tmp_path / "full.csv")
+        everyone = results[1][results[1]["group"] == "all"]
+        assert everyone["mean_mental_health"].tolist() == pytest.approx(
+            expected.groupby("step_id")["cumulative_mental_health"].mean().tolist(),
+            abs=1e-6,
+        )
+        assert everyone["lockdown"].tolist() == self.lockdown_policy
+
+    @pytest.mark.filterwarnings("ignore:Given sim_size")
+    @patch("comma.model.Hypothesis.get_positive_cases")
+    def test_resume(self, mock_positive_cases, tmp_path):
+        """
+        A resumed simulation keeps writing the aggregates
+        """
+        steps = 6
+        mock_positive_cases.return_value = pd.Series([1000] * steps)
+        lockdown_policy = ["easy"] * 3 + ["hard"] * 3
+        expected_path = tmp_path / "expected.csv"
+        out_path = tmp_path / "out.csv"
+        checkpoint = tmp_path / "checkpoint.npz"
+
+        expected = Model(20, self.dir_params, seed=0, vectorized=True)
+        expected.run(steps, lockdown_policy, expected_path, aggregate=True)
+
+        model = Model(20, self.dir_params, seed=0, vectorized=True)
+        update = model.update
+
+        def interrupted_update(lockdown, step):
+            if step == 5:
+                raise KeyboardInterrupt
+            update(lockdown, step)
+
+        with patch.object(model, "update", side_effect=interrupted_update):
+            with pytest.raises(KeyboardInterrupt):
+                model.run(
+                    steps,
+                    lockdown_policy,
+                    out_path,
+                    checkpoint_path=checkpoint,
+                    checkpoint_every=2,
+                    aggregate=True,
+                )
+        Model.resume(checkpoint, progress=False)
+
+        assert out_path.read_bytes() == expected_path.read_bytes()
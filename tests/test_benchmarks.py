@@ -0,0 +1,60 @@
+from benchmarks.run import PHASES, compare, main, new_cases, simulate
+import json
+import numpy as np
+
+
+class TestBenchmarks:
+    def test_new_cases(self):
+        assert list(new_cases(100_000, 3)) == [35, 41, 38]
+        assert len(new_cases(1000, 25)) == 25
+        assert np.all(new_cases(10, 10) >= 1)
+
+    def test_simulate(self):
+        timer = simulate(50, steps=3, trace_memory=True)
+
+        assert timer.calls == {
+            "populate": 1,
+            "agents": 1,
+            "step": 3,
+            "update": 3,
+            "report": 1,
+        }
+        assert all(timer.seconds[phase] > 0 for phase in PHASES)
+        assert all(timer.peak_alloc[phase] > 0 for phase in PHASES)
+
+    def test_compare(self):
+        def results(seconds, memory):
+            return {
+                "results": [
+                    {
+                        "size": 1000,
+                        "phase": "step",
+                        "seconds": seconds,
+                        "peak_alloc_mb": memory,
+                    }
+                ]
+            }
+
+        baseline = results(1.0, 100.0)
+        assert compare(results(1.1, 110.0), baseline) == []
+        assert compare(results(0.5, 10.0), baseline) == []
+        assert len(compare(results(1.5, 100.0), baseline)) == 1
+        assert len(compare(results(1.0, 150.0), baseline)) == 1
+        # below the noise
+        assert compare(results(0.002, 0.5), results(0.001, 0.1)) == []
+
+    def test_run(self, tmp_path, capsys):
+        """
+        The results are written as json, and compared with a baseline
+        """
+        out = tmp_path / "results.json"
+        args = ["run", "--sizes", "20", "--steps", "2", "--out", str(out)]
+        assert main(args) == 0
+        with open(out) as f:
+            results = json.load(f)
+        assert results["meta"]["steps"] == 2
+        assert [r["phase"] for r in results["results"]] == PHASES
+        assert all(r["peak_alloc_mb"] > 0 for r in results["results"])
+
+        assert main(["compare", str(out), str(out)]) == 0
+        assert "No regression" in capsys.readouterr().out
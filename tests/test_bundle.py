@@ -0,0 +1,131 @@
+from comma.bundle import ParameterBundle, load_bundle
+from comma.hypothesis import Hypothesis
+from comma.individual import Individual
+import numpy as np
+import pandas as pd
+import pytest
+import shutil
+from unittest.mock import patch
+
+
+class TestParameterBundle:
+    @pytest.fixture
+    def dir_params(self, tmp_path):
+        return shutil.copytree("parameters/", tmp_path / "parameters")
+
+    def test_same_as_hypotheses(self, tmp_path):
+        """
+        The bundle holds the matrices read by `Hypothesis.read_hypotheses`
+        """
+        bundle = load_bundle("parameters/", cache_dir=tmp_path)
+        hypotheses = bundle.hypotheses(["easy", "hard", "easy"])
+
+        assert bundle.lockdowns == ["easy", "hard"]
+        assert bundle.matrices.shape == (2, 3, 9, 43)
+        for lockdown, (matrix, infected, effects) in hypotheses.items():
+            expected = Hypothesis.read_hypotheses("parameters/", {lockdown}, "lockdown")
+            pd.testing.assert_frame_equal(matrix, expected[lockdown])
+            pd.testing.assert_frame_equal(
+                infected,
+                Individual.modify_policy_when_infected(expected[lockdown]),
+                check_dtype=False,
+            )
+            expected = Hypothesis.read_hypotheses("parameters/", {lockdown}, "actions")
+            pd.testing.assert_frame_equal(effects, expected[lockdown])
+
+        with pytest.raises(ValueError, match="No hypotheses"):
+            bundle.hypotheses(["medium"])
+
+    def test_cached(self, dir_params, tmp_path):
+        """
+        Every lockdown is compiled once, until one of its files changes
+        """
+        cache_dir = tmp_path / "cache"
+        with patch.object(
+            ParameterBundle, "compile", wraps=ParameterBundle.compile
+        ) as mock_compile:
+            load_bundle(dir_params, ["easy"], cache_dir=cache_dir)
+            first = load_bundle(dir_params, ["hard", "easy"], cache_dir=cache_dir)
+            second = load_bundle(dir_params, cache_dir=cache_dir)
+            assert [call.args[1] for call in mock_compile.call_args_list] == [
+                ["easy"],
+                ["hard"],
+            ]
+            assert second.lockdowns == ["easy", "hard"]
+            assert not second.matrices.flags.writeable
+            assert np.array_equal(first.matrices, second.matrices)
+
+            fpath = dir_params / "lockdown_hard.csv"
+            fpath.write_text(fpath.read_text().replace("-0.39", "-0.5", 1))
+            third = load_bundle(dir_params, cache_dir=cache_dir)
+            assert mock_compile.call_args.args[1] == ["hard"]
+            assert np.array_equal(first.matrices[0], third.matrices[0])
+            assert not np.array_equal(first.matrices[1], third.matrices[1])
+
+    def test_aligned(self, dir_params, tmp_path):
+        """
+        The rows and columns of the files can be in any order,
+        and other lockdowns are compiled when they are asked for
+        """
+        df = pd.read_csv(dir_params / "lockdown_easy.csv")
+        df = df[df.columns[::-1]].iloc[::-1]
+        df.to_csv(dir_params / "lockdown_medium.csv", index=False)
+        shutil.copy(
+            dir_params / "actions_effects_on_mh_easy.csv",
+            dir_params / "actions_effects_on_mh_medium.csv",
+        )
+
+        assert load_bundle(dir_params, cache_dir=tmp_path).lockdowns == [
+            "easy",
+            "hard",
+        ]
+        bundle = load_bundle(dir_params, ["medium", "easy"], cache_dir=tmp_path)
+        assert bundle.lockdowns == ["easy", "medium"]
+        easy, medium = bundle.matrices
+        assert np.array_equal(easy, medium)
+
+    def test_invalid(self, dir_params, tmp_path):
+        (dir_params / "actions_effects_on_mh_hard.csv").unlink()
+        with pytest.raises(ValueError, match="not found: actions_effects_on_mh_hard"):
+            load_bundle(dir_params, cache_dir=tmp_path)
+
+        shutil.copy("parameters/actions_effects_on_mh_hard.csv", dir_params)
+        fpath = dir_params / "lockdown_easy.csv"
+        df = pd.read_csv(fpath)
+        df[df["actions"] != "exercise"].to_csv(fpath, index=False)
+        with pytest.raises(ValueError, match="Missing actions"):
+            load_bundle(dir_params, cache_dir=tmp_path)
+        assert not list(tmp_path.glob("params-*")), "invalid files are not cached"
+
+    def test_other_lockdowns(self, dir_params, tmp_path):
+        """
+        The files of the lockdowns that are not asked for are not read,
+        e.g. an incomplete lockdown, or a backup of one
+        """
+        df = pd.read_csv(dir_params / "lockdown_easy.csv")
+        df.iloc[:3].to_csv(dir_params / "lockdown_backup.csv", index=False)
+
+        bundle = load_bundle(dir_params, ["easy", "hard"], cache_dir=tmp_path)
+        assert bundle.lockdowns == ["easy", "hard"]
+        with pytest.raises(ValueError, match="not found: actions_effects_on_mh_backup"):
+            load_bundle(dir_params, ["easy", "backup"], cache_dir=tmp_path)
+
+    def test_cache_not_writable(self, tmp_path):
+        """
+        A cache that can't be written doesn't stop the simulation
+        """
+        (tmp_path / "file").write_text("")
+        expected = load_bundle("parameters/", cache_dir=tmp_path / "cache")
+        with pytest.warns(UserWarning, match="Could not cache"):
+            bundle = load_bundle("parameters/", cache_dir=tmp_path / "file" / "cache")
+        assert bundle.lockdowns == expected.lockdowns
+        assert np.array_equal(bundle.matrices, expected.matrices)
+
+    def test_version(self, tmp_path):
+        """
+        The compiled lockdowns of another version of the bundle are not used
+        """
+        load_bundle("parameters/", cache_dir=tmp_path)
+        with patch("comma.bundle.BUNDLE_VERSION", -1):
+            load_bundle("parameters/", cache_dir=tmp_path)
+        assert len(list(tmp_path.glob("params-*"))) == 4
@@ -0,0 +1,387 @@
+from comma.casedata import (
+    CaseStore,
+    fetch_file,
+    iter_records,
+    load_case_store,
+    main,
+    read_covid_file,
+    read_records,
+    stream_covid_data,
+)
+from comma.hypothesis import Hypothesis
+from email.utils import parsedate_to_datetime
+import functools
+import gzip
+import http.server
+import json
+import os
+import pandas as pd
+import pytest
+import requests
+import threading
+from unittest.mock import patch
+
+SNAPSHOT = os.path.join(os.path.dirname(__file__), "data", "rivm_snapshot.json")
+
+
+class RivmHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Stand-in of the RIVM server, serving the snapshot at /rivm.json with
+    an ETag, conditional and range requests, and gzip compression
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.client_address, dict(self.headers)))
+        if self.path != "/rivm.json":
+            self.send_error(404)
+            return
+
+        etag = self.headers.get("If-None-Match")
+        since = self.headers.get("If-Modified-Since")
+        if etag is not None:
+            not_modified = etag == server.etag
+        else:
+            not_modified = since is not None and parsedate_to_datetime(
+                since
+            ) >= parsedate_to_datetime(server.last_modified)
+        if not_modified:
+            self.send_response(304)
+            self.send_header("ETag", server.etag)
+            self.end_headers()
+            return
+
+        payload = server.body
+        compressed = "gzip" in self.headers.get("Accept-Encoding", "")
+        if compressed:
+            payload = gzip.compress(payload, mtime=0)
+        offset = 0
+        ranges = self.headers.get("Range")
+        if ranges is not None and self.headers.get("If-Range") == server.etag:
+            offset = int(ranges.removeprefix("bytes=").rstrip("-"))
+
+        self.send_response(206 if offset else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", server.etag)
+        self.send_header("Last-Modified", server.last_modified)
+        self.send_header("Accept-Ranges", "bytes")
+        if compressed:
+            self.send_header("Content-Encoding", "gzip")
+        if offset:
+            self.send_header(
+                "Content-Range", f"bytes {offset}-{len(payload) - 1}/{len(payload)}"
+            )
+        self.send_header("Content-Length", str(len(payload) - offset))
+        self.end_headers()
+        if server.fail_after is not None:
+            # the connection is lost in the middle of the transfer
+            self.wfile.write(payload[offset:][: server.fail_after])
+            server.fail_after = None
+            self.close_connection = True
+            return
+        self.wfile.write(payload[offset:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def rivm_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RivmHandler)
+    with open(SNAPSHOT, "rb") as f:
+        server.body = f.read()
+    server.etag = '"v1"'
+    server.last_modified = "Sat, 01 Jan 2022 10:00:00 GMT"
+    server.fail_after = None
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_port}/rivm.json"
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestCaseStore:
+    @pytest.fixture
+    def rivm_data(self):
+        # three reports of the same days, in no particular order
+        records = []
+        reports = [
+            ("2022-01-04T10:00:00", 5),
+            ("2021-12-31T10:00:00", 0),
+            ("2022-01-02T10:00:00", 1),
+        ]
+        for report, offset in reports:
+            for day in ["2022-01-01", "2022-01-02", "2022-01-03"]:
+                for code, name, total in [
+                    ("GM0289", "Wageningen", 6000),
+                    ("GM0014", "Groningen", 9000),
+                    (None, "", 1),
+                ]:
+                    records.append(
+                        {
+                            "Version": 8,
+                            "Date_of_report": report,
+                            "Date_of_publication": day,
+                            "Municipality_code": code,
+                            "Municipality_name": name,
+                            "Total_reported": total + int(day[-1]) * 10 + offset,
+                        }
+                    )
+        return pd.DataFrame(records[::-1])
+
+    def test_query(self, rivm_data, tmp_path):
+        """
+        A query gives the same records as filtering the RIVM data
+        """
+        store = CaseStore.ingest(rivm_data)
+        store.save(tmp_path / "store.npz")
+        store = CaseStore.load(tmp_path / "store.npz")
+
+        actual = store.query("GM0289", "2022-01-01", "2022-01-04")
+        # the reports of 31/12 and of the 4th at 10:00 are outside the period
+        expected = rivm_data[
+            (rivm_data["Municipality_code"] == "GM0289")
+            & (rivm_data["Date_of_report"] == "2022-01-02T10:00:00")
+        ]
+        assert list(actual.columns) == list(rivm_data.columns)
+        assert len(actual) == 3
+        assert sorted(actual["Total_reported"]) == sorted(expected["Total_reported"])
+        assert set(actual["Municipality_name"]) == {"Wageningen"}
+        assert set(actual["Date_of_report"]) == {pd.Timestamp("2022-01-02 10:00")}
+
+        assert store.query("XL4521", "2022-01-01", "2022-01-04").empty
+        with pytest.raises(ValueError, match="outside available dates"):
+            store.query("GM0289", "2021-12-01", "2022-01-04")
+
+    @patch("comma.hypothesis.Hypothesis.download_covid_data")
+    def test_positive_cases(self, mock_download, rivm_data):
+        """
+        The data is downloaded once, then queried from the store
+        """
+        mock_download.return_value = rivm_data
+        for code in ["GM0289", "GM0014", "GM0289"]:
+            hypothesis = Hypothesis("2022-01-01", 3)
+            cases = hypothesis.get_positive_cases(code)
+
+        assert mock_download.call_count == 1
+        # the most recent report of every day
+        assert list(cases) == [6011, 6021, 6031]
+        assert load_case_store() is not None
+
+    @patch("comma.hypothesis.Hypothesis.download_covid_data")
+    def test_refresh(self, mock_download, rivm_data, capsys):
+        mock_download.return_value = rivm_data
+        main(["info"])
+        assert "No case data" in capsys.readouterr().out
+
+        main(["refresh"])
+        assert mock_download.call_count == 1
+        assert "27 records of 3 municipalities" in capsys.readouterr().out
+
+
+class TestStreaming:
+    @pytest.fixture
+    def records(self):
+        return [
+            {
+                "Date_of_report": f"2022-01-0{day}T10:00:00",
+                "Date_of_publication": f"2022-01-0{day}",
+                "Municipality_code": code,
+                "Municipality_name": name,
+                "Total_reported": 100 * day + i,
+            }
+            for day in range(1, 5)
+            for i, (code, name) in enumerate(
+                [("GM1900", "Súdwest-Fryslân"), ("GM0289", "Wageningen"), (None, "")]
+            )
+        ]
+
+    @pytest.fixture
+    def json_file(self, tmp_path, records):
+        fpath = tmp_path / "rivm.json"
+        fpath.write_text(json.dumps(records, indent=1, ensure_ascii=False), "utf-8")
+        return fpath
+
+    def test_iter_records(self, json_file, records):
+        """
+        Records split across chunks (even inside a multi-byte
+        character) are parsed as a whole
+        """
+        content = json_file.read_bytes()
+        for size in [1, 7, 64, len(content)]:
+            chunks = [content[i:][:size] for i in range(0, len(content), size)]
+            assert list(iter_records(chunks)) == records
+
+        assert list(iter_records([b"[]"])) == []
+        with pytest.raises(ValueError):
+            list(iter_records([content[:-30]]))
+        with pytest.raises(ValueError):
+            list(iter_records([b'{"a": 1}']))
+
+    def test_read_records(self, json_file, records):
+        """
+        Only the records of the municipalities and dates asked for are kept
+        """
+        data = stream_covid_data(
+            str(json_file), ["GM1900"], "2022-01-02", "2022-01-04", chunk_size=16
+        )
+
+        expected = pd.DataFrame(records)
+        expected = expected[
+            (expected["Municipality_code"] == "GM1900")
+            & (expected["Date_of_report"] >= "2022-01-02")
+            & (expected["Date_of_report"] <= "2022-01-04")
+        ].reset_index(drop=True)
+        pd.testing.assert_frame_equal(data, expected)
+        assert len(data) == 2, "the report of the 4th at 10:00 is after the end"
+
+        everything = read_records([json_file.read_bytes()])
+        pd.testing.assert_frame_equal(everything, pd.DataFrame(records))
+
+    def test_missing_columns(self):
+        chunks = [b'[{"a": 1}, {"a": 2, "b": 3}, {"b": 4}]']
+        data = read_records(chunks)
+        expected = pd.DataFrame({"a": [1, 2, None], "b": [None, 3, 4]})
+        pd.testing.assert_frame_equal(data, expected)
+
+    def test_stream_from_http(self, json_file, records):
+        """
+        The file is parsed while it is served by a local HTTP server
+        """
+        handler = functools.partial(
+            http.server.SimpleHTTPRequestHandler, directory=json_file.parent
+        )
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = f"http://127.0.0.1:{server.server_port}/{json_file.name}"
+            data = stream_covid_data(url, ["GM0289"], chunk_size=32)
+            with pytest.raises(Exception, match="Failed to download"):
+                stream_covid_data(url + ".missing")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert list(data["Total_reported"]) == [101, 201, 301, 401]
+
+
+class TestDownload:
+    @pytest.fixture(autouse=True)
+    def no_backoff(self, monkeypatch):
+        monkeypatch.setattr("comma.casedata.BACKOFF", 0)
+
+    @pytest.fixture
+    def snapshot(self):
+        return read_covid_file(SNAPSHOT)
+
+    def test_compressed(self, rivm_server, snapshot, tmp_path):
+        """
+        The file is sent compressed, and kept compressed until it is parsed
+        """
+        fpath = tmp_path / "rivm.json"
+        meta = fetch_file(rivm_server.url, fpath)
+
+        _, headers = rivm_server.requests[-1]
+        assert "gzip" in headers["Accept-Encoding"]
+        assert meta == {
+            "etag": '"v1"',
+            "last_modified": "Sat, 01 Jan 2022 10:00:00 GMT",
+            "content_encoding": "gzip",
+        }
+        assert os.path.getsize(fpath) < len(rivm_server.body)
+        pd.testing.assert_frame_equal(read_covid_file(fpath), snapshot)
+        assert os.listdir(tmp_path) == ["rivm.json"]
+
+    def test_conditional(self, rivm_server, snapshot):
+        """
+        The file is downloaded again only when it changed
+        """
+        data = stream_covid_data(rivm_server.url)
+        pd.testing.assert_frame_equal(data, snapshot)
+        validators = data.attrs["http"]
+
+        assert stream_covid_data(rivm_server.url, validators=validators) is None
+        _, headers = rivm_server.requests[-1]
+        assert headers["If-None-Match"] == '"v1"'
+        assert headers["If-Modified-Since"] == "Sat, 01 Jan 2022 10:00:00 GMT"
+
+        # a server without ETag compares the dates
+        assert (
+            stream_covid_data(rivm_server.url, validators={**validators, "etag": None})
+            is None
+        )
+
+        rivm_server.etag = '"v2"'
+        assert stream_covid_data(rivm_server.url, validators=validators) is not None
+
+    def test_session_reused(self, rivm_server):
+        for _ in range(3):
+            stream_covid_data(rivm_server.url)
+        clients = {client for client, _ in rivm_server.requests}
+        assert len(clients) == 1, "the downloads share a connection"
+
+    def test_resume(self, rivm_server, snapshot, tmp_path):
+        """
+        An interrupted transfer is resumed where it stopped
+        """
+        rivm_server.fail_after = 100
+        data = stream_covid_data(rivm_server.url)
+
+        pd.testing.assert_frame_equal(data, snapshot)
+        (_, first), (_, second) = rivm_server.requests
+        assert "Range" not in first
+        assert second["Range"] == "bytes=100-"
+        assert second["If-Range"] == '"v1"'
+
+    def test_resume_next_call(self, rivm_server, snapshot, tmp_path):
+        """
+        A transfer that failed is resumed by the next download, unless
+        the file changed in the meantime
+        """
+        fpath = tmp_path / "rivm.json"
+        rivm_server.fail_after = 100
+        with pytest.raises(requests.ConnectionError):
+            fetch_file(rivm_server.url, fpath, retries=0)
+        assert os.path.getsize(f"{fpath}.part") == 100
+
+        fetch_file(rivm_server.url, fpath)
+        _, headers = rivm_server.requests[-1]
+        assert headers["Range"] == "bytes=100-"
+        pd.testing.assert_frame_equal(read_covid_file(fpath), snapshot)
+
+        rivm_server.fail_after = 100
+        with pytest.raises(requests.ConnectionError):
+            fetch_file(rivm_server.url, fpath, retries=0)
+        rivm_server.etag = '"v2"'
+        rivm_server.body = rivm_server.body.replace(b'"Version": 8', b'"Version": 9')
+        fetch_file(rivm_server.url, fpath)
+        assert set(read_covid_file(fpath)["Version"]) == {9}
+
+    def test_refresh(self, rivm_server, capsys):
+        """
+        Refreshing the store downloads the file only when it changed
+        """
+        main(["refresh", "--url", rivm_server.url])
+        assert "Stored 15 records" in capsys.readouterr().out
+        assert load_case_store().meta["etag"] == '"v1"'
+
+        main(["refresh", "--url", rivm_server.url])
+        assert "up to date" in capsys.readouterr().out
+        assert len(rivm_server.requests) == 2
+
+        main(["refresh", "--url", rivm_server.url, "--force"])
+        assert "Stored 15 records" in capsys.readouterr().out
+        _, headers = rivm_server.requests[-1]
+        assert "If-None-Match" not in headers
+
+        rivm_server.etag = '"v2"'
+        main(["refresh", "--url", rivm_server.url])
+        assert "Stored 15 records" in capsys.readouterr().out
+        assert load_case_store().meta["etag"] == '"v2"'
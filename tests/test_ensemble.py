@@ -0,0 +1,96 @@
+from comma.ensemble import run_ensemble
+from comma.model import Model
+from comma.population import Population
+import numpy as np
+import pandas as pd
+import pytest
+from unittest.mock import patch
+
+
+@pytest.mark.filterwarnings("ignore:Given sim_size")
+@patch("comma.model.Hypothesis.get_positive_cases")
+class TestEnsemble:
+    dir_params = "parameters/"
+    steps = 4
+    lockdown_policy = ["easy", "easy", "hard", "hard"]
+
+    def run(self, out_dir, workers, replicates=3, seed=0):
+        return run_ensemble(
+            replicates,
+            20,
+            self.dir_params,
+            self.steps,
+            self.lockdown_policy,
+            out_dir,
+            seed=seed,
+            workers=workers,
+        )
+
+    def test_reproducible(self, mock_positive_cases, tmp_path):
+        """
+        The replicates are the same whatever the number of workers
+        """
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        serial = self.run(tmp_path / "serial", workers=1)
+        parallel = self.run(tmp_path / "parallel", workers=2)
+
+        assert len(serial) == len(parallel) == 3
+        for serial_path, parallel_path in zip(serial, parallel):
+            with open(serial_path) as f, open(parallel_path) as g:
+                assert f.read() == g.read()
+
+    def test_replicates_differ(self, mock_positive_cases, tmp_path):
+        """
+        Each replicate has its own seed, spawned from the seed of the ensemble
+        """
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        paths = self.run(tmp_path, workers=1, replicates=2)
+        first, second = [pd.read_csv(path, sep=";", decimal=",") for path in paths]
+
+        assert not first["cumulative_mental_health"].equals(
+            second["cumulative_mental_health"]
+        )
+
+        # the first replicate is a model seeded with the first child seed
+        seed = np.random.SeedSequence(0).spawn(2)[0]
+        model = Model(20, self.dir_params, seed=seed, vectorized=True)
+        model.run(self.steps, self.lockdown_policy, out_path=tmp_path / "model.csv")
+        with open(paths[0]) as f:
+            assert f.read() == (tmp_path / "model.csv").read_text()
+
+    def test_no_replicates(self, mock_positive_cases, tmp_path):
+        with pytest.raises(ValueError):
+            self.run(tmp_path, workers=1, replicates=0)
+
+    def test_shared_population(self, mock_positive_cases, tmp_path):
+        """
+        With a shared population, the replicates simulate the same agents
+        """
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        paths = run_ensemble(
+            2,
+            20,
+            self.dir_params,
+            self.steps,
+            self.lockdown_policy,
+            tmp_path,
+            seed=0,
+            workers=1,
+            shared_population=True,
+        )
+
+        # the population is seeded from the seed of the ensemble
+        seed = np.random.SeedSequence(0)
+        features = Population.populate(
+            20, self.dir_params, np.random.default_rng(seed)
+        ).features
+        model = Model(
+            20,
+            self.dir_params,
+            seed=seed.spawn(2)[1],
+            vectorized=True,
+            population=Population(features),
+        )
+        model.run(self.steps, self.lockdown_policy, out_path=tmp_path / "model.csv")
+        with open(paths[1]) as f:
+            assert f.read() == (tmp_path / "model.csv").read_text()
@@ -0,0 +1,52 @@
+from comma.history import History
+import numpy as np
+import pytest
+
+
+class TestHistory:
+    @pytest.fixture
+    def history(self):
+        history = History(steps=2, size=3)
+        history.record(
+            0, "easy", np.zeros(3), np.array([1.0, 2.0, 3.0]), np.zeros(3), np.nan
+        )
+        history.record(
+            1,
+            "hard",
+            np.ones(3),
+            np.array([2.0, 3.0, 4.0]),
+            np.array([0, 1, 0]),
+            np.array([np.nan, 1, np.nan]),
+        )
+        return history
+
+    def test_to_frame(self, history):
+        df = history.to_frame()
+
+        assert list(df.columns) == History.columns
+        assert len(df) == 6
+        assert list(df["step_id"]) == [0, 0, 0, 1, 1, 1]
+        assert list(df["agent_id"]) == [0, 1, 2, 0, 1, 2]
+        assert list(df["lockdown"]) == ["easy"] * 3 + ["hard"] * 3
+        assert list(df["cumulative_mental_health"]) == [1, 2, 3, 2, 3, 4]
+        assert df["days_since_first_infection"].isna().sum() == 5
+
+    def test_fill(self, history):
+        # the state of the agents comes back from the rows of results
+        restored = History(steps=2, size=3)
+        restored.fill(history.to_frame())
+
+        for name in ["delta_mh", "mh", "covid_status"]:
+            assert np.array_equal(getattr(restored, name), getattr(history, name))
+        assert np.array_equal(
+            restored.days_since_positive, history.days_since_positive, equal_nan=True
+        )
+
+    def test_extend(self, history):
+        history.extend(4)
+
+        assert history.steps == 4
+        assert history.recorded == 2
+        assert np.all(history.mh[1] == [2.0, 3.0, 4.0])
+        assert np.all(np.isnan(history.days_since_positive[2:]))
+        assert len(history.to_frame()) == 6
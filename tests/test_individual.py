@@ -229,3 +229,24 @@ class TestIndividual:
         expected = 0.20
         error_margin = 0.01
         assert proportion == pytest.approx(expected, abs=error_margin)
+
+    def test_view_on_population(self, dir_params, expected_cols, seed):
+        """
+        Agents only hold an index into the population arrays, and a
+        standalone agent gets a population of its own
+        """
+        agents = Individual.populate(2, dir_params, rng=np.random.default_rng(seed))
+        assert not hasattr(agents[0], "__dict__")
+        assert agents[1].get_features().name == 1
+
+        standalone = Individual(7, dir_params, agents[1].get_features())
+        standalone.covid_status = 1
+        assert standalone.get_covid_status() == 1
+        assert agents[1].get_covid_status() == 0
+        assert list(standalone.get_features().index) == expected_cols
+        assert np.all(standalone.get_features() == agents[1].get_features())
+
+        # the recovery status is set per agent
+        assert np.isnan(agents[0].recovery)
+        agents[0].recovery = True
+        assert agents[0].recovery and np.isnan(agents[1].recovery)
@@ -0,0 +1,131 @@
+from comma.ipf import IPFTable, alias_table, fit_ipf, load_ipf_table
+from comma.population import Population
+import numpy as np
+import pandas as pd
+import pytest
+from unittest.mock import patch
+
+
+class TestIPF:
+    @pytest.fixture
+    def dir_params(self, tmp_path):
+        # a small weights file
+        df_weights = pd.DataFrame(
+            {
+                "gender": ["M", "M", "F", "F"],
+                "BMI": ["obese", "unknown", "obese", "unknown"],
+                "weight": [10.0, 30.0, 20.0, 40.0],
+            }
+        )
+        df_weights.to_csv(tmp_path / "ipf_weights.csv.zip", sep=",")
+        return tmp_path
+
+    def test_alias_table(self):
+        # drawing with the alias table follows the weights
+        weights = np.array([1.0, 0.0, 5.0, 2.0, 2.0])
+        prob, alias = alias_table(weights)
+        table = IPFTable({}, np.empty((5, 0)), prob, alias, None)
+
+        rows = table.sample(200_000, np.random.default_rng(0), alias=True)
+        frequencies = np.bincount(rows, minlength=5) / len(rows)
+
+        assert np.allclose(frequencies, weights / weights.sum(), atol=0.005)
+
+    def test_cache(self, dir_params):
+        # the weights file is parsed once, then the table is read from the cache
+        table = load_ipf_table(dir_params)
+        assert table.categories == {"gender": ["M", "F"], "BMI": ["obese", "unknown"]}
+
+        with patch("comma.ipf.pd.read_csv", side_effect=AssertionError):
+            cached_table = load_ipf_table(dir_params)
+
+        assert isinstance(cached_table.codes, np.memmap)
+        assert np.array_equal(cached_table.codes, table.codes)
+        assert np.array_equal(cached_table.alias, table.alias)
+
+    def test_draw_compatible(self, dir_params):
+        # by default the draws are the ones of `rng.choice` with the weights,
+        # as sampled by earlier versions, and use as many random numbers
+        df_weights = pd.read_csv(dir_params / "ipf_weights.csv.zip", index_col=0)
+        weights = df_weights["weight"] / df_weights["weight"].sum()
+        rng = np.random.default_rng(0)
+        expected = rng.choice(df_weights.index, 1000, p=weights)
+
+        table = load_ipf_table(dir_params)
+        table_rng = np.random.default_rng(0)
+        assert np.array_equal(table.sample(1000, table_rng), expected)
+        assert table_rng.random() == rng.random()
+
+    def test_populate_ipf(self, dir_params):
+        # the sampled agents are one-hot encoded with lowercase names
+        size = 10_000
+        population = Population.populate_ipf(size, dir_params, np.random.default_rng(0))
+        frame = population.to_frame()
+
+        assert np.all(frame["gender_m"] + frame["gender_f"] == 1)
+        assert np.all(frame["bmi_obese"] + frame["bmi_unknown"] == 1)
+        assert frame["gender_m"].mean() == pytest.approx(0.4, abs=0.02)
+        assert frame["bmi_obese"].mean() == pytest.approx(0.3, abs=0.02)
+
+    def test_sampling_from_ipf(self, dir_params):
+        # the sample has the variables and categories of the weights file
+        sample = Population.sampling_from_ipf(100, dir_params)
+
+        assert list(sample.columns) == ["gender", "BMI"]
+        assert set(sample["gender"]) <= {"M", "F"}
+
+    @pytest.fixture
+    def survey(self):
+        rng = np.random.default_rng(0)
+        size = 2000
+        gender = rng.choice(["m", "f"], size)
+        depressed = np.where(
+            gender == "f",
+            rng.choice(["yes", "no"], size, p=[0.3, 0.7]),
+            rng.choice(["yes", "no"], size, p=[0.2, 0.8]),
+        )
+        education = rng.choice(["low", "medium", "high"], size)
+        return pd.DataFrame(
+            {"gender": gender, "depressed": depressed, "education": education}
+        )
+
+    def test_fit_ipf(self, survey, dir_params):
+        # the fitted weights match the crosstabs, and can be sampled from
+        crosstabs = [
+            pd.crosstab(survey["gender"], survey["depressed"]),
+            pd.crosstab(survey["education"], survey["gender"]),
+        ]
+        fit = fit_ipf(crosstabs, tol=1e-8)
+
+        assert fit.converged
+        assert fit.weights.shape == (2, 2, 3)
+        assert list(fit.categories) == ["gender", "depressed", "education"]
+        for crosstab in crosstabs:
+            fitted = fit.to_frame().pivot_table(
+                index=crosstab.index.name,
+                columns=crosstab.columns.name,
+                values="weight",
+                aggfunc="sum",
+            )
+            fitted = fitted.reindex_like(crosstab) * crosstab.to_numpy().sum()
+            assert np.allclose(fitted, crosstab)
+
+        fit.save(dir_params)
+        sample = Population.sampling_from_ipf(100, dir_params)
+        assert list(sample.columns) == ["gender", "depressed", "education"]
+
+    def test_fit_ipf_not_converged(self, survey):
+        # inconsistent marginals can't be matched
+        crosstabs = [
+            pd.crosstab(survey["gender"], survey["depressed"]),
+            pd.Series([1, 9], index=pd.Index(["m", "f"], name="gender")),
+        ]
+        with pytest.warns(UserWarning, match="IPF did not converge"):
+            fit = fit_ipf(crosstabs, max_iter=10)
+
+        assert not fit.converged
+        assert fit.iterations == 10
+
+    def test_fit_ipf_unnamed(self):
+        with pytest.raises(ValueError):
+            fit_ipf([pd.DataFrame([[1, 2], [3, 4]])])
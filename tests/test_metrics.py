@@ -0,0 +1,122 @@
+from comma.metrics import NO_METRICS, Metrics
+from comma.model import Model
+import json
+import pandas as pd
+import pstats
+import pytest
+import tracemalloc
+from unittest.mock import patch
+
+
+@pytest.mark.filterwarnings("ignore:Given sim_size")
+@patch("comma.model.Hypothesis.get_positive_cases")
+class TestMetrics:
+    dir_params = "parameters/"
+    lockdown_policy = ["easy", "easy", "hard", "hard"]
+
+    def run(self, out_path, metrics=None, vectorized=True):
+        model = Model(20, self.dir_params, seed=0, vectorized=vectorized)
+        model.run(4, self.lockdown_policy, out_path=out_path, metrics=metrics)
+        return model
+
+    def test_records(self, mock_positive_cases, tmp_path):
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        records = []
+        model = self.run(tmp_path / "out.csv", Metrics(callback=records.append))
+
+        assert [r["event"] for r in records] == ["setup"] + ["step"] * 4 + ["run"]
+        setup, *steps, run = records
+        assert set(setup["phases"]) == {"population", "new_cases", "hypotheses"}
+        assert [r["step"] for r in steps] == [0, 1, 2, 3]
+        assert [r["lockdown"] for r in steps] == self.lockdown_policy
+        for record in steps:
+            assert set(record["phases"]) == {
+                "recovery",
+                "infection",
+                "actions",
+                "effects",
+                "update",
+                "report",
+            }
+            assert sum(record["phases"].values()) <= record["seconds"]
+            assert record["agent_steps_per_second"] > 0
+            assert record["peak_rss_mb"] > 0
+            assert isinstance(record["net_live_blocks"], int)
+        assert run["steps"] == 4
+        assert run["phases"]["update"] == pytest.approx(
+            sum(r["phases"]["update"] for r in steps)
+        )
+        assert model.metrics is NO_METRICS
+
+    def test_object_engine(self, mock_positive_cases, tmp_path):
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        records = []
+        self.run(tmp_path / "out.csv", Metrics(callback=records.append), False)
+        assert {"recovery", "infection", "actions"} <= set(records[1]["phases"])
+
+    def test_same_results(self, mock_positive_cases, tmp_path):
+        """
+        The metrics don't change the simulation
+        """
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        self.run(tmp_path / "without.csv")
+        self.run(tmp_path / "with.csv", Metrics(path=tmp_path / "metrics.jsonl"))
+        assert (tmp_path / "with.csv").read_text() == (
+            tmp_path / "without.csv"
+        ).read_text()
+
+        with open(tmp_path / "metrics.jsonl") as f:
+            records = [json.loads(line) for line in f]
+        assert [r["event"] for r in records] == ["setup"] + ["step"] * 4 + ["run"]
+
+    def test_profile(self, mock_positive_cases, tmp_path):
+        """
+        Some steps can be profiled, and their allocations traced
+        """
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        records = []
+        metrics = Metrics(
+            callback=records.append,
+            profile_steps=(1, 3),
+            profile_path=tmp_path / "run.prof",
+            trace_steps=(2, 4),
+            top=3,
+        )
+        self.run(tmp_path / "out.csv", metrics)
+
+        events = [r["event"] for r in records]
+        assert events[-3:] == ["tracemalloc", "run", "profile"]
+        assert ["traced_peak_mb" in r for r in records if r["event"] == "step"] == [
+            False,
+            False,
+            True,
+            True,
+        ]
+        assert all(
+            r["traced_allocated_mb"] > 0 for r in records if "traced_peak_mb" in r
+        )
+        tracemalloc_record = records[events.index("tracemalloc")]
+        assert tracemalloc_record["steps"] == [2, 4]
+        assert len(tracemalloc_record["top"]) == 3
+
+        stats = pstats.Stats(str(tmp_path / "run.prof"))
+        functions = {name for _, _, name in stats.stats}
+        assert "step_vectorized" in functions
+
+        with pytest.raises(ValueError):
+            Metrics(profile_steps=(0, 1))
+
+    def test_tracing_of_the_caller(self, mock_positive_cases, tmp_path):
+        """
+        The tracing started before the run goes on after it
+        """
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        tracemalloc.start()
+        try:
+            self.run(tmp_path / "out.csv", Metrics(trace_steps=(1, 3)))
+            assert tracemalloc.is_tracing()
+        finally:
+            tracemalloc.stop()
+
+        self.run(tmp_path / "out.csv", Metrics(trace_steps=(1, 2)))
+        assert not tracemalloc.is_tracing()
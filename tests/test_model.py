@@ -1,8 +1,13 @@
+from comma.hypothesis import Hypothesis
+from comma.individual import Individual
 from comma.model import Model
+from comma.population import Population
+from comma.writer import read_results
 import numpy as np
 import pandas as pd
 import pytest
 import os
+from unittest.mock import patch
 
 
 class TestModel:
@@ -132,3 +137,215 @@ class TestModel:
         actual = [agent.get_covid_status() for agent in negative_agents]
         expected = [1]
         assert expected == actual
+
+    def test_step_vectorized(self):
+        # test that the batched step infects the requested number of agents
+        # and makes every agent choose its actions
+        size = 50
+        new_infected = 5
+        model = Model(
+            size=size, dir_params=self.dir_parameters, seed=self.seed, vectorized=True
+        )
+        lockdown = Hypothesis.read_hypotheses(self.dir_parameters, {"easy"}, "lockdown")
+        action_effects = Hypothesis.read_hypotheses(
+            self.dir_parameters, {"easy"}, "actions"
+        )
+        model.step_vectorized(lockdown["easy"], action_effects["easy"], new_infected)
+
+        assert model.population.covid_status.sum() == new_infected
+        assert model.population.chosen_actions.shape == (size, 9)
+        assert all(
+            agent.days_since_positive == 1
+            for agent in model.agents
+            if agent.covid_status == 1
+        )
+
+    def test_update(self):
+        # test that the cumulative mental health is the previous one
+        # plus the incremental effect, minus a small baseline effect
+        model = Model(size=10, dir_params=self.dir_parameters, seed=self.seed)
+        model.population.status[:] = 1.0
+        model.update("easy", 0)
+        model.current_step += 1
+        model.population.status[:] = 2.0
+        model.update("hard", 1)
+
+        assert np.all(model.history.delta_mh[0] == 0)
+        assert np.all(model.history.mh[0] == 1.0)
+        assert np.all(model.history.delta_mh[1] == 2.0)
+        assert np.allclose(model.history.mh[1], 3.0, atol=0.01)
+        assert model.history.lockdown_names == ["easy", "hard"]
+
+    @pytest.mark.filterwarnings("ignore:Given sim_size")
+    @patch("comma.model.Hypothesis.get_positive_cases")
+    def test_streamed_output(self, mock_positive_cases, tmp_path):
+        # test that the output streamed while running is the same as the
+        # output written at the end of the simulation
+        steps = 4
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        lockdown_pattern = ["easy", "easy", "hard", "hard"]
+
+        model = Model(
+            size=20, dir_params=self.dir_parameters, seed=self.seed, vectorized=True
+        )
+        model.run(steps, lockdown_pattern, out_path=tmp_path / "streamed.csv")
+        model.report(tmp_path / "report.csv")
+
+        streamed_model = Model(
+            size=20, dir_params=self.dir_parameters, seed=self.seed, vectorized=True
+        )
+        streamed_model.run(
+            steps,
+            lockdown_pattern,
+            out_path=tmp_path / "streamed_only.csv",
+            keep_history=False,
+            chunk_rows=30,
+        )
+
+        expected = (tmp_path / "report.csv").read_text()
+        assert (tmp_path / "streamed.csv").read_text() == expected
+        assert (tmp_path / "streamed_only.csv").read_text() == expected
+        assert streamed_model.history.mh.shape == (1, 20)
+
+    @pytest.mark.filterwarnings("ignore:Given sim_size")
+    @patch("comma.model.Hypothesis.get_positive_cases")
+    def test_lockdown_infected_cached(self, mock_positive_cases, tmp_path):
+        # test that the lockdown of positive agents is not derived once per
+        # agent and step, it is compiled once per policy in the parameter bundle
+        mock_positive_cases.return_value = pd.Series([5000, 10000, 15000, 20000])
+        model = Model(size=50, dir_params=self.dir_parameters, seed=self.seed)
+
+        with patch(
+            "comma.model.Individual.modify_policy_when_infected",
+            wraps=Individual.modify_policy_when_infected,
+        ) as mock_modify:
+            model.run(
+                4, ["easy", "easy", "hard", "hard"], out_path=tmp_path / "out.csv"
+            )
+
+        assert model.population.covid_status.sum() > 0
+        # once per policy, as the cache of the test starts empty
+        assert mock_modify.call_count == 2
+
+    def test_given_population(self):
+        population = Population.populate(
+            5, self.dir_parameters, np.random.default_rng(0)
+        )
+        model = Model(5, self.dir_parameters, seed=self.seed, population=population)
+        assert model.population is population
+        assert model._agents is None, "the agents are created on first use"
+        assert len(model.agents) == 5
+        assert model.agents[3].get_features().equals(model.population.to_frame().loc[3])
+
+        with pytest.raises(ValueError):
+            Model(4, self.dir_parameters, population=population)
+
+    @pytest.mark.filterwarnings("ignore:Given sim_size")
+    @pytest.mark.parametrize("output_format", ["csv", "npz"])
+    @patch("comma.model.Hypothesis.get_positive_cases")
+    def test_resume(self, mock_positive_cases, output_format, tmp_path):
+        # test that a simulation interrupted after a checkpoint and resumed
+        # gives the same output as a simulation that wasn't interrupted
+        steps = 6
+        mock_positive_cases.return_value = pd.Series([1000] * steps)
+        lockdown_pattern = ["easy", "easy", "easy", "hard", "hard", "hard"]
+        expected_path = tmp_path / f"expected.{output_format}"
+        out_path = tmp_path / f"out.{output_format}"
+        checkpoint = tmp_path / "checkpoint.npz"
+
+        expected = Model(20, self.dir_parameters, seed=self.seed, vectorized=True)
+        expected.run(
+            steps, lockdown_pattern, expected_path, output_format=output_format
+        )
+
+        model = Model(20, self.dir_parameters, seed=self.seed, vectorized=True)
+        update = model.update
+
+        def interrupted_update(lockdown, step):
+            if step == 5:
+                raise KeyboardInterrupt
+            update(lockdown, step)
+
+        with patch.object(model, "update", side_effect=interrupted_update):
+            with pytest.raises(KeyboardInterrupt):
+                model.run(
+                    steps,
+                    lockdown_pattern,
+                    out_path,
+                    output_format=output_format,
+                    chunk_rows=30,
+                    checkpoint_path=checkpoint,
+                    checkpoint_every=2,
+                )
+
+        # the checkpoint holds the last step only, the features are apart
+        with np.load(checkpoint) as data:
+            assert "features" not in data.files
+            assert all(
+                data[name].ndim == 1 for name in data.files if "history/" in name
+            )
+        assert (tmp_path / "checkpoint.npz.features.npy").exists()
+
+        resumed = Model.resume(checkpoint)
+
+        assert resumed.current_step == steps
+        if output_format == "csv":
+            assert np.array_equal(resumed.history.mh, expected.history.mh)
+        else:
+            # the steps before the checkpoint are read back as float32
+            assert np.allclose(resumed.history.mh, expected.history.mh, atol=1e-6)
+            assert np.array_equal(resumed.history.mh[3:], expected.history.mh[3:])
+        pd.testing.assert_frame_equal(
+            read_results(out_path, output_format),
+            read_results(expected_path, output_format),
+        )
+        if output_format == "csv":
+            assert out_path.read_bytes() == expected_path.read_bytes()
+
+    def test_checkpoint_format(self, tmp_path):
+        model = Model(20, self.dir_parameters, seed=self.seed, vectorized=True)
+        with pytest.raises(ValueError):
+            model.run(
+                2,
+                ["easy", "hard"],
+                tmp_path / "out.parquet",
+                output_format="parquet",
+                checkpoint_path=tmp_path / "checkpoint.npz",
+            )
+
+    @pytest.mark.filterwarnings("ignore:Given sim_size")
+    @patch("comma.model.Hypothesis.get_positive_cases")
+    def test_fork(self, mock_positive_cases, tmp_path):
+        # test that branches continue the prefix of a simulation, with
+        # their own reproducible random numbers
+        mock_positive_cases.side_effect = lambda *args: pd.Series([1000] * 4)
+        prefix = ["easy", "easy"]
+
+        def run_branches(name):
+            model = Model(20, self.dir_parameters, seed=self.seed, vectorized=True)
+            model.run(2, prefix, tmp_path / f"{name}_prefix.csv")
+            branches = model.fork(2)
+            for i, branch in enumerate(branches):
+                branch.run(4, prefix + ["hard", "hard"], tmp_path / f"{name}_{i}.csv")
+            return model, branches
+
+        model, branches = run_branches("a")
+        run_branches("b")
+
+        assert np.shares_memory(
+            branches[0].population.features, model.population.features
+        )
+        assert model.current_step == 2, "the model itself is not changed"
+        prefix_output = read_results(tmp_path / "a_prefix.csv")
+        outputs = [read_results(tmp_path / f"a_{i}.csv") for i in range(2)]
+        for output in outputs:
+            assert list(output["step_id"].unique()) == [0, 1, 2, 3]
+            pd.testing.assert_frame_equal(output[output["step_id"] < 2], prefix_output)
+        assert not outputs[0].equals(outputs[1])
+        for i in range(2):
+            assert (tmp_path / f"a_{i}.csv").read_text() == (
+                tmp_path / f"b_{i}.csv"
+            ).read_text()
+
+        with pytest.raises(ValueError):
+            model.fork(1)[0].run(4, ["hard"] * 4, tmp_path / "wrong.csv")
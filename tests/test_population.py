@@ -0,0 +1,182 @@
+from comma.hypothesis import Hypothesis
+from comma.individual import Individual
+from comma.model import Model
+from comma.population import Population, cached_population, recovery_probability
+import numpy as np
+import os
+import pytest
+from scipy.stats import gamma
+from unittest.mock import patch
+
+
+class TestPopulation:
+    @pytest.fixture
+    def dir_params(self):
+        return "parameters/"
+
+    @pytest.fixture
+    def seed(self):
+        return np.random.SeedSequence(0)
+
+    def test_populate(self, dir_params, seed):
+        """
+        The feature matrix has one row per agent, one column
+        per feature, and holds the one-hot encoded features
+        """
+        size = 100
+        population = Population.populate(
+            size, dir_params, rng=np.random.default_rng(seed)
+        )
+
+        assert population.features.shape == (size, len(Population.feature_names))
+        assert np.all(population.features[:, 0] == 1), "baseline should be 1"
+        assert np.all((population.features == 0) | (population.features == 1))
+        assert population.covid_status.shape == (size,)
+        assert population.chosen_actions.shape == (size, len(Population.actions))
+
+    def test_populate_matches_individuals(self, dir_params, seed):
+        """
+        Individual.populate builds the same features as Population.populate
+        """
+        population = Population.populate(10, dir_params, np.random.default_rng(seed))
+        agents = Individual.populate(10, dir_params, np.random.default_rng(seed))
+
+        for i, agent in enumerate(agents):
+            assert np.all(agent.get_features().to_numpy() == population.features[i])
+
+    def test_agents_share_state(self, dir_params, seed):
+        """
+        Changing an agent's state changes the population arrays, and vice versa
+        """
+        population = Population.populate(3, dir_params, np.random.default_rng(seed))
+        agents = Individual.from_population(population, dir_params)
+
+        agents[1].covid_status = 1
+        agents[1].days_since_positive = 1
+        assert list(population.covid_status) == [0, 1, 0]
+        assert population.days_since_positive[1] == 1
+
+        population.status[2] = 0.5
+        assert agents[2].get_status() == 0.5
+
+    def test_wrong_shape(self):
+        with pytest.raises(ValueError):
+            Population(np.ones((2, 3)))
+
+    def test_choose_actions_matches_individuals(self, dir_params, seed):
+        """
+        The batched choice of actions gives the same actions as
+        choosing them agent by agent with the same random generator
+        """
+        lockdown = Hypothesis.read_hypotheses(dir_params, {"easy"}, "lockdown")
+        lockdown = lockdown["easy"]
+        population = Population.populate(50, dir_params, np.random.default_rng(1))
+        agents = Individual.populate(50, dir_params, np.random.default_rng(1))
+
+        population.choose_actions_on_lockdown(lockdown, np.random.default_rng(seed))
+        rng = np.random.default_rng(seed)
+        for agent in agents:
+            agent.choose_actions_on_lockdown(lockdown, rng=rng)
+
+        expected = np.array([agent.chosen_actions for agent in agents])
+        assert np.array_equal(population.chosen_actions, expected)
+
+    def test_take_actions_matches_individuals(self, dir_params, seed):
+        """
+        The batched effect of the actions on mental health is the same
+        as the effect computed agent by agent
+        """
+        action_effects = Hypothesis.read_hypotheses(dir_params, {"hard"}, "actions")
+        action_effects = action_effects["hard"]
+        population = Population.populate(50, dir_params, np.random.default_rng(seed))
+        agents = Individual.from_population(population, dir_params)
+        population.chosen_actions[:] = np.random.default_rng(2).random((50, 9)) < 0.5
+
+        population.take_actions(action_effects)
+        actual = population.status.copy()
+        for agent in agents:
+            agent.take_actions(action_effects)
+
+        assert np.allclose(actual, population.status)
+
+    def test_recovery_probability(self):
+        """
+        The recovery tables match the gamma cumulative distribution functions
+        """
+        n_days = np.array([1, 11, 30, 100, 365])
+        standard = recovery_probability(n_days, np.zeros(5, dtype=int))
+        long_covid = recovery_probability(n_days, np.ones(5, dtype=int))
+
+        assert np.allclose(standard, gamma.cdf(n_days, a=5, scale=3))
+        assert np.allclose(long_covid, gamma.cdf(n_days, a=7, scale=10))
+        assert recovery_probability(np.array([1000]), np.array([1])) == pytest.approx(1)
+
+    def test_get_recovered(self, dir_params, seed):
+        """
+        Only positive agents that tested positive more than 10 days ago recover
+        """
+        population = Population.populate(1000, dir_params, np.random.default_rng(seed))
+        population.covid_status[:600] = 1
+        population.days_since_positive[:300] = 5
+        population.days_since_positive[300:600] = 60
+
+        recovered = population.get_recovered(np.random.default_rng(seed))
+
+        assert np.all((recovered >= 300) & (recovered < 600))
+        assert len(recovered) > 150
+
+    def test_from_codes(self):
+        """
+        Each agent gets a one in the column of its category, unknown
+        categories are left out
+        """
+        codes = {"gender": np.array([0, 1, 1]), "bmi": np.array([2, 0, 1])}
+        categories = {"gender": ["M", "F"], "bmi": ["Obese", "unknown", "other"]}
+        population = Population.from_codes(codes, categories, lowercase=True)
+        frame = population.to_frame()
+
+        assert list(frame["baseline"]) == [1, 1, 1]
+        assert list(frame["gender_m"]) == [1, 0, 0]
+        assert list(frame["gender_f"]) == [0, 1, 1]
+        assert list(frame["bmi_obese"]) == [0, 1, 0]
+        assert list(frame["bmi_unknown"]) == [0, 0, 1]
+        assert population.features.sum() == 3 + 3 + 2
+
+    def test_cached_population(self, dir_params, tmp_path):
+        """
+        The second time, the population is loaded from the cache,
+        memory-mapped, and the random generator continues from where
+        it was after creating the population
+        """
+        rng = np.random.default_rng(3)
+        population = cached_population(50, dir_params, 3, rng, cache_dir=tmp_path)
+        expected = rng.random(5)
+
+        rng = np.random.default_rng(3)
+        with patch.object(Population, "populate") as populate:
+            cached = cached_population(50, dir_params, 3, rng, cache_dir=tmp_path)
+        populate.assert_not_called()
+        assert not cached.features.flags.writeable, "should be memory-mapped"
+        assert np.array_equal(cached.features, population.features)
+        assert np.array_equal(rng.random(5), expected)
+
+    def test_cached_population_keys(self, dir_params, tmp_path):
+        """
+        Populations of a different size or seed get their own entry,
+        populations without a seed are not cached
+        """
+        for size, seed in [(10, 0), (20, 0), (10, 1), (10, None)]:
+            rng = np.random.default_rng(seed)
+            cached_population(size, dir_params, seed, rng, cache_dir=tmp_path)
+
+        assert len(os.listdir(tmp_path)) == 3
+
+    def test_model_cache_population(self, dir_params):
+        """
+        A model with a cached population is the same as one without
+        """
+        model = Model(20, dir_params, seed=4)
+        for _ in range(2):
+            cached = Model(20, dir_params, seed=4, cache_population=True)
+            assert np.array_equal(cached.population.features, model.population.features)
+            assert cached.rng.bit_generator.state == model.rng.bit_generator.state
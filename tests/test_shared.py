@@ -0,0 +1,55 @@
+from comma.model import Model
+from comma.population import Population
+from comma.shared import SharedArrays, attach_hypotheses, share_hypotheses
+import numpy as np
+import os
+import pickle
+import pytest
+
+
+class TestSharedArrays:
+    @pytest.fixture
+    def arrays(self):
+        return {"features": np.ones((1000, 43)), "codes": np.arange(1000)}
+
+    def test_shared_arrays(self, arrays, tmp_path):
+        """
+        The arrays are mapped read-only, and only their folder is pickled
+        """
+        with SharedArrays(arrays, dir=tmp_path) as shared:
+            copy = pickle.loads(pickle.dumps(shared))
+            for name, array in arrays.items():
+                assert np.array_equal(copy[name], array)
+                assert isinstance(copy[name], np.memmap)
+                assert not copy[name].flags.writeable
+            assert "codes" in copy and "other" not in copy
+            assert len(pickle.dumps(shared)) < arrays["features"].nbytes
+            with pytest.raises(KeyError):
+                shared["other"]
+
+        assert not os.path.exists(shared.path), "files should be removed"
+
+    def test_population_attached(self, tmp_path):
+        """
+        A population built on a shared feature matrix doesn't copy it
+        """
+        population = Population.populate(10, "parameters/", np.random.default_rng(0))
+        with SharedArrays({"features": population.features}, dir=tmp_path) as shared:
+            features = shared["features"]
+            attached = Population(features)
+
+            assert np.shares_memory(attached.features, features)
+            assert np.array_equal(attached.features, population.features)
+
+    def test_hypotheses(self, tmp_path):
+        """
+        The matrices of the hypotheses are the same once shared
+        """
+        hypotheses = Model.read_hypotheses("parameters/", ["easy", "hard"])
+        with SharedArrays(share_hypotheses(hypotheses), dir=tmp_path) as shared:
+            attached = attach_hypotheses(shared, ["easy", "hard", "easy"])
+
+            assert set(attached) == {"easy", "hard"}
+            for lockdown, matrices in hypotheses.items():
+                for matrix, array in zip(matrices, attached[lockdown]):
+                    assert np.array_equal(np.asarray(matrix), array)
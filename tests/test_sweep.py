@@ -0,0 +1,130 @@
+from comma.sweep import Scenario, read_sweep, run_sweep
+from comma.writer import read_results
+import numpy as np
+import os
+import pandas as pd
+import pytest
+import shutil
+from unittest.mock import patch
+
+
+@pytest.mark.filterwarnings("ignore:Given sim_size")
+@patch("comma.model.Hypothesis.get_positive_cases")
+class TestSweep:
+    dir_params = "parameters/"
+
+    @pytest.fixture
+    def scenarios(self):
+        return {
+            "late": ["easy", "easy", "easy", "hard"],
+            "early": ["easy", "easy", "hard", "hard"],
+        }
+
+    def test_sweep(self, mock_positive_cases, scenarios, tmp_path):
+        """
+        The scenarios simulate the same population with the same random
+        numbers, so they only differ after their policies do
+        """
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        path = run_sweep(scenarios, 20, self.dir_params, tmp_path, seed=0, workers=1)
+        results = read_sweep(tmp_path)
+
+        # one file for all the scenarios
+        assert os.listdir(tmp_path) == ["sweep.csv"]
+        assert results.equals(read_results(path))
+        assert mock_positive_cases.call_count == 1, "cases should be read once"
+        assert list(results["scenario"].unique()) == ["late", "early"]
+        late, early = [
+            results[results["scenario"] == name].set_index(["step_id", "agent_id"])
+            for name in ["late", "early"]
+        ]
+        mh = "cumulative_mental_health"
+        assert late.loc[[0, 1], mh].equals(early.loc[[0, 1], mh])
+        assert not late.loc[2, mh].equals(early.loc[2, mh])
+        assert list(read_sweep(tmp_path, ["early"])["scenario"].unique()) == ["early"]
+
+    def test_reproducible(self, mock_positive_cases, scenarios, tmp_path):
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        run_sweep(scenarios, 20, self.dir_params, tmp_path / "a", seed=1, workers=1)
+        run_sweep(scenarios, 20, self.dir_params, tmp_path / "b", seed=1, workers=2)
+
+        pd.testing.assert_frame_equal(
+            read_sweep(tmp_path / "a"), read_sweep(tmp_path / "b")
+        )
+
+    def test_npz(self, mock_positive_cases, scenarios, tmp_path):
+        """
+        In binary formats too, the scenarios are chunks of one file
+        """
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        path = run_sweep(
+            scenarios, 20, self.dir_params, tmp_path, seed=0, output_format="npz"
+        )
+        assert os.listdir(tmp_path) == ["sweep.npz"]
+        with np.load(path) as archive:
+            assert sorted(name for name in archive.files if "scenario/" in name) == [
+                "scenario/0",
+                "scenario/1",
+            ]
+        pd.testing.assert_frame_equal(
+            read_sweep(tmp_path, ["early"]),
+            read_sweep(tmp_path).query("scenario == 'early'").reset_index(drop=True),
+        )
+
+    def test_parameters_folder(self, mock_positive_cases, tmp_path):
+        """
+        A scenario can read its hypotheses from another parameters folder
+        """
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000, 4000])
+        other_params = tmp_path / "other"
+        shutil.copytree(self.dir_params, other_params)
+        fpath = other_params / "actions_effects_on_mh_easy.csv"
+        effects = pd.read_csv(fpath)
+        numeric = effects.columns[1:]
+        effects[numeric] = effects[numeric] * 2
+        effects.to_csv(fpath, index=False)
+
+        policy = ["easy"] * 4
+        scenarios = [
+            Scenario("base", policy),
+            Scenario("doubled", policy, dir_params=str(other_params)),
+        ]
+        run_sweep(scenarios, 20, self.dir_params, tmp_path / "out", seed=0, workers=1)
+        results = read_sweep(tmp_path / "out")
+
+        base, doubled = [
+            results.loc[results["scenario"] == name, "delta_mental_health"]
+            for name in ["base", "doubled"]
+        ]
+        assert np.allclose(doubled.to_numpy(), 2 * base.to_numpy())
+
+    def test_lockdown_of_another_folder(self, mock_positive_cases, tmp_path):
+        """
+        A scenario can use a lockdown that only its own folder defines,
+        whatever the order of the scenarios
+        """
+        mock_positive_cases.return_value = pd.Series([1000, 2000, 3000])
+        other_params = tmp_path / "other"
+        shutil.copytree(self.dir_params, other_params)
+        for name in ["lockdown", "actions_effects_on_mh"]:
+            shutil.copy(
+                other_params / f"{name}_hard.csv", other_params / f"{name}_medium.csv"
+            )
+
+        scenarios = [
+            Scenario("medium", ["easy", "medium", "medium"], str(other_params)),
+            Scenario("easy", ["easy"] * 3),
+        ]
+        run_sweep(scenarios, 20, self.dir_params, tmp_path / "out", seed=0, workers=1)
+        results = read_sweep(tmp_path / "out")
+        medium = results[results["scenario"] == "medium"]
+        assert list(medium.groupby("step_id")["lockdown"].first()) == [
+            "easy",
+            "medium",
+            "medium",
+        ]
+
+    def test_unique_names(self, mock_positive_cases, tmp_path):
+        scenarios = [Scenario("a", ["easy", "hard"]), Scenario("a", ["hard", "easy"])]
+        with pytest.raises(ValueError):
+            run_sweep(scenarios, 20, self.dir_params, tmp_path)
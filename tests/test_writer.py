@@ -0,0 +1,83 @@
+from comma.writer import CsvWriter, get_writer, read_results
+import numpy as np
+import pandas as pd
+import pytest
+
+
+class TestWriter:
+    @pytest.fixture
+    def blocks(self):
+        return [
+            pd.DataFrame(
+                {
+                    "step_id": [step, step],
+                    "lockdown": ["easy", "easy"],
+                    "agent_id": [0, 1],
+                    "cumulative_mental_health": [0.5 * step, 1.25 * step],
+                }
+            )
+            for step in range(3)
+        ]
+
+    def test_csv_writer(self, tmp_path, blocks):
+        # blocks written in chunks give the same file as writing them at once
+        expected_path = tmp_path / "expected.csv"
+        actual_path = tmp_path / "actual.csv"
+        pd.concat(blocks, ignore_index=True).to_csv(
+            expected_path, index=False, sep=";", decimal=","
+        )
+
+        with CsvWriter(actual_path, chunk_rows=3) as writer:
+            for block in blocks:
+                writer.write(block)
+            # the first two blocks are on disk already
+            assert len(pd.read_csv(actual_path, sep=";", decimal=",")) == 4
+
+        assert actual_path.read_text() == expected_path.read_text()
+
+    @pytest.mark.parametrize("output_format", ["parquet", "feather", "npz"])
+    def test_binary_writers(self, tmp_path, blocks, output_format):
+        # what is written in chunks is read back with compact types
+        if output_format != "npz":
+            pytest.importorskip("pyarrow")
+        blocks[2]["lockdown"] = "hard"
+        out_path = tmp_path / f"results.{output_format}"
+
+        with get_writer(out_path, output_format, chunk_rows=3) as writer:
+            for block in blocks:
+                writer.write(block)
+
+        actual = read_results(out_path, output_format)
+        expected = pd.concat(blocks, ignore_index=True)
+
+        assert list(actual.columns) == list(expected.columns)
+        assert list(actual["lockdown"]) == list(expected["lockdown"])
+        assert list(actual["step_id"]) == list(expected["step_id"])
+        assert actual["cumulative_mental_health"].dtype == np.float32
+        assert np.allclose(
+            actual["cumulative_mental_health"], expected["cumulative_mental_health"]
+        )
+
+    def test_unknown_format(self, tmp_path):
+        with pytest.raises(ValueError):
+            get_writer(tmp_path / "results.xlsx", "xlsx")
+
+    @pytest.mark.parametrize("output_format", ["csv", "npz"])
+    def test_resume(self, tmp_path, blocks, output_format):
+        # rows written after a checkpoint are dropped when resuming
+        path = tmp_path / f"out.{output_format}"
+        with get_writer(path, output_format, chunk_rows=100) as writer:
+            writer.write(blocks[0])
+            state = writer.checkpoint()
+            writer.write(blocks[1])
+
+        with get_writer(path, output_format, chunk_rows=100, state=state) as writer:
+            writer.write(blocks[2])
+
+        actual = read_results(path, output_format)
+        assert list(actual["step_id"]) == [0, 0, 2, 2]
+
+    def test_resume_not_supported(self, tmp_path):
+        pytest.importorskip("pyarrow")
+        with pytest.raises(ValueError):
+            get_writer(tmp_path / "out.parquet", "parquet", state={})